@@ -0,0 +1,247 @@
+"""Runs a whole deploy against the local stand-ins in benchmarks/fakes.py so the deploy time can be
+measured without making anything real. Every main.py step is timed and the calls each fake got,
+the bytes moved and the peak memory of the deployer are reported for every step.
+
+The delays make the fakes take about as long as Digital Ocean and docker do, with the defaults a
+deploy takes about as long as its polling and the parallel steps allow.
+
+Run it from the ctf_k8 folder:
+    python benchmarks/deploy.py --challenges 20 --provision 5 --build 0.5 --push 0.5
+    python benchmarks/deploy.py --repeat --json results.json
+    python benchmarks/deploy.py --instanced 2 --teams 50
+    python benchmarks/deploy.py --builder kaniko
+    python benchmarks/deploy.py --destroy --teardown 5
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+import requests
+import yaml
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+from python import tracing
+
+# The fakes in the order they are reported
+services = ['do', 'spaces', 'kube', 'docker', 'cf', 'ctfd']
+
+def workspace(urls, challenges, size, instanced=0, builder='docker', files='ctfd'):
+    """Makes a folder with settings that point at the fakes and some challeneges to deploy
+
+    Args:
+        urls (dict): The url of every fake
+        challenges (int): The amount of challeneges to make
+        size (int): The size in KB of the file in every challeneges deploy folder
+        instanced (int, optional): How many of the challeneges are instanced. Defaults to 0.
+        builder (str, optional): The build backend. Defaults to 'docker'.
+        files (str, optional): Where the files of challeneges are uploaded, ctfd or spaces. Defaults to 'ctfd'.
+
+    Returns:
+        (str): The path of the folder
+    """
+    path = tempfile.mkdtemp(prefix='ctf-k8-deploy-')
+    shutil.copytree(os.path.join(root, 'templates'), os.path.join(path, 'templates'))
+
+    # Points every client at its fake
+    with open(os.path.join(root, 'settings_example.yaml')) as f:
+        settings = yaml.safe_load(f)
+    settings['infra']['api-url'] = f'{urls["do"]}/v2'
+    settings['infra']['storage']['endpoint'] = urls['spaces']
+    settings['infra']['reconcile'] = True
+    settings['infra']['builder']['type'] = builder
+    settings['dns']['api-url'] = f'{urls["cf"]}/client/v4'
+    settings['ctfd']['url'] = urls['ctfd']
+    settings['ctfd']['files'] = files
+    with open(os.path.join(path, 'settings.yaml'), 'w') as f:
+        f.write(yaml.dump(settings))
+
+    # Makes the challeneges, every one has its own context so nothing is cached between them
+    for count in range(challenges):
+        folder = os.path.join(path, f'challeneges/bench{count}')
+        os.makedirs(os.path.join(folder, 'deploy'))
+        with open(os.path.join(folder, 'chal.yaml'), 'w') as f:
+            f.write(f"name: bench{count}\nneeds-deployed: true\nliveCommand: 'true'\ndocker-port: 80\ninstanced: {str(count < instanced).lower()}\n"
+                f"category: bench\nvalue: 100\nflags: ['flag{{bench{count}}}']\nhints: ['look closer']\nfiles: [deploy/data]\n")
+        with open(os.path.join(folder, 'deploy/Dockerfile'), 'w') as f:
+            f.write(f'FROM scratch\nCOPY data /data{count}\n')
+        with open(os.path.join(folder, 'deploy/data'), 'wb') as f:
+            f.write(os.urandom(size * 1024))
+    return path
+
+def startFakes(args):
+    """Starts the fakes in their own process so they dont count towards the time or memory of the deployer
+
+    Args:
+        args (argparse.Namespace): The delays
+
+    Returns:
+        (tuple): The process and the url of every fake
+    """
+    command = [sys.executable, os.path.join(root, 'benchmarks/fakes.py')]
+    for delay in ['provision', 'lb', 'ingress', 'build', 'push', 'pod', 'ctfd', 'teardown']:
+        command += [f'--{delay}', str(getattr(args, delay))]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    return process, json.loads(process.stdout.readline())
+
+def phase(name, func, urls, trace, verbose):
+    """Runs a step of the deploy and measures it
+
+    Args:
+        name (str): The name of the step
+        func (function): The step
+        urls (dict): The url of every fake
+        trace (bool): Also measures the peak python memory of the step with tracemalloc
+        verbose (bool): Shows what the step prints
+
+    Returns:
+        (dict): The time, calls, bytes and memory of the step
+    """
+    for url in urls.values():
+        requests.post(f'{url}/_bench/reset')
+    if trace:
+        tracemalloc.reset_peak() if hasattr(tracemalloc, 'reset_peak') else tracemalloc.clear_traces()
+
+    # Runs the step and keeps what it prints unless verbose is set
+    output = io.StringIO()
+    error = None
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(sys.stdout if verbose else output), contextlib.redirect_stderr(sys.stderr if verbose else output):
+        try:
+            with tracing.trace(f'benchmark.{name}'):
+                func()
+        except Exception as e:
+            error = f'{type(e).__name__}: {e}'
+    took = time.perf_counter() - start
+
+    result = {
+        'phase': name,
+        'seconds': took,
+        'error': error,
+        'services': {service: requests.get(f'{urls[service]}/_bench').json() for service in services},
+        # ru_maxrss is in KB on linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+    if trace:
+        result['peak_python_mb'] = tracemalloc.get_traced_memory()[1] / 1048576
+    if error and not verbose:
+        print(output.getvalue(), end='', file=sys.stderr)
+    return result
+
+def report(results, trace):
+    """Prints a table of the results
+
+    Args:
+        results (list): The result of every step
+        trace (bool): The python memory was measured
+    """
+    header = f'{"phase":<20}  {"time":>8}  ' + '  '.join(f'{service:>7}' for service in services) + f'  {"KB in/out":>14}  {"peak rss":>9}'
+    if trace:
+        header += f'  {"peak py":>8}'
+    print(header)
+    for result in results:
+        stats = result['services']
+        moved = f'{sum(s["received"] for s in stats.values()) // 1024}/{sum(s["sent"] for s in stats.values()) // 1024}'
+        line = f'{result["phase"]:<20}  {result["seconds"]:7.2f}s  ' + '  '.join(f'{stats[service]["total"]:>7}' for service in services)
+        line += f'  {moved:>14}  {result["peak_rss_mb"]:7.1f}MB'
+        if trace:
+            line += f'  {result["peak_python_mb"]:6.1f}MB'
+        if result['error']:
+            line += f'  failed: {result["error"]}'
+        print(line)
+    print(f'{"total":<20}  {sum(result["seconds"] for result in results):7.2f}s')
+
+    # Shows the resources that would still be billed after a destroy
+    if results and results[-1]['phase'] == 'destroy':
+        stats = results[-1]['services']
+        print('left behind: ' + ', '.join(f'{service} {stats[service]["live"]}' for service in services if service in ('do', 'spaces', 'cf')))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--challenges', type=int, default=10, help='Challeneges to deploy')
+    parser.add_argument('--context-kb', type=int, default=64, help='Size of the file in every challeneges deploy folder')
+    parser.add_argument('--provision', type=float, default=3, help='Seconds clusters and databases take to be ready')
+    parser.add_argument('--lb', type=float, default=2, help='Seconds a load balancer takes to get an ip')
+    parser.add_argument('--ingress', type=float, default=2, help='Seconds the ingress takes to get an ip')
+    parser.add_argument('--build', type=float, default=0.5, help='Seconds an image build takes')
+    parser.add_argument('--push', type=float, default=0.5, help='Seconds an image push takes')
+    parser.add_argument('--pod', type=float, default=1, help='Seconds the pods of a deployment take to be ready')
+    parser.add_argument('--ctfd', type=float, default=0.02, help='Seconds every CTFd API call takes')
+    parser.add_argument('--teardown', type=float, default=2, help='Seconds a deleted resource takes to be gone')
+    parser.add_argument('--instanced', type=int, default=0, help='How many of the challeneges are instanced')
+    parser.add_argument('--teams', type=int, default=0, help='Teams that start an instance of every instanced challenege, then they are all reaped')
+    parser.add_argument('--builder', default='docker', choices=['docker', 'kaniko'], help='Builds with the docker fake or with Jobs in the Kubernetes fake')
+    parser.add_argument('--files', default='ctfd', choices=['ctfd', 'spaces'], help='Uploads the files of challeneges to the CTFd fake or to the Spaces fake')
+    parser.add_argument('--repeat', action='store_true', help='Deploys the frontend, challeneges and lb and syncs CTFd again to measure a redeploy')
+    parser.add_argument('--destroy', action='store_true', help='Destroys everything at the end and shows what was left behind')
+    parser.add_argument('--tracemalloc', action='store_true', help='Also measures the peak python memory of each step, this slows the deploy down')
+    parser.add_argument('--json', help='Writes the results to a file so runs can be compared')
+    parser.add_argument('--trace', help='Traces the deploy and writes the trace to this file, see main.py --trace')
+    parser.add_argument('--verbose', action='store_true', help='Shows what the deployer prints')
+    args = parser.parse_args()
+
+    process, urls = startFakes(args)
+    path = workspace(urls, args.challenges, args.context_kb, args.instanced, args.builder, args.files)
+    cwd = os.getcwd()
+    try:
+        # The deployer runs in this process from the workspace like it would from ctf_k8
+        os.chdir(path)
+        os.environ['DOCKER_HOST'] = urls['docker'].replace('http://', 'tcp://')
+        warnings.simplefilter('ignore', PendingDeprecationWarning)
+        import main as deployer
+        if args.trace:
+            tracing.install()
+
+        steps = [('infra', deployer.deployInfra), ('frontend', deployer.deployFrontEnd), ('challenges', deployer.deployChallenges), ('lb', deployer.deployLB), ('ctfd', deployer.syncCTFd)]
+        if args.teams and args.instanced:
+            def startInstances():
+                from python.instancer import instancer
+                instances = instancer()
+                for team in range(args.teams):
+                    for chal in range(min(args.instanced, args.challenges)):
+                        instances.start(f'team{team}', f'bench{chal}')
+
+            def reapInstances():
+                from python.instancer import instancer
+                instancer().reap(now=time.time() + 86400)
+
+            steps += [('start instances', startInstances), ('reap instances', reapInstances)]
+        if args.repeat:
+            steps += [('redeploy frontend', deployer.deployFrontEnd), ('redeploy challenges', deployer.deployChallenges), ('redeploy lb', deployer.deployLB), ('resync ctfd', deployer.syncCTFd)]
+        if args.destroy:
+            steps += [('destroy', lambda: deployer.destroy(yes=True))]
+
+        if args.tracemalloc:
+            tracemalloc.start()
+        results = []
+        for name, func in steps:
+            results.append(phase(name, func, urls, args.tracemalloc, args.verbose))
+            if results[-1]['error']:
+                break
+
+        report(results, args.tracemalloc)
+        if args.trace:
+            tracing.export(os.path.join(cwd, args.trace))
+            tracing.summary()
+        if args.json:
+            with open(os.path.join(cwd, args.json), 'w') as f:
+                f.write(json.dumps({'settings': vars(args), 'results': results}, indent=2))
+    finally:
+        os.chdir(cwd)
+        process.stdin.close()
+        process.terminate()
+        process.wait()
+        shutil.rmtree(path)
+
+if __name__ == '__main__':
+    main()
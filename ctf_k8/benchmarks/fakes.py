@@ -0,0 +1,1115 @@
+"""Local stand-ins for the Digital Ocean API, Spaces, the Kubernetes API, the docker daemon, the
+Cloudflare API and CTFd. They keep just enough state for the deployer to run end to end, count every call
+and can be given delays so provisioning, builds and pushes take about as long as the real ones.
+
+Every fake also serves GET /_bench with its call counts and the resources it still has, and
+POST /_bench/reset to clear the counts.
+
+Run it on its own to deploy against it by hand, it prints the urls and serves until it is stopped:
+    python benchmarks/fakes.py --provision 5 --build 1
+"""
+import argparse
+import base64
+import hashlib
+import json
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import yaml
+
+
+class fake():
+    """A fake API server, subclasses add their routes in setup
+
+    Varibles:
+        delays (dict): Seconds things take, eg provision, lb, ingress, build, push and teardown
+        routes (list): The (method, pattern, name, func) of every route
+        calls (dict): The amount of calls to every route
+        received (int): The bytes received
+        sent (int): The bytes sent
+        server (ThreadingHTTPServer): The server once it is started
+    """
+
+    delays = None
+    routes = None
+    calls = None
+    received = 0
+    sent = 0
+    server = None
+
+    def __init__(self, delays=None):
+        self.delays = delays or {}
+        self.routes = []
+        self.calls = {}
+        self.lock = threading.RLock()
+        self.setup()
+
+    def setup(self):
+        """Adds the routes of the fake
+        """
+
+    def route(self, method, pattern, func):
+        """Adds a route, named groups in the pattern are passed to the function
+
+        Args:
+            method (str): The HTTP method
+            pattern (str): The regex the whole path has to match
+            func (function): Gets called with the match groups, the query, the body and the request headers and returns the status, the body and optionally headers
+        """
+        name = method + ' ' + re.sub(r'[(][?]P<(\w+)>[^)]*[)]', r'{\1}', pattern)
+        name = name.replace('(?:/v[0-9.]+)?', '').replace('(?:', '[').replace(')?', ']').replace('\\', '')
+        self.routes.append((method, re.compile(pattern), name, func))
+
+    def ready(self, created, delay):
+        """Checks if something made at a time has finished
+
+        Args:
+            created (float): The monotonic time it was made
+            delay (str): The name of the delay it takes
+
+        Returns:
+            (bool): True once the delay has passed
+        """
+        return time.monotonic() >= created + self.delays.get(delay, 0)
+
+    def live(self):
+        """Gets the amount of resources that would still be billed, so a teardown can be checked
+
+        Returns:
+            (int): The amount of resources
+        """
+        return 0
+
+    def stats(self):
+        """Gets the call counts, bytes moved and resources left
+
+        Returns:
+            (dict): The calls to every route, the total calls, the bytes received and sent and the live resources
+        """
+        with self.lock:
+            return {'calls': dict(self.calls), 'total': sum(self.calls.values()), 'received': self.received, 'sent': self.sent, 'live': self.live()}
+
+    def reset(self):
+        """Clears the call counts
+        """
+        with self.lock:
+            self.calls = {}
+            self.received = 0
+            self.sent = 0
+
+    def read(self, request):
+        """Reads the body of a request, plain and chunked bodies are supported
+
+        Args:
+            request (BaseHTTPRequestHandler): The request
+
+        Returns:
+            (bytes): The body
+        """
+        if request.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            body = b''
+            while True:
+                size = int(request.rfile.readline().split(b';')[0].strip() or b'0', 16)
+                if size == 0:
+                    request.rfile.readline()
+                    return body
+                body += request.rfile.read(size)
+                request.rfile.readline()
+        length = int(request.headers.get('Content-Length') or 0)
+        return request.rfile.read(length) if length else b''
+
+    def handle(self, request):
+        """Sends a request to its route and writes the response
+
+        Args:
+            request (BaseHTTPRequestHandler): The request
+        """
+        url = urlsplit(request.path)
+        path = unquote(url.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        body = self.read(request)
+
+        # The benchmark endpoints arent counted
+        if path == '/_bench':
+            return self.respond(request, 200, self.stats())
+        if path == '/_bench/reset':
+            self.reset()
+            return self.respond(request, 204, '')
+
+        for method, pattern, name, func in self.routes:
+            match = pattern.fullmatch(path)
+            if method == request.command and match:
+                with self.lock:
+                    self.calls[name] = self.calls.get(name, 0) + 1
+                    self.received += len(body)
+                return self.respond(request, *func(query=query, body=body, headers=request.headers, **match.groupdict()))
+
+        with self.lock:
+            self.calls[f'{request.command} (unknown)'] = self.calls.get(f'{request.command} (unknown)', 0) + 1
+        print(f'{type(self).__name__}: no route for {request.command} {path}', file=sys.stderr)
+        self.respond(request, 404, {'message': f'no route for {request.command} {path}'})
+
+    def respond(self, request, status, body, headers=None):
+        """Writes a response, dicts and lists are sent as json and generators are streamed a json line at a time
+
+        Args:
+            request (BaseHTTPRequestHandler): The request
+            status (int): The status code
+            body (any): The body
+            headers (dict, optional): Extra headers. Defaults to None.
+        """
+        request.send_response(status)
+        for key, value in (headers or {}).items():
+            request.send_header(key, value)
+
+        # Streams are sent chunked so the client sees every line as soon as it is written
+        if hasattr(body, '__next__'):
+            request.send_header('Content-Type', 'application/json')
+            request.send_header('Transfer-Encoding', 'chunked')
+            request.end_headers()
+            try:
+                for item in body:
+                    data = (json.dumps(item) + '\n').encode()
+                    request.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+                    request.wfile.flush()
+                    with self.lock:
+                        self.sent += len(data)
+                request.wfile.write(b'0\r\n\r\n')
+            except (BrokenPipeError, ConnectionResetError):
+                request.close_connection = True
+            return
+
+        if isinstance(body, (dict, list)):
+            data = json.dumps(body).encode()
+            kind = 'application/json'
+        else:
+            data = body.encode() if isinstance(body, str) else body
+            kind = (headers or {}).get('Content-Type', 'text/plain')
+        if not (headers or {}).get('Content-Type'):
+            request.send_header('Content-Type', kind)
+        request.send_header('Content-Length', str(len(data)))
+        request.end_headers()
+        if request.command != 'HEAD':
+            request.wfile.write(data)
+        with self.lock:
+            self.sent += len(data)
+
+    def serve(self, port=0):
+        """Starts the server in a background thread
+
+        Args:
+            port (int, optional): The port to listen on. Defaults to any free port.
+
+        Returns:
+            (str): The url of the server
+        """
+        owner = self
+
+        class handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                owner.handle(self)
+
+            do_POST = do_PUT = do_PATCH = do_DELETE = do_HEAD = do_GET
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+
+def loads(body):
+    """Parses a json body
+
+    Args:
+        body (bytes): The body
+
+    Returns:
+        (any): The parsed body or an empty dict
+    """
+    return json.loads(body) if body else {}
+
+
+class fakeDigitalOcean(fake):
+    """The parts of the Digital Ocean API the deployer uses. Clusters and databases are provisioning
+    for the provision delay and load balancers get their ip after the lb delay. Deleted resources are
+    still found until the teardown delay has passed
+
+    Varibles:
+        kubeUrl (str): The url of the fake Kubernetes API put in the kubeconfig
+        clusters (dict): The clusters keyed by id
+        databases (dict): The databases keyed by id
+        balancers (dict): The load balancers keyed by id
+        registries (dict): The container registry, an account only has one
+    """
+
+    kubeUrl = None
+    clusters = None
+    databases = None
+    balancers = None
+    registries = None
+
+    def setup(self):
+        self.clusters = {}
+        self.databases = {}
+        self.balancers = {}
+        self.registries = {}
+
+        v2 = '/v2'
+        self.route('POST', f'{v2}/kubernetes/clusters', self.createCluster)
+        self.route('GET', f'{v2}/kubernetes/clusters/(?P<id>[^/]+)', self.getCluster)
+        self.route('DELETE', f'{v2}/kubernetes/clusters/(?P<id>[^/]+)/destroy_with_associated_resources/dangerous', lambda id, **kw: self.remove(self.clusters, id, 'cluster'))
+        self.route('GET', f'{v2}/kubernetes/clusters/(?P<id>[^/]+)/kubeconfig', self.getKubeconfig)
+        self.route('POST', f'{v2}/1-clicks/kubernetes', lambda **kw: (200, {'message': 'Successfully kicked off addon job.'}))
+        self.route('POST', f'{v2}/kubernetes/registry', lambda **kw: (204, ''))
+        self.route('POST', f'{v2}/databases', self.createDatabase)
+        self.route('GET', f'{v2}/databases/(?P<id>[^/]+)', self.getDatabase)
+        self.route('DELETE', f'{v2}/databases/(?P<id>[^/]+)', lambda id, **kw: self.remove(self.databases, id, 'database'))
+        self.route('POST', f'{v2}/databases/(?P<id>[^/]+)/users', self.createUser)
+        self.route('GET', f'{v2}/databases/(?P<id>[^/]+)/config', self.getConfig)
+        self.route('PATCH', f'{v2}/databases/(?P<id>[^/]+)/config', self.setConfig)
+        self.route('GET', f'{v2}/databases/(?P<id>[^/]+)/replicas', self.listReplicas)
+        self.route('POST', f'{v2}/databases/(?P<id>[^/]+)/replicas', self.createReplica)
+        self.route('GET', f'{v2}/databases/(?P<id>[^/]+)/replicas/(?P<name>[^/]+)', self.getReplica)
+        self.route('DELETE', f'{v2}/databases/(?P<id>[^/]+)/replicas/(?P<name>[^/]+)', lambda id, name, **kw: self.remove(self.databases.get(id, {}).get('replicas', {}), name, 'replica'))
+        self.route('POST', f'{v2}/registry', self.createRegistry)
+        self.route('GET', f'{v2}/registry', self.getRegistry)
+        self.route('DELETE', f'{v2}/registry', lambda **kw: self.remove(self.registries, 'registry', 'registry'))
+        self.route('GET', f'{v2}/registry/docker-credentials', lambda **kw: (200, {'auths': {'registry.digitalocean.com': {'auth': 'YmVuY2g6YmVuY2g='}}}))
+        self.route('POST', f'{v2}/load_balancers', self.createBalancer)
+        self.route('GET', f'{v2}/load_balancers', self.listBalancers)
+        self.route('GET', f'{v2}/load_balancers/(?P<id>[^/]+)', self.getBalancer)
+        self.route('PUT', f'{v2}/load_balancers/(?P<id>[^/]+)', self.updateBalancer)
+        self.route('DELETE', f'{v2}/load_balancers/(?P<id>[^/]+)', lambda id, **kw: self.remove(self.balancers, id, 'load balancer'))
+        self.route('POST', f'{v2}/load_balancers/(?P<id>[^/]+)/forwarding_rules', self.addRules)
+        self.route('DELETE', f'{v2}/load_balancers/(?P<id>[^/]+)/forwarding_rules', self.removeRules)
+
+    def missing(self, what):
+        return 404, {'id': 'not_found', 'message': f'The {what} could not be found.'}
+
+    def find(self, items, id):
+        """Gets a resource, one that was deleted is dropped once the teardown delay has passed
+
+        Args:
+            items (dict): The resources of one kind
+            id (str): The id of the resource
+
+        Returns:
+            (dict): The resource or None if it is gone
+        """
+        with self.lock:
+            item = items.get(id)
+            if item is not None and 'deleted' in item and self.ready(item['deleted'], 'teardown'):
+                items.pop(id)
+                return None
+            return item
+
+    def remove(self, items, id, what):
+        item = self.find(items, id)
+        if item is None:
+            return self.missing(what)
+        item.setdefault('deleted', time.monotonic())
+        return 204, ''
+
+    def live(self):
+        with self.lock:
+            items = [(self.clusters, id) for id in list(self.clusters)] + [(self.databases, id) for id in list(self.databases)]
+            items += [(database['replicas'], name) for database in list(self.databases.values()) for name in list(database['replicas'])]
+            items += [(self.balancers, id) for id in list(self.balancers)] + [(self.registries, id) for id in list(self.registries)]
+            return sum(1 for collection, id in items if self.find(collection, id) is not None)
+
+    def createCluster(self, body, **kw):
+        data = loads(body)
+        cluster = dict(data, id=str(uuid.uuid4()), created=time.monotonic(), status={'state': 'provisioning'})
+        self.clusters[cluster['id']] = cluster
+        return 201, {'kubernetes_cluster': self.cluster(cluster)}
+
+    def cluster(self, cluster):
+        view = {key: value for key, value in cluster.items() if key not in ('created', 'deleted')}
+        view['status'] = {'state': 'running' if self.ready(cluster['created'], 'provision') else 'provisioning'}
+        if 'deleted' in cluster:
+            view['status'] = {'state': 'deleting'}
+        return view
+
+    def getCluster(self, id, **kw):
+        if self.find(self.clusters, id) is None:
+            return self.missing('cluster')
+        return 200, {'kubernetes_cluster': self.cluster(self.clusters[id])}
+
+    def getKubeconfig(self, id, **kw):
+        config = {
+            'apiVersion': 'v1',
+            'kind': 'Config',
+            'clusters': [{'name': 'fake', 'cluster': {'server': self.kubeUrl}}],
+            'users': [{'name': 'fake', 'user': {'token': 'fake'}}],
+            'contexts': [{'name': 'fake', 'context': {'cluster': 'fake', 'user': 'fake'}}],
+            'current-context': 'fake',
+        }
+        return 200, yaml.dump(config), {'Content-Type': 'application/yaml'}
+
+    def connection(self, engine, host):
+        port = 25061 if engine == 'redis' else 25060
+        uri = f'rediss://default:fake@{host}:{port}' if engine == 'redis' else f'mysql://doadmin:fake@{host}:{port}/defaultdb'
+        return {'uri': uri, 'database': 'defaultdb', 'host': host, 'port': port, 'user': 'doadmin', 'password': 'fake', 'ssl': True}
+
+    def createDatabase(self, body, **kw):
+        data = loads(body)
+        id = str(uuid.uuid4())
+        host = f'{data["name"]}-do-user-1-0.db.ondigitalocean.com'
+        database = dict(data, id=id, created=time.monotonic(), config={}, replicas={},
+            connection=self.connection(data['engine'], host), private_connection=self.connection(data['engine'], f'private-{host}'))
+        self.databases[id] = database
+        return 201, {'database': self.database(database)}
+
+    def database(self, database):
+        view = {key: value for key, value in database.items() if key not in ('created', 'deleted', 'config', 'replicas')}
+        view['status'] = 'online' if self.ready(database['created'], 'provision') else 'creating'
+        if 'deleted' in database:
+            view['status'] = 'decommissioned'
+        return view
+
+    def getDatabase(self, id, **kw):
+        if self.find(self.databases, id) is None:
+            return self.missing('database')
+        return 200, {'database': self.database(self.databases[id])}
+
+    def createUser(self, id, body, **kw):
+        if id not in self.databases:
+            return self.missing('database')
+        data = loads(body)
+        return 201, {'user': dict(data, role='normal', password=uuid.uuid4().hex)}
+
+    def getConfig(self, id, **kw):
+        if id not in self.databases:
+            return self.missing('database')
+        return 200, {'config': self.databases[id]['config']}
+
+    def setConfig(self, id, body, **kw):
+        if id not in self.databases:
+            return self.missing('database')
+        self.databases[id]['config'].update(loads(body).get('config', {}))
+        return 200, ''
+
+    def replica(self, replica):
+        view = {key: value for key, value in replica.items() if key not in ('created', 'deleted')}
+        view['status'] = 'online' if self.ready(replica['created'], 'provision') else 'forking'
+        return view
+
+    def listReplicas(self, id, **kw):
+        if id not in self.databases:
+            return self.missing('database')
+        replicas = self.databases[id]['replicas']
+        return 200, {'replicas': [self.replica(replicas[name]) for name in list(replicas) if self.find(replicas, name) is not None]}
+
+    def createReplica(self, id, body, **kw):
+        if id not in self.databases:
+            return self.missing('database')
+        data = loads(body)
+        host = f'{data["name"]}-do-user-1-0.db.ondigitalocean.com'
+        replica = dict(data, created=time.monotonic(), connection=self.connection('mysql', host), private_connection=self.connection('mysql', f'private-{host}'))
+        self.databases[id]['replicas'][data['name']] = replica
+        return 201, {'replica': self.replica(replica)}
+
+    def getReplica(self, id, name, **kw):
+        replica = self.find(self.databases.get(id, {}).get('replicas', {}), name)
+        if replica is None:
+            return self.missing('replica')
+        return 200, {'replica': self.replica(replica)}
+
+    def createRegistry(self, body, **kw):
+        self.registries['registry'] = {'name': loads(body)['name'], 'storage_usage_bytes': 0, 'region': 'fra1'}
+        return 201, {'registry': self.registries['registry']}
+
+    def getRegistry(self, **kw):
+        registry = self.find(self.registries, 'registry')
+        if registry is None:
+            return self.missing('registry')
+        return 200, {'registry': {key: value for key, value in registry.items() if key != 'deleted'}}
+
+    def createBalancer(self, body, **kw):
+        data = loads(body)
+        balancer = dict(data, id=str(uuid.uuid4()), created=time.monotonic(), forwarding_rules=list(data.get('forwarding_rules', [])))
+        self.balancers[balancer['id']] = balancer
+        return 202, {'load_balancer': self.balancer(balancer)}
+
+    def balancer(self, balancer):
+        view = {key: value for key, value in balancer.items() if key not in ('created', 'deleted')}
+        ready = self.ready(balancer['created'], 'lb')
+        view['ip'] = '203.0.113.20' if ready else ''
+        view['status'] = 'active' if ready else 'new'
+        return view
+
+    def listBalancers(self, query, **kw):
+        page, per_page = int(query.get('page', 1)), int(query.get('per_page', 20))
+        balancers = [self.balancers[id] for id in list(self.balancers) if self.find(self.balancers, id) is not None]
+        items = balancers[(page - 1) * per_page:page * per_page]
+        pages = {'next': f'?page={page + 1}'} if page * per_page < len(balancers) else {}
+        return 200, {'load_balancers': [self.balancer(lb) for lb in items], 'links': {'pages': pages}, 'meta': {'total': len(balancers)}}
+
+    def getBalancer(self, id, **kw):
+        if self.find(self.balancers, id) is None:
+            return self.missing('load balancer')
+        return 200, {'load_balancer': self.balancer(self.balancers[id])}
+
+    def updateBalancer(self, id, body, **kw):
+        if self.find(self.balancers, id) is None:
+            return self.missing('load balancer')
+        self.balancers[id].update(loads(body))
+        return 200, {'load_balancer': self.balancer(self.balancers[id])}
+
+    def addRules(self, id, body, **kw):
+        if id not in self.balancers:
+            return self.missing('load balancer')
+        self.balancers[id]['forwarding_rules'].extend(loads(body).get('forwarding_rules', []))
+        return 204, ''
+
+    def removeRules(self, id, body, **kw):
+        if id not in self.balancers:
+            return self.missing('load balancer')
+        remove = loads(body).get('forwarding_rules', [])
+        self.balancers[id]['forwarding_rules'] = [rule for rule in self.balancers[id]['forwarding_rules'] if rule not in remove]
+        return 204, ''
+
+
+class fakeSpaces(fake):
+    """The S3 calls the deployer makes to Spaces, used with path style addressing
+
+    Varibles:
+        buckets (dict): The ETag of every object keyed by bucket then key
+    """
+
+    buckets = None
+
+    def setup(self):
+        self.buckets = {}
+        self.route('PUT', '/(?P<bucket>[^/]+)/?', self.createBucket)
+        self.route('GET', '/(?P<bucket>[^/]+)/?', self.listObjects)
+        self.route('DELETE', '/(?P<bucket>[^/]+)/?', self.deleteBucket)
+        self.route('POST', '/(?P<bucket>[^/]+)/?', self.deleteObjects)
+        self.route('PUT', '/(?P<bucket>[^/]+)/(?P<key>.+)', self.putObject)
+        self.route('HEAD', '/(?P<bucket>[^/]+)/(?P<key>.+)', self.headObject)
+
+    def createBucket(self, bucket, **kw):
+        self.buckets.setdefault(bucket, {})
+        return 200, '', {'Location': f'/{bucket}'}
+
+    def listObjects(self, bucket, **kw):
+        if bucket not in self.buckets:
+            return 404, '<Error><Code>NoSuchBucket</Code></Error>', {'Content-Type': 'application/xml'}
+        contents = ''.join(f'<Contents><Key>{key}</Key><ETag>"{etag}"</ETag><Size>0</Size></Contents>' for key, etag in self.buckets[bucket].items())
+        body = f'<?xml version="1.0" encoding="UTF-8"?><ListBucketResult><Name>{bucket}</Name><KeyCount>{len(self.buckets[bucket])}</KeyCount><IsTruncated>false</IsTruncated>{contents}</ListBucketResult>'
+        return 200, body, {'Content-Type': 'application/xml'}
+
+    def live(self):
+        return len(self.buckets)
+
+    def deleteBucket(self, bucket, **kw):
+        if bucket not in self.buckets:
+            return 404, '<Error><Code>NoSuchBucket</Code></Error>', {'Content-Type': 'application/xml'}
+        if self.buckets[bucket]:
+            return 409, '<Error><Code>BucketNotEmpty</Code></Error>', {'Content-Type': 'application/xml'}
+        self.buckets.pop(bucket)
+        return 204, ''
+
+    def deleteObjects(self, bucket, body, **kw):
+        # The bulk delete (POST /bucket?delete) is the only POST sent to a bucket
+        for key in re.findall(r'<Key>(.*?)</Key>', body.decode()):
+            self.buckets.get(bucket, {}).pop(key, None)
+        return 200, '<?xml version="1.0" encoding="UTF-8"?><DeleteResult></DeleteResult>', {'Content-Type': 'application/xml'}
+
+    def headObject(self, bucket, key, **kw):
+        etag = self.buckets.get(bucket, {}).get(key)
+        if etag is None:
+            return 404, ''
+        return 200, '', {'ETag': f'"{etag}"'}
+
+    def putObject(self, bucket, key, body, **kw):
+        etag = hashlib.md5(body).hexdigest()
+        self.buckets.setdefault(bucket, {})[key] = etag
+        return 200, '', {'ETag': f'"{etag}"'}
+
+
+class fakeKubernetes(fake):
+    """A Kubernetes API that stores objects of any kind. Ingresses get a load balancer ip after the
+    ingress delay and watches send the change when it happens. Jobs stand in for the kaniko builds,
+    they succeed after the build and push delays and leave a pod with the image digest
+
+    Varibles:
+        objects (dict): Every object keyed by api, namespace, plural and name
+        version (int): The last resourceVersion given out
+    """
+
+    objects = None
+    version = 0
+
+    # Matches /api/v1/namespaces/frontend/services/name, /apis/apps/v1/namespaces/frontend/deployments and /api/v1/namespaces
+    path = r'/(?P<api>api/v1|apis/[^/]+/[^/]+)(?:/namespaces/(?P<ns>[^/]+))?/(?P<plural>[a-z]+)'
+
+    def setup(self):
+        self.objects = {}
+        self.nodePort = 30000
+
+        # One node so the instancer can find an external ip
+        node = {'kind': 'Node', 'apiVersion': 'v1', 'metadata': {'name': 'fake-node', 'labels': {}}, 'spec': {},
+            'status': {'addresses': [{'type': 'InternalIP', 'address': '10.0.0.2'}, {'type': 'ExternalIP', 'address': '203.0.113.30'}]}}
+        self.create(api='api/v1', ns=None, plural='nodes', body=json.dumps(node).encode())
+
+        self.route('POST', self.path, self.create)
+        self.route('GET', self.path, self.list)
+        self.route('GET', f'{self.path}/(?P<name>[^/]+)', self.get)
+        self.route('PATCH', f'{self.path}/(?P<name>[^/]+)', self.patch)
+        self.route('PUT', f'{self.path}/(?P<name>[^/]+)', self.replace)
+        self.route('DELETE', f'{self.path}/(?P<name>[^/]+)', self.delete)
+
+    def status(self, code, reason, message):
+        return code, {'kind': 'Status', 'apiVersion': 'v1', 'status': 'Failure', 'reason': reason, 'message': message, 'code': code}
+
+    def initialStatus(self, obj):
+        # Some kinds have status fields the client requires
+        if obj.get('kind') == 'HorizontalPodAutoscaler':
+            replicas = obj.get('spec', {}).get('minReplicas', 1)
+            return {'currentReplicas': replicas, 'desiredReplicas': replicas}
+        if obj.get('kind') == 'DaemonSet':
+            return {'currentNumberScheduled': 1, 'desiredNumberScheduled': 1, 'numberMisscheduled': 0, 'numberReady': 1}
+        return {}
+
+    def normalize(self, obj):
+        """Stores an object the way the API does, stringData is base64 encoded into data, cpu amounts
+        under requests and limits are given back in millicores and empty env values are dropped
+
+        Args:
+            obj (dict): The object, changed in place
+        """
+        if obj.get('stringData'):
+            data = obj.get('data') or {}
+            for key, value in obj.pop('stringData').items():
+                data[key] = base64.b64encode(str(value).encode()).decode()
+            obj['data'] = data
+
+        def walk(value, quantity=False):
+            if isinstance(value, dict):
+                # Empty env values are left out like every empty field the API gives back
+                if 'name' in value and value.get('value') == '':
+                    value.pop('value')
+                for key, child in value.items():
+                    if quantity and key == 'cpu' and not str(child).endswith('m'):
+                        value[key] = f'{round(float(child) * 1000)}m'
+                    else:
+                        walk(child, key in ('requests', 'limits'))
+            elif isinstance(value, list):
+                for child in value:
+                    walk(child)
+        walk(obj.get('spec'))
+
+    def bump(self, obj):
+        with self.lock:
+            self.version += 1
+            obj['metadata']['resourceVersion'] = str(self.version)
+
+    def view(self, obj):
+        """Gets an object the way the API returns it, an ingress gets its ip once its delay has passed
+
+        Args:
+            obj (dict): The stored object
+
+        Returns:
+            (dict): The object
+        """
+        if obj.get('kind') == 'Ingress' and not obj['status'].get('loadBalancer', {}).get('ingress'):
+            if self.ready(obj['_created'], 'ingress'):
+                obj['status'] = {'loadBalancer': {'ingress': [{'ip': '203.0.113.10'}]}}
+                self.bump(obj)
+
+        # Deployments are ready once their pods have had time to start
+        if obj.get('kind') == 'Deployment' and not obj['status'].get('readyReplicas'):
+            if self.ready(obj['_created'], 'pod'):
+                replicas = obj.get('spec', {}).get('replicas', 1)
+                obj['status'] = {'replicas': replicas, 'readyReplicas': replicas, 'availableReplicas': replicas}
+                self.bump(obj)
+
+        # Build Jobs finish once the image would have been built and pushed
+        if obj.get('kind') == 'Job' and not obj['status'].get('succeeded'):
+            if time.monotonic() >= obj['_created'] + self.delays.get('build', 0) + self.delays.get('push', 0):
+                self.finishJob(obj)
+        return {key: value for key, value in obj.items() if key != '_created'}
+
+    def finishJob(self, job):
+        """Marks a Job as done and makes its pod with the digest kaniko would write as the termination message
+
+        Args:
+            job (dict): The stored Job
+        """
+        name, ns = job['metadata']['name'], job['metadata']['namespace']
+        args = job['spec']['template']['spec']['containers'][0].get('args', [])
+        digest = 'sha256:' + hashlib.sha256(json.dumps(args).encode()).hexdigest()
+        pod = {'kind': 'Pod', 'apiVersion': 'v1', 'metadata': {'name': f'{name}-pod', 'namespace': ns, 'labels': {'job-name': name}},
+            'spec': job['spec']['template']['spec'], 'status': {'phase': 'Succeeded', 'containerStatuses': [{
+                'name': 'kaniko', 'image': '', 'imageID': '', 'ready': False, 'restartCount': 0,
+                'state': {'terminated': {'exitCode': 0, 'reason': 'Completed', 'message': digest}}}]}}
+        with self.lock:
+            pod['_created'] = time.monotonic()
+            self.bump(pod)
+            self.objects[('api/v1', ns, 'pods', pod['metadata']['name'])] = pod
+            job['status'] = {'succeeded': 1, 'conditions': [{'type': 'Complete', 'status': 'True'}]}
+            self.bump(job)
+
+    def create(self, api, ns, plural, body, **kw):
+        obj = loads(body)
+        name = obj['metadata']['name']
+        key = (api, ns, plural, name)
+        with self.lock:
+            if key in self.objects:
+                return self.status(409, 'AlreadyExists', f'{plural} "{name}" already exists')
+            obj['metadata'].update(uid=str(uuid.uuid4()), generation=1, creationTimestamp=datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'))
+            if ns:
+                obj['metadata']['namespace'] = ns
+            obj.setdefault('status', self.initialStatus(obj))
+            self.normalize(obj)
+            if obj.get('kind') == 'Service' and obj.get('spec', {}).get('type') == 'NodePort':
+                for port in obj['spec']['ports']:
+                    if not port.get('nodePort'):
+                        port['nodePort'] = self.nodePort
+                        self.nodePort += 1
+            obj['_created'] = time.monotonic()
+            self.bump(obj)
+            self.objects[key] = obj
+        return 201, self.view(obj)
+
+    def get(self, api, ns, plural, name, **kw):
+        obj = self.objects.get((api, ns, plural, name))
+        if obj is None:
+            return self.status(404, 'NotFound', f'{plural} "{name}" not found')
+        return 200, self.view(obj)
+
+    def labelled(self, obj, selector):
+        # Supports the key=value and key label selectors
+        labels = obj['metadata'].get('labels') or {}
+        for part in filter(None, selector.split(',')):
+            key, _, value = part.partition('=')
+            if key not in labels or ('=' in part and labels[key] != value):
+                return False
+        return True
+
+    def matching(self, api, ns, plural, query):
+        selector = dict(part.split('=', 1) for part in query.get('fieldSelector', '').split(',') if '=' in part)
+        for (a, n, p, name), obj in list(self.objects.items()):
+            if a == api and p == plural and (ns is None or n == ns) and selector.get('metadata.name', name) == name and self.labelled(obj, query.get('labelSelector', '')):
+                yield obj
+
+    def list(self, api, ns, plural, query, **kw):
+        if query.get('watch') in ('true', '1', 'True'):
+            return 200, self.watch(api, ns, plural, query)
+        items = [self.view(obj) for obj in self.matching(api, ns, plural, query)]
+        return 200, {'kind': 'List', 'apiVersion': 'v1', 'metadata': {'resourceVersion': str(self.version)}, 'items': items}
+
+    def watch(self, api, ns, plural, query):
+        """Streams the changes to the matching objects until the watch times out
+
+        Args:
+            api (str): The api path
+            ns (str): The namespace
+            plural (str): The plural name of the kind
+            query (dict): The query, resourceVersion, timeoutSeconds and fieldSelector are used
+
+        Yields:
+            (dict): The watch events
+        """
+        since = int(query.get('resourceVersion') or 0)
+        deadline = time.monotonic() + min(int(query.get('timeoutSeconds') or 60), 60)
+        seen = {}
+        while time.monotonic() < deadline:
+            for obj in self.matching(api, ns, plural, query):
+                view = self.view(obj)
+                version = int(view['metadata']['resourceVersion'])
+                key = view['metadata']['name']
+                if version > max(since, seen.get(key, 0)):
+                    seen[key] = version
+                    yield {'type': 'MODIFIED', 'object': view}
+            time.sleep(0.05)
+
+    def merge(self, live, patch):
+        for key, value in patch.items():
+            if isinstance(value, dict) and isinstance(live.get(key), dict):
+                self.merge(live[key], value)
+            elif value is None:
+                live.pop(key, None)
+            else:
+                live[key] = value
+
+    def patch(self, api, ns, plural, name, body, **kw):
+        obj = self.objects.get((api, ns, plural, name))
+        if obj is None:
+            return self.status(404, 'NotFound', f'{plural} "{name}" not found')
+        with self.lock:
+            # A resourceVersion in the patch makes it fail if the object changed since it was read
+            patch = loads(body)
+            version = patch.get('metadata', {}).pop('resourceVersion', None)
+            if version is not None and version != obj['metadata']['resourceVersion']:
+                return self.status(409, 'Conflict', 'the object has been modified')
+            self.merge(obj, patch)
+            self.normalize(obj)
+            obj['metadata']['generation'] = obj['metadata'].get('generation', 1) + 1
+            self.bump(obj)
+        return 200, self.view(obj)
+
+    def replace(self, api, ns, plural, name, body, **kw):
+        obj = self.objects.get((api, ns, plural, name))
+        if obj is None:
+            return self.status(404, 'NotFound', f'{plural} "{name}" not found')
+        with self.lock:
+            new = loads(body)
+            new['metadata'] = dict(obj['metadata'], **new.get('metadata', {}))
+            new['_created'] = obj['_created']
+            new.setdefault('status', obj.get('status', {}))
+            self.normalize(new)
+            self.bump(new)
+            self.objects[(api, ns, plural, name)] = new
+        return 200, self.view(new)
+
+    def delete(self, api, ns, plural, name, **kw):
+        obj = self.objects.pop((api, ns, plural, name), None)
+        if obj is None:
+            return self.status(404, 'NotFound', f'{plural} "{name}" not found')
+        # Services return the deleted object and everything else returns a Status
+        if obj.get('kind') == 'Service':
+            return 200, self.view(obj)
+        return 200, {'kind': 'Status', 'apiVersion': 'v1', 'status': 'Success', 'details': {'name': name, 'kind': plural}}
+
+
+class fakeDocker(fake):
+    """A docker daemon that builds and pushes instantly apart from the build and push delays. A build
+    of a context it has already built skips the build delay like the layer cache would
+
+    Varibles:
+        images (dict): The id of every built image keyed by tag and by short id
+        built (set): The hashes of every context that was built
+    """
+
+    images = None
+    built = None
+
+    version = r'(?:/v[0-9.]+)?'
+
+    def setup(self):
+        self.images = {}
+        self.built = set()
+        self.route('GET', '/_ping', lambda **kw: (200, 'OK'))
+        self.route('HEAD', '/_ping', lambda **kw: (200, 'OK'))
+        self.route('GET', f'{self.version}/version', lambda **kw: (200, {'ApiVersion': '1.43', 'MinAPIVersion': '1.12', 'Version': '24.0.0', 'Os': 'linux', 'Arch': 'amd64'}))
+        self.route('POST', f'{self.version}/auth', lambda **kw: (200, {'Status': 'Login Succeeded', 'IdentityToken': ''}))
+        self.route('POST', f'{self.version}/build', self.build)
+        self.route('GET', f'{self.version}/images/(?P<name>.+)/json', self.inspect)
+        self.route('POST', f'{self.version}/images/(?P<name>.+)/push', self.push)
+
+    def build(self, query, body, **kw):
+        context = hashlib.sha256(body).hexdigest()
+        id = hashlib.sha256(f'{context}{query.get("t")}'.encode()).hexdigest()
+        cached = context in self.built
+        self.built.add(context)
+        self.images[query.get('t')] = id
+        self.images[id[:12]] = id
+
+        def stream():
+            yield {'stream': 'Step 1/1 : FROM scratch\n'}
+            if not cached:
+                time.sleep(self.delays.get('build', 0))
+            yield {'aux': {'ID': f'sha256:{id}'}}
+            yield {'stream': f'Successfully built {id[:12]}\n'}
+            yield {'stream': f'Successfully tagged {query.get("t")}:latest\n'}
+        return 200, stream()
+
+    def inspect(self, name, **kw):
+        id = self.images.get(name) or self.images.get(name.split(':')[0])
+        if id is None:
+            return 404, {'message': f'No such image: {name}'}
+        return 200, {'Id': f'sha256:{id}', 'RepoTags': [tag for tag, value in self.images.items() if value == id and '/' in (tag or '')]}
+
+    def push(self, name, query, **kw):
+        id = self.images.get(name)
+        if id is None:
+            return 404, {'message': f'An image does not exist locally with the tag: {name}'}
+
+        def stream():
+            yield {'status': f'The push refers to repository [{name}]'}
+            time.sleep(self.delays.get('push', 0))
+            yield {'status': f'{query.get("tag", "latest")}: digest: sha256:{id} size: 528'}
+            yield {'progressDetail': {}, 'aux': {'Tag': query.get('tag', 'latest'), 'Digest': f'sha256:{id}', 'Size': 528}}
+        return 200, stream()
+
+
+class fakeCloudflare(fake):
+    """The Cloudflare zone and DNS record endpoints, any zone that is looked up exists
+
+    Varibles:
+        zones (dict): The zones keyed by name
+        records (dict): The records of every zone keyed by zone id then record id
+    """
+
+    zones = None
+    records = None
+
+    def setup(self):
+        self.zones = {}
+        self.records = {}
+        v4 = '/client/v4'
+        self.route('GET', f'{v4}/zones', self.getZones)
+        self.route('GET', f'{v4}/zones/(?P<zone>[^/]+)/dns_records', self.listRecords)
+        self.route('POST', f'{v4}/zones/(?P<zone>[^/]+)/dns_records', self.createRecord)
+        self.route('PUT', f'{v4}/zones/(?P<zone>[^/]+)/dns_records/(?P<id>[^/]+)', self.updateRecord)
+        self.route('DELETE', f'{v4}/zones/(?P<zone>[^/]+)/dns_records/(?P<id>[^/]+)', self.deleteRecord)
+
+    def live(self):
+        return sum(len(records) for records in self.records.values())
+
+    def result(self, result, info=None):
+        body = {'success': True, 'errors': [], 'messages': [], 'result': result}
+        if info:
+            body['result_info'] = info
+        return 200, body
+
+    def getZones(self, query, **kw):
+        name = query.get('name')
+        if name and name not in self.zones:
+            self.zones[name] = {'id': uuid.uuid4().hex, 'name': name, 'status': 'active'}
+            self.records[self.zones[name]['id']] = {}
+        zones = [zone for zone in self.zones.values() if name in (None, zone['name'])]
+        return self.result(zones, {'page': 1, 'per_page': 20, 'count': len(zones), 'total_count': len(zones)})
+
+    def listRecords(self, zone, query, **kw):
+        page, per_page = int(query.get('page', 1)), int(query.get('per_page', 100))
+        records = list(self.records.get(zone, {}).values())
+        items = records[(page - 1) * per_page:page * per_page]
+        return self.result(items, {'page': page, 'per_page': per_page, 'count': len(items), 'total_count': len(records)})
+
+    def createRecord(self, zone, body, **kw):
+        record = dict(loads(body), id=uuid.uuid4().hex, zone_id=zone)
+        record.setdefault('ttl', 1)
+        record.setdefault('proxied', False)
+        self.records.setdefault(zone, {})[record['id']] = record
+        return self.result(record)
+
+    def updateRecord(self, zone, id, body, **kw):
+        record = dict(loads(body), id=id, zone_id=zone)
+        self.records.setdefault(zone, {})[id] = record
+        return self.result(record)
+
+    def deleteRecord(self, zone, id, **kw):
+        self.records.get(zone, {}).pop(id, None)
+        return self.result({'id': id})
+
+
+class fakeCTFd(fake):
+    """The CTFd setup wizard, login and the admin API calls the sync makes. Pages set a session
+    cookie with a nonce the forms and session API calls have to send back, every API call takes
+    the ctfd delay
+
+    Varibles:
+        admin (dict): The admin made by the setup wizard or None before it is run
+        sessions (dict): The nonce of every session and if it is logged in keyed by its cookie
+        tokens (set): The API tokens that have been made
+        challenges (dict): The challeneges keyed by id
+        children (dict): The flags, hints and files keyed by their id
+        ids (int): The last id given out
+    """
+
+    admin = None
+    sessions = None
+    tokens = None
+    challenges = None
+    children = None
+    ids = 0
+
+    def setup(self):
+        self.sessions = {}
+        self.tokens = set()
+        self.challenges = {}
+        self.children = {}
+        self.route('GET', '/setup', self.getSetup)
+        self.route('POST', '/setup', self.postSetup)
+        self.route('GET', '/login', self.getLogin)
+        self.route('POST', '/login', self.postLogin)
+        self.route('GET', '/', self.index)
+        self.route('POST', '/api/v1/tokens', self.createToken)
+        self.route('GET', '/api/v1/challenges', self.api(self.listChallenges))
+        self.route('POST', '/api/v1/challenges', self.api(self.createChallenge))
+        self.route('PATCH', '/api/v1/challenges/(?P<id>[0-9]+)', self.api(self.updateChallenge))
+        self.route('DELETE', '/api/v1/challenges/(?P<id>[0-9]+)', self.api(self.deleteChallenge))
+        self.route('GET', '/api/v1/challenges/(?P<id>[0-9]+)/(?P<kind>flags|hints|files)', self.api(self.listChildren))
+        self.route('POST', '/api/v1/(?P<kind>flags|hints|files)', self.api(self.createChild))
+        self.route('DELETE', '/api/v1/(?P<kind>flags|hints|files)/(?P<id>[0-9]+)', self.api(self.deleteChild))
+
+    def nextId(self):
+        with self.lock:
+            self.ids += 1
+            return self.ids
+
+    def session(self, headers, login=False):
+        """Gets the session of a request, a new one is made if it doesnt have one or when it logs in
+
+        Args:
+            headers (dict): The request headers
+            login (bool, optional): Makes a new logged in session. Defaults to False.
+
+        Returns:
+            (tuple): The cookie and the session
+        """
+        cookie = re.search(r'session=([0-9a-f]+)', headers.get('Cookie', ''))
+        cookie = cookie.group(1) if cookie else None
+        if login or cookie not in self.sessions:
+            cookie = uuid.uuid4().hex
+            self.sessions[cookie] = {'nonce': uuid.uuid4().hex, 'admin': login}
+        return cookie, self.sessions[cookie]
+
+    def page(self, headers, html, status=200, location=None, login=False):
+        cookie, session = self.session(headers, login)
+        extra = {'Set-Cookie': f'session={cookie}; Path=/', 'Content-Type': 'text/html'}
+        if location:
+            extra['Location'] = location
+        return status, html.replace('NONCE', session['nonce']), extra
+
+    def getSetup(self, headers, **kw):
+        if self.admin is not None:
+            return self.page(headers, '', 302, '/')
+        return self.page(headers, '<form><input id="nonce" name="nonce" type="hidden" value="NONCE"></form>')
+
+    def postSetup(self, headers, body, **kw):
+        form = {key: values[-1] for key, values in parse_qs(body.decode()).items()}
+        if self.admin is not None or form.get('nonce') != self.session(headers)[1]['nonce']:
+            return 403, 'Forbidden'
+        self.admin = {'name': form['name'], 'password': form['password']}
+        return self.page(headers, '', 302, '/', login=True)
+
+    def getLogin(self, headers, **kw):
+        return self.page(headers, '<form><input id="nonce" name="nonce" type="hidden" value="NONCE"></form>')
+
+    def postLogin(self, headers, body, **kw):
+        form = {key: values[-1] for key, values in parse_qs(body.decode()).items()}
+        if form.get('nonce') != self.session(headers)[1]['nonce'] or self.admin != {'name': form.get('name'), 'password': form.get('password')}:
+            return self.page(headers, 'Your username or password is incorrect')
+        return self.page(headers, '', 302, '/', login=True)
+
+    def index(self, headers, **kw):
+        return self.page(headers, "<script>var init = {'urlRoot': \"\", 'csrfNonce': \"NONCE\"}</script>")
+
+    def createToken(self, headers, **kw):
+        cookie, session = self.session(headers)
+        if not session['admin'] or headers.get('CSRF-Token') != session['nonce']:
+            return 403, {'success': False}
+        token = f'ctfd_{uuid.uuid4().hex}'
+        self.tokens.add(token)
+        return 200, {'success': True, 'data': {'id': self.nextId(), 'value': token}}
+
+    def api(self, func):
+        """Wraps an API route so it needs a token and takes the ctfd delay
+        """
+        def call(headers, **kw):
+            if headers.get('Authorization', '').split(' ')[-1] not in self.tokens:
+                return 403, {'success': False, 'message': 'Forbidden'}
+            time.sleep(self.delays.get('ctfd', 0))
+            return func(headers=headers, **kw)
+        return call
+
+    def listChallenges(self, **kw):
+        return 200, {'success': True, 'data': [dict(chal) for chal in self.challenges.values()]}
+
+    def createChallenge(self, body, **kw):
+        chal = dict(loads(body), id=self.nextId())
+        self.challenges[chal['id']] = chal
+        return 200, {'success': True, 'data': chal}
+
+    def updateChallenge(self, id, body, **kw):
+        if int(id) not in self.challenges:
+            return 404, {'success': False}
+        self.challenges[int(id)].update(loads(body))
+        return 200, {'success': True, 'data': self.challenges[int(id)]}
+
+    def deleteChallenge(self, id, **kw):
+        if self.challenges.pop(int(id), None) is None:
+            return 404, {'success': False}
+        for key in [key for key, child in self.children.items() if child['challenge_id'] == int(id)]:
+            self.children.pop(key)
+        return 200, {'success': True}
+
+    def listChildren(self, id, kind, **kw):
+        return 200, {'success': True, 'data': [child for child in self.children.values() if child['challenge_id'] == int(id) and child['kind'] == kind]}
+
+    def createChild(self, kind, body, headers, **kw):
+        if kind == 'files':
+            # Reads the multipart form the file is uploaded in
+            from email.parser import BytesParser
+            message = BytesParser().parsebytes(b'Content-Type: ' + headers['Content-Type'].encode() + b'\r\n\r\n' + body)
+            form = {part.get_param('name', header='content-disposition'): part for part in message.get_payload()}
+            data = form['file'].get_payload(decode=True)
+            child = {'challenge_id': int(form['challenge'].get_payload()), 'type': 'challenge',
+                'location': f"{uuid.uuid4().hex}/{form['file'].get_filename()}", 'sha1sum': hashlib.sha1(data).hexdigest()}
+        else:
+            child = loads(body)
+            child['challenge_id'] = int(child.get('challenge_id') or child['challenge'])
+        child.update(id=self.nextId(), kind=kind)
+        if child['challenge_id'] not in self.challenges:
+            return 404, {'success': False}
+        self.children[child['id']] = child
+        return 200, {'success': True, 'data': child}
+
+    def deleteChild(self, kind, id, **kw):
+        if self.children.pop(int(id), None) is None:
+            return 404, {'success': False}
+        return 200, {'success': True}
+
+
+def start(delays):
+    """Starts every fake
+
+    Args:
+        delays (dict): Seconds things take, provision, lb, ingress, build, push, pod, ctfd and teardown
+
+    Returns:
+        (dict): The fakes and their urls keyed by name
+    """
+    fakes = {
+        'do': fakeDigitalOcean(delays),
+        'spaces': fakeSpaces(delays),
+        'kube': fakeKubernetes(delays),
+        'docker': fakeDocker(delays),
+        'cf': fakeCloudflare(delays),
+        'ctfd': fakeCTFd(delays),
+    }
+    urls = {name: server.serve() for name, server in fakes.items()}
+    fakes['do'].kubeUrl = urls['kube']
+    return fakes, urls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--provision', type=float, default=0, help='Seconds clusters, databases and replicas take to be ready')
+    parser.add_argument('--lb', type=float, default=0, help='Seconds a load balancer takes to get an ip')
+    parser.add_argument('--ingress', type=float, default=0, help='Seconds the ingress takes to get an ip')
+    parser.add_argument('--build', type=float, default=0, help='Seconds an image build takes')
+    parser.add_argument('--push', type=float, default=0, help='Seconds an image push takes')
+    parser.add_argument('--pod', type=float, default=0, help='Seconds the pods of a deployment take to be ready')
+    parser.add_argument('--ctfd', type=float, default=0, help='Seconds every CTFd API call takes')
+    parser.add_argument('--teardown', type=float, default=0, help='Seconds a deleted resource is still found for')
+    args = parser.parse_args()
+
+    fakes, urls = start(vars(args))
+    print(json.dumps(urls), flush=True)
+
+    # Serves until stdin is closed or the process is stopped
+    try:
+        sys.stdin.read()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
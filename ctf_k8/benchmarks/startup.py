@@ -0,0 +1,135 @@
+"""Measures the startup cost of the deployer: how long each module takes to import and how long
+each main.py command takes to get to its first network call. Every run is a fresh python process
+so nothing is cached between runs.
+
+Run it from the ctf_k8 folder:
+    python benchmarks/startup.py --runs 5
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+modules = ['python.digital_ocean', 'python.kube', 'python.cloudflare', 'python.ctfd']
+commands = ['infra', 'frontend', 'challenges', 'lb']
+
+# Imports a module and prints how long it took
+importCode = '''
+import sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+'''
+
+# Runs a main.py command and stops it as soon as it opens its first connection
+commandCode = '''
+import os, runpy, socket, sys, threading, time
+start = time.perf_counter()
+first = threading.Lock()
+def connect(self, *args):
+    # Only the first connection is timed, other threads wait here until the process exits
+    first.acquire()
+    print(time.perf_counter() - start, flush=True)
+    os._exit(0)
+socket.socket.connect = connect
+socket.socket.connect_ex = connect
+socket.getaddrinfo = lambda *args, **kwargs: connect(None)
+sys.path.insert(0, {root!r})
+sys.argv = ['main.py', {command!r}]
+runpy.run_path(os.path.join({root!r}, 'main.py'), run_name='__main__')
+print('no network call was made', file=sys.stderr)
+os._exit(1)
+'''
+
+kubeconfig = {
+    'apiVersion': 'v1',
+    'kind': 'Config',
+    'clusters': [{'name': 'bench', 'cluster': {'server': 'https://127.0.0.1:6443', 'insecure-skip-tls-verify': True}}],
+    'users': [{'name': 'bench', 'user': {'token': 'bench'}}],
+    'contexts': [{'name': 'bench', 'context': {'cluster': 'bench', 'user': 'bench'}}],
+    'current-context': 'bench',
+}
+
+def workspace():
+    """Makes a folder with the settings and the state files the commands need to get to their first call
+
+    Returns:
+        (str): The path of the folder
+    """
+    path = tempfile.mkdtemp(prefix='ctf-k8-startup-')
+    shutil.copy(os.path.join(root, 'settings_example.yaml'), os.path.join(path, 'settings.yaml'))
+    shutil.copytree(os.path.join(root, 'templates'), os.path.join(path, 'templates'))
+    for folder in ['config/do', 'config/frontend', 'config/backend', 'challeneges/bench/deploy']:
+        os.makedirs(os.path.join(path, folder))
+
+    connection = {'user': 'u', 'password': 'p', 'host': '127.0.0.1', 'port': 25060, 'uri': 'rediss://127.0.0.1:25061'}
+    state = {
+        'kube': {'id': 'bench', 'config': kubeconfig},
+        'mysql': {'id': 'bench', 'private_connection': connection},
+        'redis': {'id': 'bench', 'private_connection': connection},
+        'registry': {'registry': {'name': 'ctf-bench'}},
+    }
+    for name, value in state.items():
+        with open(os.path.join(path, f'config/do/{name}.json'), 'w') as f:
+            f.write(json.dumps(value))
+
+    with open(os.path.join(path, 'config/backend/ports.yaml'), 'w') as f:
+        f.write('bench: 30000\n')
+    with open(os.path.join(path, 'challeneges/bench/chal.yaml'), 'w') as f:
+        f.write("name: bench\nneeds-deployed: true\nliveCommand: 'true'\ndocker-port: 80\n")
+    with open(os.path.join(path, 'challeneges/bench/deploy/Dockerfile'), 'w') as f:
+        f.write('FROM scratch\n')
+    return path
+
+def measure(code, cwd, runs):
+    """Runs some code in fresh python processes and gets the times it prints
+
+    Args:
+        code (str): The code to run
+        cwd (str): The folder to run it in
+        runs (int): How many times to run it
+
+    Returns:
+        (list): The time from every run
+    """
+    times = []
+    for _ in range(runs):
+        res = subprocess.run([sys.executable, '-c', code], cwd=cwd, capture_output=True, text=True)
+        if res.returncode != 0:
+            raise RuntimeError(res.stderr.strip().splitlines()[-1] if res.stderr.strip() else 'failed')
+        times.append(float(res.stdout.strip().splitlines()[-1]))
+    return times
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='How many fresh processes to time for each measurement')
+    args = parser.parse_args()
+
+    path = workspace()
+    try:
+        print(f'{"import":<32}  {"median":>8}  {"max":>8}')
+        for module in modules:
+            times = measure(importCode.format(root=root, module=module), path, args.runs)
+            print(f'{module:<32}  {statistics.median(times):7.3f}s  {max(times):7.3f}s')
+
+        print()
+        print(f'{"first network call":<32}  {"median":>8}  {"max":>8}')
+        for command in commands:
+            try:
+                times = measure(commandCode.format(root=root, command=command), path, args.runs)
+            except RuntimeError as e:
+                print(f'{"main.py " + command:<32}  failed: {e}')
+                continue
+            print(f'{"main.py " + command:<32}  {statistics.median(times):7.3f}s  {max(times):7.3f}s')
+    finally:
+        shutil.rmtree(path)
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,118 @@
+import argparse
+import os
+import yaml
 from python.digital_ocean import session
 from python.kube import kube
 from python.cloudflare import cf
 from python.ctfd import ctfd
-import yaml
+from python.state import store
+from python import sizing
+from python import tracing
+from python.instancer import instancer
+
+
+def deployInfra():
+    session().deployInfra()
+
+def deployFrontEnd():
+    kube().deployFrontEnd()
+
+def deployChallenges():
+    kube().createChallenges()
+
+def deployLB():
+    session().syncLB()
+    lb = store.yaml('config/backend/lb.yaml')
+    ip = lb['load_balancer']['ip']
+
+    # Points chal and optionally a subdomain for every challenege at the load balancer
+    records = [{'name': 'chal', 'type': 'A', 'content': ip}]
+    if store.settings().dns.get('challenge-subdomains'):
+        for name in store.yaml('config/backend/ports.yaml') or {}:
+            records.append({'name': f'{name}.chal', 'type': 'A', 'content': ip})
+
+    # Removes the subdomains of challeneges that arent deployed anymore, only records under chal that point at the load balancer are pruned
+    cf().syncRecords(records, prune=lambda record: '.chal.' in record['name'] and record['content'] == ip)
+
+def syncCTFd():
+    ctfd().sync()
+
+def estimate(players, challenges):
+    # Counts the challeneges that run in the cluster if there is a challeneges folder
+    deployed = None
+    if os.path.isdir('challeneges'):
+        deployed = sum(1 for dir in os.listdir('challeneges') if (store.yaml(f'challeneges/{dir}/chal.yaml') or {}).get('needs-deployed'))
+    print(yaml.dump({'infra': sizing.estimate(players, challenges, deployed)}, sort_keys=False))
+
+def runInstancer():
+    instancer().run()
+
+def startInstance(team, challenge):
+    print(yaml.dump(instancer().start(team, challenge), sort_keys=False))
+
+def stopInstance(team, challenge):
+    instancer().stop(team, challenge)
+
+def destroy(yes=False):
+    # Deleting cant be undone so it has to be confirmed unless --yes is passed
+    if not yes:
+        print('This deletes the cluster, databases, registry, storage space, load balancer and DNS records of this CTF')
+        if input('Type destroy to continue: ').strip() != 'destroy':
+            print('Nothing was deleted')
+            return
+    session().destroy()
+
+def deploy():
+    deployInfra()
+    deployFrontEnd()
+    deployChallenges()
+    deployLB()
+    syncCTFd()
 
-s = session()
-k = kube()
-c = cf()
-ctf = ctfd()
 
-s.deployInfra()
-k.deployFrontEnd()
+# Every command that can be run, deploy runs all of the steps in order
+commands = {
+    'deploy': deploy,
+    'infra': deployInfra,
+    'frontend': deployFrontEnd,
+    'challenges': deployChallenges,
+    'lb': deployLB,
+    'ctfd': syncCTFd,
+    'estimate': estimate,
+    'instancer': runInstancer,
+    'start': startInstance,
+    'stop': stopInstance,
+    'destroy': destroy,
+}
 
-k.createChallenges()
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Deploys a CTF to Digital Ocean Kubernetes')
+    parser.add_argument('command', nargs='?', default='deploy', choices=commands, help='What to deploy. Defaults to deploy which runs everything.')
+    parser.add_argument('--players', type=int, default=100, help='Players expected, used by estimate')
+    parser.add_argument('--challenges', type=int, default=20, help='Challeneges in the event, used by estimate')
+    parser.add_argument('--team', help='The team to start or stop an instance for')
+    parser.add_argument('--challenge', help='The instanced challenege to start or stop')
+    parser.add_argument('--yes', action='store_true', help='Destroys without asking first')
+    parser.add_argument('--trace', help='Traces every step and writes the trace to this file, files ending in .otlp.json are written as OpenTelemetry json')
+    parser.add_argument('--trace-format', choices=['json', 'otlp'], help='The format of the trace file. Defaults to the file extension.')
+    args = parser.parse_args()
 
-s.createLB()
-s.waitforLB()
-with open('config/backend/lb.yaml') as f:
-    lb = yaml.load(f.read(), Loader=yaml.CLoader)
-c.createRecord('chal', lb['load_balancer']['ip'])
\ No newline at end of file
+    # Turns on tracing and writes the trace even if the deploy fails
+    if args.trace:
+        tracing.install()
+    try:
+        with tracing.trace(f'main.{args.command}'):
+            if args.command == 'estimate':
+                estimate(args.players, args.challenges)
+            elif args.command in ('start', 'stop'):
+                if not args.team or not args.challenge:
+                    parser.error(f'{args.command} needs --team and --challenge')
+                commands[args.command](args.team, args.challenge)
+            elif args.command == 'destroy':
+                destroy(args.yes)
+            else:
+                commands[args.command]()
+    finally:
+        if args.trace:
+            tracing.export(args.trace, args.trace_format)
+            tracing.summary()
@@ -0,0 +1,222 @@
+import json
+import random
+import string
+import tarfile
+import tempfile
+import threading
+from python import render
+from python.readiness import watch
+from python.tracing import traced
+
+
+def settings(infra):
+    """Gets the build backend settings from infra.builder
+
+    Args:
+        infra (dict): The infra settings
+
+    Returns:
+        (dict): The type, image, timeout, args, resources and namespace
+    """
+    builder = infra.get('builder') or {}
+    return {
+        'type': builder.get('type', 'docker'),
+        'image': builder.get('image', 'gcr.io/kaniko-project/executor:v1.23.2'),
+        'timeout': int(builder.get('timeout', 1800)),
+        'args': list(builder.get('args') or []),
+        'resources': builder.get('resources') or {},
+        'namespace': builder.get('namespace', 'backend'),
+    }
+
+
+@traced
+class dockerBuilder():
+    """Builds the images with the docker daemon on this machine and pushes them from here
+
+    Varibles:
+        kube (kube): The Kubernetes client wrapper, its docker client is used
+    """
+
+    kube = None
+
+    def __init__(self, kube, settings=None):
+        self.kube = kube
+
+    def build(self, build):
+        """Builds the image of a challenege using the layer cache
+
+        Args:
+            build (dict): The name, tag, hash and path of the build context
+        """
+        self.kube.dclient.images.build(path=build['path'], tag=build['tag'])
+
+    def push(self, build):
+        """Pushes the image of a challenege to the container registry
+
+        Args:
+            build (dict): The name, tag, hash and path of the build context
+
+        Returns:
+            (str): The digest of the pushed image or None if the registry didnt send one
+        """
+
+        # Streams the push so errors from the registry are not lost
+        digest = None
+        for line in self.kube.dclient.images.push(build['tag'], tag='latest', stream=True, decode=True):
+            if 'error' in line:
+                raise RuntimeError(f'Pushing {build["tag"]} failed: {line["error"]}')
+            digest = line.get('aux', {}).get('Digest', digest)
+        return digest
+
+
+@traced(skip=('jobName', 'bucket'))
+class kanikoBuilder():
+    """Builds the images in the cluster. The build context of every challenege is uploaded to the
+    storage space and a kaniko Job builds it and pushes it straight to the container registry, so
+    the builds run in parallel on the nodes and nothing is pushed over the connection of this machine
+
+    Varibles:
+        kube (kube): The Kubernetes client wrapper
+        settings (dict): The builder settings
+        space (session): The Digital Ocean session used to upload the build contexts
+        ready (bool): The secret with the registry and space credentials has been made
+    """
+
+    kube = None
+    settings = None
+    space = None
+    ready = False
+
+    def __init__(self, kube, settings):
+        from python.digital_ocean import session
+
+        self.kube = kube
+        self.settings = settings
+        self.space = session()
+        self.lock = threading.Lock()
+
+    def bucket(self):
+        """Gets the storage space made with the registry
+
+        Returns:
+            (str): The name of the bucket
+        """
+        id = self.kube.registry['registry']['name'].split('ctf-')[1]
+        return f'ctf-{id}'
+
+    def jobName(self, build):
+        """Gets a name for the build Job of a challenege, every build gets its own
+
+        Args:
+            build (dict): The name, tag, hash and path of the build context
+
+        Returns:
+            (str): The name, at most 63 long so it can be used in the job-name label
+        """
+        id = ''.join(random.choice(string.ascii_lowercase + string.digits) for i in range(6))
+        return f'ctf-build-{build["name"]}'[:56].rstrip('-') + f'-{id}'
+
+    def prepare(self):
+        """Makes the secret the Jobs use to read the space and push to the registry, only the first call does anything
+        """
+        with self.lock:
+            if self.ready:
+                return
+            storage = self.kube.settings['infra']['storage']
+            values = render.buildValues(
+                registry_auth=json.dumps(self.kube.registry['authJSON']),
+                space_key=storage['spaceKey'],
+                space_secret=storage['spaceSecret'],
+            )
+            self.kube.apply('Secret', render.render('backend/build-secret.yaml', values), self.settings['namespace'])
+            self.ready = True
+
+    def build(self, build):
+        """Uploads the build context of a challenege to the storage space as a tar.gz named after
+        its hash, a context that is already there isnt uploaded again
+
+        Args:
+            build (dict): The name, tag, hash and path of the build context
+        """
+        from botocore.exceptions import ClientError
+
+        key = f'builds/{build["name"]}-{build["hash"]}.tar.gz'
+        build['context'] = f's3://{self.bucket()}/{key}'
+        try:
+            self.space.boto.head_object(Bucket=self.bucket(), Key=key)
+            return
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey', 'NotFound'):
+                raise
+
+        # Spools the archive to disk once it is big so large contexts dont sit in memory
+        with tempfile.SpooledTemporaryFile(max_size=64 * 1024 * 1024) as archive:
+            with tarfile.open(fileobj=archive, mode='w:gz') as tar:
+                tar.add(build['path'], arcname='.')
+            archive.seek(0)
+            self.space.boto.upload_fileobj(archive, self.bucket(), key)
+
+    def push(self, build):
+        """Runs a kaniko Job that builds the uploaded context and pushes the image, kaniko writes the
+        digest to the termination message of the pod so it can be read when the Job is done
+
+        Args:
+            build (dict): The name, tag, hash, path and uploaded context of the build
+
+        Returns:
+            (str): The digest of the pushed image or None if the Job didnt write one
+        """
+        self.prepare()
+        ns = self.settings['namespace']
+        storage = self.kube.settings['infra']['storage']
+        region = storage.get('region', 'nyc3')
+        values = render.buildValues(
+            job=self.jobName(build),
+            context=build['context'],
+            destination=f'{build["tag"]}:latest',
+            image=self.settings['image'],
+            endpoint=storage.get('endpoint', f'https://{region}.digitaloceanspaces.com'),
+            region=region,
+            args=self.settings['args'],
+            resources=self.settings['resources'],
+            timeout=self.settings['timeout'],
+        )
+        self.kube.batch.create_namespaced_job(body=render.render('backend/build.yaml', values), namespace=ns)
+
+        # Waits for the Job to finish or fail
+        def done(job):
+            failed = any(cond.type == 'Failed' and cond.status == 'True' for cond in job.status.conditions or [])
+            return bool(job.status.succeeded) or failed
+        job = watch(self.kube.batch.list_namespaced_job, done, f'build of {build["name"]}', timeout=self.settings['timeout'] + 60,
+            namespace=ns, field_selector=f'metadata.name={values.job}')
+        if not job.status.succeeded:
+            raise RuntimeError(f'Building {build["tag"]} failed, see kubectl logs -n {ns} job/{values.job}')
+
+        # Reads the digest from the pod that finished
+        for pod in self.kube.core.list_namespaced_pod(ns, label_selector=f'job-name={values.job}').items:
+            for status in pod.status.container_statuses or []:
+                terminated = status.state.terminated if status.state else None
+                if terminated is not None and terminated.exit_code == 0 and (terminated.message or '').strip().startswith('sha256:'):
+                    return terminated.message.strip()
+        return None
+
+
+# The build backends that can be picked with infra.builder.type
+backends = {
+    'docker': dockerBuilder,
+    'kaniko': kanikoBuilder,
+}
+
+def create(kube):
+    """Makes the build backend set in the settings
+
+    Args:
+        kube (kube): The Kubernetes client wrapper
+
+    Returns:
+        (dockerBuilder|kanikoBuilder): The build backend
+    """
+    builder = settings(kube.settings['infra'])
+    if builder['type'] not in backends:
+        raise ValueError(f'Unknown builder {builder["type"]}, use ' + ' or '.join(backends))
+    return backends[builder['type']](kube, builder)
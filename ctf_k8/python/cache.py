@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+import threading
+
+
+class buildCache():
+    """Keeps track of which challenege images are already in the container registry so unchanged challeneges are not rebuilt
+
+    Varibles:
+        path (str): The path of the manifest file
+        images (dict): The hash of the deploy folder and the pushed image for every challenege
+    """
+
+    path = None
+    images = None
+
+    def __init__(self, path='config/backend/images.json'):
+        """Loads the manifest if it exists
+
+        Args:
+            path (str, optional): The path of the manifest file. Defaults to 'config/backend/images.json'.
+        """
+        self.path = path
+        self.images = {}
+        self.lock = threading.Lock()
+
+        try:
+            with open(path) as f:
+                self.images = json.loads(f.read())
+        except:
+            pass
+
+    def hashContext(self, path):
+        """Hashes every file in a docker build context, the hash changes if any file is added, removed, renamed or edited
+
+        Args:
+            path (str): The path of the build context
+
+        Returns:
+            (str): The sha256 of the build context
+        """
+        digest = hashlib.sha256()
+
+        # Walks the folder in a fixed order so the hash is the same on every run
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file = os.path.join(root, name)
+                digest.update(os.path.relpath(file, path).replace(os.sep, '/').encode())
+                digest.update(b'\0')
+                digest.update(str(os.stat(file).st_mode & 0o111).encode())
+                with open(file, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                        digest.update(chunk)
+                digest.update(b'\0')
+
+        return digest.hexdigest()
+
+    def get(self, name, context, repo):
+        """Gets the pushed image for a challenege if its build context hasnt changed
+
+        Args:
+            name (str): The name of the challenege
+            context (str): The hash of the build context
+            repo (str): The repository the image should be in
+
+        Returns:
+            (str): The image pinned to its digest or None if it needs to be built
+        """
+        entry = self.images.get(name)
+        if entry and entry['hash'] == context and entry['image'].startswith(f'{repo}@'):
+            return entry['image']
+        return None
+
+    def set(self, name, context, image):
+        """Records the image pushed for a challenege and saves the manifest
+
+        Args:
+            name (str): The name of the challenege
+            context (str): The hash of the build context
+            image (str): The image pinned to its digest
+        """
+        with self.lock:
+            self.images[name] = {'hash': context, 'image': image}
+
+            # Writes to a temp file first so a crash never leaves a half written manifest
+            with open(f'{self.path}.tmp', 'w') as f:
+                f.write(json.dumps(self.images, indent=2, sort_keys=True))
+            os.replace(f'{self.path}.tmp', self.path)
@@ -1,35 +1,176 @@
-import CloudFlare
-import yaml
+from concurrent.futures import ThreadPoolExecutor
+from python.state import store
+from python.tracing import traced, wrap
 
+@traced(skip=('fqdn',))
 class cf():
+    """Manages the DNS records for the CTF in Cloudflare
 
-    session = None
+    Varibles:
+        client (CloudFlare.CloudFlare): The Cloudflare client, it is made the first time it is used
+        zone (dict): The zone for the domain in the settings
+        zones (dict): The zone for every domain looked up keyed by the domain, shared by every instance
+        ingress (str): The ip of the frontend ingress
+    """
+
+    client = None
     zone = None
     ingress = None
+    zones = {}
 
     def __init__(self):
-        with open(r'settings.yaml') as file:
-            self.settings = yaml.load(file.read(), Loader=yaml.FullLoader)
+        self.refresh()
 
-        try:
-            with open('config/do/ingress.txt') as f:
-                self.ingress = f.read()
-        except:
-            pass
+    def refresh(self):
+        self.settings = store.settings()
+        self.ingress = store.text('config/do/ingress.txt')
 
-        self.session = CloudFlare.CloudFlare(token=self.settings['dns']['api_key'])
-        self.getZones()
+    @property
+    def session(self):
+        # The Cloudflare SDK is only imported and the client made the first time it is used
+        if self.client is None:
+            import CloudFlare
+            self.client = CloudFlare.CloudFlare(token=self.settings['dns']['api_key'], base_url=self.settings['dns'].get('api-url'))
+        return self.client
 
     def getZones(self):
-        zones = self.session.zones.get()
-        for zone in zones:
-            if zone['name'] == self.settings['dns']['domain']:
-                self.zone = zone
-    
+        """Gets the zone for the domain, it is only looked up once per domain
+        """
+        domain = self.settings['dns']['domain']
+        if domain not in self.zones:
+            zones = self.session.zones.get(params={'name': domain})
+            for zone in zones:
+                if zone['name'] == domain:
+                    self.zones[domain] = zone
+        self.zone = self.zones.get(domain)
+        if self.zone is None:
+            raise ValueError(f'Could not find a Cloudflare zone for {domain}')
+
+    def fqdn(self, name):
+        """Gets the full name of a record the way Cloudflare returns it
+
+        Args:
+            name (str): The name of the record, @ for the domain itself
+
+        Returns:
+            (str): The full name of the record
+        """
+        domain = self.zone['name']
+        if name in ('@', '', domain):
+            return domain
+        if name.endswith(f'.{domain}'):
+            return name
+        return f'{name}.{domain}'
+
+    def getRecords(self, per_page=100):
+        """Gets every record in the zone a page at a time
+
+        Args:
+            per_page (int, optional): The amount of records in each page. Defaults to 100.
+
+        Returns:
+            (list): All of the records
+        """
+        records = []
+        page = 1
+        while True:
+            result = self.session.zones.dns_records.get(self.zone['id'], params={'page': page, 'per_page': per_page})
+            records.extend(result)
+            if len(result) < per_page:
+                return records
+            page += 1
+
+    def syncRecords(self, records, prune=False, workers=8):
+        """Makes the records in the zone match the records given. The existing records are fetched
+        once and only the creates, updates and deletes that are needed are sent, at the same time
+
+        Args:
+            records (list): The records that should exist, each has a name, type and content and can have a ttl and proxied
+            prune (bool|function, optional): Deletes records of the same types that are not in the list, a function limits it to the existing records it returns True for. Defaults to False.
+            workers (int, optional): The max amount of changes sent at once. Defaults to 8.
+
+        Returns:
+            (dict): The amount of records created, updated, deleted and unchanged
+        """
+        if self.zone is None:
+            self.getZones()
+
+        # Groups the existing records by type and name
+        existing = {}
+        for record in self.getRecords():
+            existing.setdefault((record['type'], record['name']), []).append(record)
+
+        creates, updates, deletes = [], [], []
+        unchanged = 0
+        wanted = set()
+        for record in records:
+            record = dict(record, name=self.fqdn(record['name']))
+            key = (record['type'], record['name'])
+            wanted.add(key)
+            current = existing.get(key, [])
+
+            # Keeps the first existing record and removes any duplicates
+            if not current:
+                creates.append(record)
+                continue
+            deletes.extend(current[1:])
+            if all(current[0].get(field) == value for field, value in record.items()):
+                unchanged += 1
+            else:
+                updates.append((current[0]['id'], record))
+
+        # Removes the records that are no longer wanted
+        if prune:
+            types = {record['type'] for record in records}
+            for key, current in existing.items():
+                if key[0] in types and key not in wanted:
+                    deletes.extend(record for record in current if prune is True or prune(record))
+
+        # Sends all the changes at once
+        zone = self.zone['id']
+        dns = self.session.zones.dns_records
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            calls = [pool.submit(wrap(dns.post), zone, data=record) for record in creates]
+            calls += [pool.submit(wrap(dns.put), zone, id, data=record) for id, record in updates]
+            calls += [pool.submit(wrap(dns.delete), zone, record['id']) for record in deletes]
+            for call in calls:
+                call.result()
+
+        return {'created': len(creates), 'updated': len(updates), 'deleted': len(deletes), 'unchanged': unchanged}
+
+    def deleteRecords(self, names, contents, workers=8):
+        """Deletes the A records with the names given that point at one of the ips given, records with
+        the same name that point somewhere else are left alone
+
+        Args:
+            names (list): The names of the records, @ for the domain itself
+            contents (set): The ips the records have to point at
+            workers (int, optional): The max amount of deletes sent at once. Defaults to 8.
+
+        Returns:
+            (int): The amount of records deleted
+        """
+        if self.zone is None:
+            self.getZones()
+
+        names = {self.fqdn(name) for name in names}
+        deletes = [record for record in self.getRecords() if record['type'] == 'A' and record['name'] in names and record['content'] in contents]
+
+        zone = self.zone['id']
+        dns = self.session.zones.dns_records
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for call in [pool.submit(wrap(dns.delete), zone, record['id']) for record in deletes]:
+                call.result()
+        return len(deletes)
+
     def createRecord(self, domain='@', ip=None):
-        self.__init__()
+        """Creates or updates an A record
+
+        Args:
+            domain (str, optional): The name of the record. Defaults to '@'.
+            ip (str, optional): The ip the record points to. Defaults to the ip of the ingress.
+        """
+        self.refresh()
         if ip == None:
             ip = self.ingress
-        record = {'name':f'{domain}', 'type':'A', 'content':ip}
-        r = self.session.zones.dns_records.post(self.zone['id'], data=record)
-    
\ No newline at end of file
+        self.syncRecords([{'name':f'{domain}', 'type':'A', 'content':ip}])
@@ -1,89 +1,366 @@
-import requests
+import hashlib
+import json
+import os
 import random
+import re
 import string
+import threading
+import requests
 import yaml
+from concurrent.futures import ThreadPoolExecutor
+from python.rest_api import restApi
+from python.ports import portIndex
+from python.readiness import poll
+from python.state import store
+from python.tracing import traced, wrap
 
+
+@traced(skip=('nonce', 'check', 'connection', 'challenges', 'save'))
 class ctfd():
+    """Sets up CTFd and keeps its challeneges the same as the chal.yaml files. The setup wizard is
+    run the first time, then an admin token is made and every call after that goes through the
+    pooled API client. The hash of every challenege that was synced is kept so a sync only sends
+    the challeneges that changed
+
+    A chal.yaml can set description, category, value, state, max-attempts, type, flags, hints, files
+    (paths in the challenege folder, uploaded to CTFd or to the storage space with ctfd.files), connection (eg 'nc {host} {port}') and connection-info for challeneges
+    that arent behind the load balancer as well as what it already sets to deploy
+
+    Varibles:
+        settings (dict): Stores the settings for the deployemnt from settings.yaml
+        url (str): The url of CTFd
+        verify (bool): Checks the TLS cert of CTFd
+        path (str): The file the admin login, token and synced challeneges are kept in
+        state (dict): The admin password, the token and the id and hash of every synced challenege
+        api (restApi): The pooled client for the CTFd API once there is a token
+    """
 
     settings = None
+    url = None
+    verify = None
+    path = None
+    state = None
+    api = None
+
+    def __init__(self, path='config/frontend/ctfd.json'):
+        """Loads the settings and what was synced last time
+
+        Args:
+            path (str, optional): The file the login, token and synced challeneges are kept in. Defaults to 'config/frontend/ctfd.json'.
+        """
+        self.settings = store.settings()
+        self.url = self.settings.ctfd.get('url', f'https://{self.settings.domain}').rstrip('/')
+        self.verify = self.settings.ctfd.get('verify-tls', True)
+        self.path = path
+        self.state = store.read(path, json.loads, {})
+        self.state.setdefault('challenges', {})
+        self.lock = threading.Lock()
 
-    def __init__(self):
-        with open(r'settings.yaml') as file:
-            self.settings = yaml.load(file.read(), Loader=yaml.FullLoader)
+    def save(self):
+        """Writes the login, token and synced challeneges to the state file
+        """
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(f'{self.path}.tmp', 'w') as f:
+                f.write(json.dumps(self.state, indent=2))
+            os.replace(f'{self.path}.tmp', self.path)
+
+    def nonce(self, html):
+        """Gets the CSRF nonce from a CTFd page
+
+        Args:
+            html (str): The page
+
+        Returns:
+            (str): The nonce
+        """
+        match = re.search(r'name="nonce"[^>]*value="([^"]+)"', html) or re.search(r'csrfNonce[\'"]?\s*:\s*"([^"]+)"', html)
+        if match is None:
+            raise RuntimeError(f'Could not find the CSRF nonce on {self.url}')
+        return match.group(1)
+
+    def check(self, res, what, ok=(200,)):
+        """Raises if a CTFd API call failed
+
+        Args:
+            res (requests.Response): The response from CTFd
+            what (str): What the call did, used in the error
+            ok (tuple, optional): The status codes that mean the call worked. Defaults to (200,).
+
+        Returns:
+            (requests.Response): The response
+        """
+        if res.status_code not in ok:
+            raise RuntimeError(f'{what} in CTFd failed with {res.status_code}: {res.text[:200]}')
+        return res
 
     def setup(self):
-        domain = self.settings['domain']
-        name = self.settings['ctf-name']
-        desc = self.settings['ctf-description']
-        if self.settings['mode'].lower() == 'team':
-            mode = 'team_mode'
-        else:
-            mode = 'user_mode'
-        user = 'admin'
-        email = self.settings['admin-email']
-        letters = string.ascii_letters + string.digits + string.punctuation
-        password = ''.join(random.choice(letters) for i in range(15))
-        data = f'''------WebKitFormBoundaryzZ74g4zylE33R6Rf
-                Content-Disposition: form-data; name="ctf_name"
+        """Runs the setup wizard if CTFd hasnt been set up, otherwise logs in as the admin
 
-                {name}
-                ------WebKitFormBoundaryzZ74g4zylE33R6Rf
-                Content-Disposition: form-data; name="ctf_description"
+        Returns:
+            (requests.Session): The logged in session
+        """
+        ctfd = self.settings.ctfd
+        web = requests.Session()
+        web.verify = self.verify
 
-                {desc}
-                ------WebKitFormBoundaryzZ74g4zylE33R6Rf
-                Content-Disposition: form-data; name="{mode}"
+        # Waits for CTFd to answer, it can still be starting after a deploy and its DNS or ingress may not be ready yet
+        def get():
+            try:
+                return web.get(f'{self.url}/setup', allow_redirects=False, timeout=(5, 30))
+            except requests.RequestException:
+                return None
+        res = poll(get, lambda res: res is not None and res.status_code < 500, 'CTFd', timeout=600)
 
-                users
-                ------WebKitFormBoundaryzZ74g4zylE33R6Rf
-                Content-Disposition: form-data; name="name"
+        # The wizard only answers before CTFd is set up, after that it redirects
+        if res.status_code == 200:
+            letters = string.ascii_letters + string.digits
+            self.state['password'] = self.state.get('password') or ''.join(random.SystemRandom().choice(letters) for i in range(24))
+            self.save()
+            data = {
+                'ctf_name': ctfd['ctf-name'],
+                'ctf_description': ctfd.get('ctf-description', ''),
+                'user_mode': 'teams' if ctfd.get('mode', 'team').lower() == 'team' else 'users',
+                'name': 'admin',
+                'email': ctfd['admin-email'],
+                'password': self.state['password'],
+                'ctf_theme': ctfd.get('theme', 'core'),
+                'theme_color': '',
+                'start': '',
+                'end': '',
+                '_submit': 'Finish',
+                'nonce': self.nonce(res.text),
+            }
+            res = web.post(f'{self.url}/setup', data=data, allow_redirects=False, timeout=(5, 30))
+            if res.status_code != 302:
+                raise RuntimeError(f'The CTFd setup failed with {res.status_code}')
+            print(f'CTFd is set up, the admin password is in {self.path}')
+            return web
 
-                {user}
-                ------WebKitFormBoundaryzZ74g4zylE33R6Rf
-                Content-Disposition: form-data; name="email"
+        # Logs in with the password from when it was set up
+        if not self.state.get('password'):
+            raise RuntimeError(f'CTFd is already set up and there is no admin password in {self.path}')
+        res = web.get(f'{self.url}/login', timeout=(5, 30))
+        data = {'name': 'admin', 'password': self.state['password'], 'nonce': self.nonce(res.text)}
+        res = web.post(f'{self.url}/login', data=data, allow_redirects=False, timeout=(5, 30))
+        if res.status_code != 302:
+            raise RuntimeError(f'Logging into CTFd failed with {res.status_code}')
+        return web
 
-                {email}
-                ------WebKitFormBoundaryzZ74g4zylE33R6Rf
-                Content-Disposition: form-data; name="password"
+    def token(self):
+        """Gets the API client, the saved token is used if it still works otherwise a new one is made
 
-                {password}
-                ------WebKitFormBoundaryzZ74g4zylE33R6Rf
-                Content-Disposition: form-data; name="ctf_logo"; filename=""
-                Content-Type: application/octet-stream
+        Returns:
+            (restApi): The client
+        """
+        if self.api is not None:
+            return self.api
 
+        # The saved token is tried first, if it doesnt work one new token is made and tried
+        for made in (False, True):
+            if self.state.get('token'):
+                api = restApi(self.state['token'], url=f'{self.url}/api/v1', scheme='Token', pool=self.settings.ctfd.get('sync-workers', 8), verify=self.verify, rateLimit=False)
+                if api.get('challenges', params={'view': 'admin'}).status_code == 200:
+                    self.api = api
+                    return api
+            if made:
+                raise RuntimeError('The CTFd token that was just made cant list the challeneges, check that the admin user is still an admin')
 
-                ------WebKitFormBoundaryzZ74g4zylE33R6Rf
-                Content-Disposition: form-data; name="ctf_banner"; filename=""
-                Content-Type: application/octet-stream
+            # Makes a token with the logged in session, session calls to the API need the nonce of the session
+            web = self.setup()
+            nonce = self.nonce(web.get(f'{self.url}/', timeout=(5, 30)).text)
+            res = web.post(f'{self.url}/api/v1/tokens', json={'description': 'ctf-k8 sync'}, headers={'CSRF-Token': nonce}, timeout=(5, 30))
+            if res.status_code != 200:
+                raise RuntimeError(f'Making a CTFd token failed with {res.status_code}')
+            self.state['token'] = res.json()['data']['value']
+            self.save()
 
+    def connection(self, chal, ports, host):
+        """Gets how players connect to a challenege from its node port and the load balancer
+
+        Args:
+            chal (dict): The challenege settings
+            ports (portIndex): The node port of every challenege
+            host (str): The load balancer ip
+
+        Returns:
+            (str): The connection info or None if the challenege isnt deployed behind the load balancer
+        """
+        port = ports.ports.get(chal['name'])
+        if not chal.get('needs-deployed') or chal.get('instanced') or port is None or host is None:
+            return chal.get('connection-info')
+        if self.settings.dns.get('challenge-subdomains'):
+            host = f"{chal['name']}.chal.{self.settings.domain}"
+        return chal.get('connection', 'nc {host} {port}').format(host=host, port=port)
+
+    def challenges(self):
+        """Gets every challenege the way it should be in CTFd
+
+        Returns:
+            (dict): The challenege, flags, hints, files and hash keyed by the name of the challenege
+        """
+        ports = portIndex()
+        lb = store.yaml('config/backend/lb.yaml') or {}
+        host = lb.get('load_balancer', {}).get('ip')
+
+        chals = {}
+        for dir in sorted(os.listdir('challeneges')):
+            with open(f'challeneges/{dir}/chal.yaml') as f:
+                chals[dir] = yaml.load(f.read(), Loader=yaml.CLoader)
+
+        # With files set to spaces the files of every challenege are uploaded to the storage space at
+        # once and linked in the description instead of being uploaded to CTFd
+        links = {}
+        if self.settings.ctfd.get('files', 'ctfd') == 'spaces':
+            from python.digital_ocean import session
+
+            paths = [f'challeneges/{dir}/{file}' for dir, chal in chals.items() for file in chal.get('files', [])]
+            if paths:
+                links = session().uploadFiles(paths, workers=self.settings.ctfd.get('sync-workers', 8))
+
+        found = {}
+        for dir, chal in chals.items():
+            challenge = {
+                'name': chal['name'],
+                'category': chal.get('category', ''),
+                'description': chal.get('description', ''),
+                'value': chal.get('value', 100),
+                'state': chal.get('state', 'visible'),
+                'type': chal.get('type', 'standard'),
+                'connection_info': self.connection(chal, ports, host),
+            }
+            if chal.get('max-attempts'):
+                challenge['max_attempts'] = chal['max-attempts']
+            for key in ('initial', 'decay', 'minimum', 'function'):
+                if key in chal:
+                    challenge[key] = chal[key]
+
+            # Flags and hints can be a plain string or a dict with the rest of their fields
+            flags = [flag if isinstance(flag, dict) else {'content': flag} for flag in chal.get('flags', [chal['flag']] if 'flag' in chal else [])]
+            flags = [{'type': flag.get('type', 'static'), 'content': flag['content'], 'data': flag.get('data', '')} for flag in flags]
+            hints = [hint if isinstance(hint, dict) else {'content': hint} for hint in chal.get('hints', [])]
+            hints = [{'content': hint['content'], 'cost': hint.get('cost', 0)} for hint in hints]
+            files = {}
+            for file in chal.get('files', []):
+                path = f'challeneges/{dir}/{file}'
+                if path in links:
+                    challenge['description'] += f'\n\n[{os.path.basename(file)}]({links[path]})'
+                    continue
+                with open(path, 'rb') as f:
+                    files[path] = hashlib.sha1(f.read()).hexdigest()
+
+            item = {'challenge': challenge, 'flags': flags, 'hints': hints, 'files': files}
+            item['hash'] = hashlib.sha256(json.dumps(item, sort_keys=True).encode()).hexdigest()
+            found[chal['name']] = item
+        return found
+
+    def syncChallenge(self, item, id=None):
+        """Creates or updates a challenege and makes its flags, hints and files match
+
+        Args:
+            item (dict): The challenege, flags, hints and files from challenges
+            id (int, optional): The id of the challenege if it is already in CTFd. Defaults to None.
+
+        Returns:
+            (int): The id of the challenege
+        """
+        api = self.token()
+        name = item['challenge']['name']
+        created = id is None
+        if created:
+            res = api.post('challenges', json=item['challenge'])
+        else:
+            res = api.patch(f'challenges/{id}', json=item['challenge'])
+        self.check(res, f'Syncing {name}')
+        id = res.json()['data']['id']
 
-                ------WebKitFormBoundaryzZ74g4zylE33R6Rf
-                Content-Disposition: form-data; name="ctf_small_icon"; filename=""
-                Content-Type: application/octet-stream
+        # Flags and hints are compared by their fields, changed ones are deleted and made again.
+        # A new challenege has none so they arent fetched
+        defaults = {'type': 'static', 'content': '', 'data': '', 'cost': 0}
+        for kind, want in (('flags', item['flags']), ('hints', item['hints'])):
+            fields = ('type', 'content', 'data') if kind == 'flags' else ('content', 'cost')
+            have = [] if created else self.check(api.get(f'challenges/{id}/{kind}'), f'Getting the {kind} of {name}').json().get('data', [])
+            keys = [tuple(entry.get(field) or defaults[field] for field in fields) for entry in want]
+            for entry in have:
+                key = tuple(entry.get(field) or defaults[field] for field in fields)
+                if key in keys:
+                    keys.remove(key)
+                else:
+                    self.check(api.delete(f"{kind}/{entry['id']}"), f'Deleting a {kind[:-1]} of {name}', (200, 404))
+            # Flags take the challenege as challenge and hints as challenge_id, CTFd ignores the other one
+            for key in keys:
+                self.check(api.post(kind, json=dict(zip(fields, key), challenge=id, challenge_id=id)), f'Adding a {kind[:-1]} to {name}')
 
+        # Files are compared by their name and sha1
+        want = {(os.path.basename(path), sha1): path for path, sha1 in item['files'].items()}
+        for entry in [] if created else self.check(api.get(f'challenges/{id}/files'), f'Getting the files of {name}').json().get('data', []):
+            key = (os.path.basename(entry.get('location', '')), entry.get('sha1sum'))
+            if key in want:
+                want.pop(key)
+            else:
+                self.check(api.delete(f"files/{entry['id']}"), f'Deleting a file of {name}', (200, 404))
+        for path in want.values():
+            with open(path, 'rb') as f:
+                res = api.post('files', files={'file': (os.path.basename(path), f)}, data={'challenge': id, 'type': 'challenge'}, headers={'Content-Type': None})
+            self.check(res, f'Uploading {path} to {name}')
+        return id
 
-                ------WebKitFormBoundaryzZ74g4zylE33R6Rf
-                Content-Disposition: form-data; name="ctf_theme"
+    def sync(self, workers=None):
+        """Makes the challeneges in CTFd match the chal.yaml files, challeneges that havent changed since
+        the last sync are skipped and challeneges that were synced before but are gone are deleted
 
-                core
-                ------WebKitFormBoundaryzZ74g4zylE33R6Rf
-                Content-Disposition: form-data; name="theme_color"
+        Args:
+            workers (int, optional): The max amount of challeneges synced at once. Defaults to ctfd.sync-workers in the settings or 8.
 
+        Returns:
+            (dict): The names of the challeneges that were created, updated, unchanged and deleted
+        """
+        workers = workers or self.settings.ctfd.get('sync-workers', 8)
+        api = self.token()
+        want = self.challenges()
 
-                ------WebKitFormBoundaryzZ74g4zylE33R6Rf
-                Content-Disposition: form-data; name="start"
+        # Gets the challeneges already in CTFd, the admin view includes hidden ones
+        existing = {chal['name']: chal['id'] for chal in api.get('challenges', params={'view': 'admin'}).json().get('data', [])}
+        synced = self.state['challenges']
+        result = {'created': [], 'updated': [], 'unchanged': [], 'deleted': []}
 
+        # Gets the challeneges this synced before that dont have a chal.yaml anymore, before any
+        # worker can change synced
+        stale = [name for name in synced if name not in want]
 
-                ------WebKitFormBoundaryzZ74g4zylE33R6Rf
-                Content-Disposition: form-data; name="start"
+        def send(name, item):
+            id = self.syncChallenge(item, existing.get(name))
+            with self.lock:
+                synced[name] = {'id': id, 'hash': item['hash']}
+            return name
 
+        def remove(name):
+            # Only forgets the challenege once CTFd deleted it so a failed delete is tried again next sync
+            if name in existing:
+                res = api.delete(f'challenges/{existing[name]}')
+                self.check(res, f'Deleting {name}', (200, 404))
+            with self.lock:
+                synced.pop(name, None)
+            return name
 
-                ------WebKitFormBoundaryzZ74g4zylE33R6Rf
-                Content-Disposition: form-data; name="_submit"
+        # Syncs the new and changed challeneges and deletes the stale ones at the same time
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            calls = []
+            for name, item in want.items():
+                if name in existing and synced.get(name, {}).get('id') == existing[name] and synced[name].get('hash') == item['hash']:
+                    result['unchanged'].append(name)
+                    continue
+                result['updated' if name in existing else 'created'].append(name)
+                calls.append(pool.submit(wrap(send), name, item))
+            for name in stale:
+                result['deleted'].append(name)
+                calls.append(pool.submit(wrap(remove), name))
 
-                Finish
-                ------WebKitFormBoundaryzZ74g4zylE33R6Rf
-                Content-Disposition: form-data; name="nonce"
+            try:
+                for call in calls:
+                    call.result()
+            finally:
+                self.save()
 
-                9646e277dc25e281cea75364d83d4ffccf732f0e795a077fafd82b7511def93f
-                ------WebKitFormBoundaryzZ74g4zylE33R6Rf--'''
+        print(', '.join(f'{len(names)} {kind}' for kind, names in result.items()) + ' challeneges in CTFd')
+        return result
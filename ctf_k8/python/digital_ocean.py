@@ -1,62 +1,56 @@
-import requests
 import yaml
 import json
-import time
 import random
 import string
-import boto3
 import os
+import hashlib
+import mimetypes
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
 from python.kube import kube
+from python.cloudflare import cf
+from python.tasks import graph
+from python.readiness import poll
+from python.rest_api import restApi
+from python.state import store
+from python.ports import portIndex
+from python import sizing
+from python.tracing import traced, wrap
 
 
+@traced(skip=('spaceEtag',))
 class session():
     """Create the Kubernetes Cluster in Digital Ocean 
 
     Varibles:
-        headers (dict): The headers for all api requests made to Digital Ocean API (includes auth token)
+        api (restApi): The pooled client for all api requests made to Digital Ocean API (includes auth token)
         settings (dict): Stores the settings for the deployemnt from settings.yaml
         kube (dict): Stores the details about the Kubernetes Cluster after its made
         mysql (dict): Stores the details about the MySQL DB after its made
         redis (int): Stores the details about the Redis DB after its made
         registry (int): Stores the about the Container Registry after its made
-        boto (boto3.clinet): Stores the client for the boto3 library boto3 is the aws library and is used for DO Storage spaces
+        boto (boto3.clinet): Stores the client for the boto3 library boto3 is the aws library and is used for DO Storage spaces, it is made the first time it is used
     """    
 
-    headers = None
+    api = None
     settings = None
     kube = None
     mysql = None
     redis = None
     registry = None
-    boto = None
+    s3 = None
     
 
     def __init__(self):
 
         # Read the settings and store them
-        with open(r'settings.yaml') as file:
-            self.settings = yaml.load(file, Loader=yaml.FullLoader)
+        self.settings = store.settings()
         
-        # Checks to see if there is a Kubernetes Cluster already configured
-        try:
-            with open('config/do/kube.json') as f:
-                self.kube = yaml.load(f.read(), Loader=yaml.CLoader)
-        except:
-            pass
-
-        # Checks to see if there is a MySQL DB already configured
-        try:
-            with open('config/do/mysql.json') as f:
-                self.mysql = yaml.load(f.read(), Loader=yaml.CLoader)
-        except:
-            pass
-
-        # Checks to see if there is a Redis DB already configured
-        try:
-            with open('config/do/redis.json') as f:
-                self.redis = yaml.load(f.read(), Loader=yaml.CLoader)
-        except:
-            pass
+        # Checks to see if there is a Kubernetes Cluster, MySQL DB and Redis DB already configured
+        self.kube = store.resource('kube')
+        self.mysql = store.resource('mysql')
+        self.redis = store.resource('redis')
         
         # Creates ther config DIrectory if it doesnt exists
         if not os.path.exists('config'):
@@ -66,46 +60,47 @@ class session():
             os.makedirs('config/do')
 
         # Checks to see if there is a Container Registry already configured
-        try:
-            with open('config/do/registry.json') as f:
-                self.registry = yaml.load(f.read(), Loader=yaml.CLoader)
-        except:
-            pass
+        self.registry = store.resource('registry')
 
-        # Sets the header for all api requests 
+        # Creates the client for all api requests 
         api_key = self.settings['infra']["api_key"]
-        self.headers = {
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {api_key}',
-        }
-
-        # Creates the boto3 client
-        session = boto3.session.Session()
-        self.boto = session.client('s3',
-                        region_name='nyc3',
-                        endpoint_url='https://nyc3.digitaloceanspaces.com',
-                        aws_access_key_id=self.settings['infra']['storage']['spaceKey'],
-                        aws_secret_access_key=self.settings['infra']['storage']['spaceSecret'])
+        self.api = restApi(api_key, url=self.settings['infra'].get('api-url', 'https://api.digitalocean.com/v2'))
+
+    @property
+    def boto(self):
+        # Creates the boto3 client the first time it is used
+        if self.s3 is None:
+            import boto3
+            storage = self.settings['infra']['storage']
+            region = storage.get('region', 'nyc3')
+            session = boto3.session.Session()
+            self.s3 = session.client('s3',
+                            region_name=region,
+                            endpoint_url=storage.get('endpoint', f'https://{region}.digitaloceanspaces.com'),
+                            aws_access_key_id=self.settings['infra']['storage']['spaceKey'],
+                            aws_secret_access_key=self.settings['infra']['storage']['spaceSecret'])
+        return self.s3
     
 
-    def createKube(self, region="tor1", count=1, size=1, scale=True, min_nodes=1, max_nodes=3):
-        """Create the Kubernetes Cluster in Digital Ocean 
+    def createKube(self, region=None, count=None, size=None, scale=None, min_nodes=None, max_nodes=None):
+        """Create the Kubernetes Cluster in Digital Ocean, anything not passed in comes from infra.region and infra.cluster in the settings
 
         Args:
             region (str, optional): The region that it will be deployed in. Defaults to "tor1".
             count (int, optional): The starting amount of nodes proably lleave at 1. Defaults to 1.
-            size (int, optional): the size of the ndoe from 1-3. Defaults to 1.
+            size (any, optional): A droplet size slug or the size of the ndoe from 1-3. Defaults to 1.
             scale (bool, optional): do you want the cluster to autoscale. Defaults to True.
-            min_nodes (int, optional): min nodes if autoscale true. Defaults to 1.
+            min_nodes (int, optional): min nodes if autoscale true. Defaults to the node count.
             max_nodes (int, optional): max nodes if auto scale true. Defaults to 3.
         """        
-        # Getting the node Size Slug
-        if size == 1:
-            size = 's-1vcpu-2gb'
-        elif size == 2:
-            size = 's-2vcpu-2gb'
-        elif size == 3:
-            size = 's-2vcpu-4gb'
+        # Getting the node Size Slug and the rest of the sizing from the settings
+        sizes = sizing.cluster(self.settings['infra'])
+        region = region or sizes['region']
+        count = count or sizes['count']
+        size = sizing.slug(size, sizing.nodeSlugs) if size is not None else sizes['size']
+        scale = sizes['scale'] if scale is None else scale
+        min_nodes = min_nodes or sizes['min_nodes']
+        max_nodes = max_nodes or sizes['max_nodes']
         
         # Creating the Payload for the api request
         data = {
@@ -134,22 +129,31 @@ class session():
         }
 
         # Sends the API request to create the cluster
-        res = requests.post("https://api.digitalocean.com/v2/kubernetes/clusters", json=data, headers=self.headers)
+        res = self.api.post("kubernetes/clusters", json=data)
 
         #Stores the Kubernetes Cluster settings
         self.kube = json.loads(res.text)['kubernetes_cluster']
     
-    def getCluster(self):
+    def getCluster(self, kubeconfig=True):
         """Gets the detail about a cluster including the kubeconfig file
+
+        Args:
+            kubeconfig (bool, optional): Also gets the kubeconfig file. Defaults to True.
+
+        Returns:
+            (dict): The cluster details
         """
 
         # Gets the Cluster details and stores them
-        res = requests.get(f"https://api.digitalocean.com/v2/kubernetes/clusters/{self.kube['id']}", headers=self.headers)
+        res = self.api.get(f"kubernetes/clusters/{self.kube['id']}")
         self.kube = json.loads(res.text)['kubernetes_cluster']
 
         # Gets the kubeconfig file
-        res = requests.get(f"https://api.digitalocean.com/v2/kubernetes/clusters/{self.kube['id']}/kubeconfig", headers=self.headers)
-        self.kube['config'] = yaml.load(res.text, Loader=yaml.CLoader)
+        if kubeconfig:
+            res = self.api.get(f"kubernetes/clusters/{self.kube['id']}/kubeconfig")
+            self.kube['config'] = yaml.load(res.text, Loader=yaml.CLoader)
+
+        return self.kube
     
     def waitForCluster(self):
         """Waits for the cluster to be provisoned then install the nginx controller
@@ -163,43 +167,33 @@ class session():
             "cluster_uuid": self.kube['id']
             }
         
-        # Loops until the cluster is provisioned
-        while True:
-            # Gets the Cluster details
-            self.getCluster()
+        # Waits until the cluster is provisioned
+        poll(lambda: self.getCluster(kubeconfig=False)['status']['state'], lambda state: state != "provisioning", 'Kubernetes cluster')
 
-            # Checks if the cluster is provisioned 
-            if self.kube['status']['state'] != "provisioning":
+        # Gets the kubeconfig now that the cluster is up
+        self.getCluster()
 
-                # Installs Nignx Controller in the cluster
-                res = requests.post('https://api.digitalocean.com/v2/1-clicks/kubernetes', json=data, headers=self.headers)
-                
-                # Writes the config to a file
-                with open('config/do/kube.json', 'w') as f:
-                    f.write(json.dumps(self.kube))
-                break
+        # Installs Nignx Controller in the cluster
+        res = self.api.post('1-clicks/kubernetes', json=data)
 
-            # Waits to check again
-            time.sleep(20)
+        # Writes the config to a file
+        with open('config/do/kube.json', 'w') as f:
+            f.write(json.dumps(self.kube))
 
-    def createMysql(self, region='tor1', size=1, nodes=1):
-        """Creates the MySQL database cluster
+    def createMysql(self, region=None, size=None, nodes=None):
+        """Creates the MySQL database cluster, anything not passed in comes from infra.region and infra.mysql in the settings
 
         Args:
             region (str, optional): The region the cluster will be in. Defaults to 'tor1'.
-            size (int, optional): The size of the db nodes form 1-4. Defaults to 1.
+            size (any, optional): A database size slug or the size of the db nodes form 1-4. Defaults to 1.
             nodes (int, optional): The amount of db nodes. Defaults to 1.
         """
 
         # Selects the DB size slug
-        if size == 1:
-            size = 'db-s-1vcpu-1gb'
-        elif size == 2:
-            size = 'db-s-1vcpu-2gb'
-        elif size == 3:
-            size = 'db-s-2vcpu-4gb'
-        elif size == 4:
-            size = 'db-s-4vcpu-8gb'
+        sizes = sizing.database(self.settings['infra'], 'mysql')
+        region = region or sizes['region']
+        size = sizing.slug(size, sizing.dbSlugs) if size is not None else sizes['size']
+        nodes = nodes or sizes['nodes']
 
         # Create the payload for the api request
         data = {
@@ -215,14 +209,18 @@ class session():
         }
 
         # Call the api and store the response as the mysql details
-        res = requests.post("https://api.digitalocean.com/v2/databases", json=data, headers=self.headers)
+        res = self.api.post("databases", json=data)
         self.mysql = json.loads(res.text)['database']
     
     def getMysql(self):
         """Gets the details of the mysql cluster form the API and stores it
+
+        Returns:
+            (dict): The MySQL DB details
         """        
-        res = requests.get(f"https://api.digitalocean.com/v2/databases/{self.mysql['id']}", headers=self.headers)
+        res = self.api.get(f"databases/{self.mysql['id']}")
         self.mysql = json.loads(res.text)['database']
+        return self.mysql
 
     def waitForMysql(self):
         """Waits for the Mysql cluster to be ready and creates a new user with the older auth plugin for compatability with ctfd
@@ -237,49 +235,62 @@ class session():
             
         }
 
-        # Loops until MySQL DB is provisined 
-        while True:
+        # Waits until MySQL DB is provisined 
+        poll(lambda: self.getMysql()['status'], lambda state: state != "creating", 'MySQL DB')
 
-            # Updates the Mysql details
-            self.getMysql()
+        # Creates the new user in the DB 
+        res = self.api.post(f"databases/{self.mysql['id']}/users", json=data)
+        res = json.loads(res.text)['user']
 
-            # Checks if the DB is provisioned
-            if self.mysql['status'] != "creating":
+        # stores the new credentials in the DB details
+        self.mysql['private_connection']['user'] = res['name']
+        self.mysql['private_connection']['password'] = res['password']
 
-                # Creates the new user in the DB 
-                res = requests.post(f"https://api.digitalocean.com/v2/databases/{self.mysql['id']}/users", json=data, headers=self.headers)
-                res = json.loads(res.text)['user']
+        # Writes the details to a file
+        with open('config/do/mysql.json', 'w') as f:
+            f.write(json.dumps(self.mysql))
 
-                # stores the new credentials in the DB details
-                self.mysql['private_connection']['user'] = res['name']
-                self.mysql['private_connection']['password'] = res['password']
-
-                # Writes the details to a file
-                with open('config/do/mysql.json', 'w') as f:
-                    f.write(json.dumps(self.mysql))
-                break
-
-            # Delay inbetween checking the DB
-            time.sleep(20)
-
-    def createRedis(self, region='tor1', size=1, nodes=1):
-        """Creates the Redis database cluster
+    def createMysqlReplicas(self):
+        """Creates the read replicas of the MySQL DB set in infra.mysql.replicas and waits for them to be online,
+        their details are stored in the MySQL details under replicas
+        """
+        sizes = sizing.database(self.settings['infra'], 'mysql')
+        replicas = []
+
+        # Creates the replicas that dont exist yet
+        existing = self.api.get(f"databases/{self.mysql['id']}/replicas").json().get('replicas', [])
+        names = {replica['name'] for replica in existing}
+        for count in range(sizes['replicas']):
+            name = f'frontend-mysql-replica-{count + 1}'
+            replicas.append(name)
+            if name not in names:
+                data = {'name': name, 'region': sizes['region'], 'size': sizes['size'], 'tags': ['frontend']}
+                self.api.post(f"databases/{self.mysql['id']}/replicas", json=data).raise_for_status()
+
+        # Waits for every replica to be online
+        self.mysql['replicas'] = []
+        for name in replicas:
+            get = lambda: self.api.get(f"databases/{self.mysql['id']}/replicas/{name}").json()['replica']
+            self.mysql['replicas'].append(poll(get, lambda replica: replica['status'] == 'online', f'MySQL replica {name}'))
+
+        # Writes the details to a file
+        with open('config/do/mysql.json', 'w') as f:
+            f.write(json.dumps(self.mysql))
+
+    def createRedis(self, region=None, size=None, nodes=None):
+        """Creates the Redis database cluster, anything not passed in comes from infra.region and infra.redis in the settings
 
         Args:
             region (str, optional): The region the cluster will be in. Defaults to 'tor1'.
-            size (int, optional): The size of the db nodes form 1-4. Defaults to 1.
+            size (any, optional): A database size slug or the size of the db nodes form 1-4. Defaults to 1.
             nodes (int, optional): The amount of db nodes. Defaults to 1.
         """
 
         # Selects the DB size slug
-        if size == 1:
-            size = 'db-s-1vcpu-1gb'
-        elif size == 2:
-            size = 'db-s-1vcpu-2gb'
-        elif size == 3:
-            size = 'db-s-2vcpu-4gb'
-        elif size == 4:
-            size = 'db-s-4vcpu-8gb'
+        sizes = sizing.database(self.settings['infra'], 'redis')
+        region = region or sizes['region']
+        size = sizing.slug(size, sizing.dbSlugs) if size is not None else sizes['size']
+        nodes = nodes or sizes['nodes']
         
         # Create the payload for the api request
         data = {
@@ -295,35 +306,53 @@ class session():
         }
 
         # Call the api and store the response as the Redis details
-        res = requests.post("https://api.digitalocean.com/v2/databases", json=data, headers=self.headers)
+        res = self.api.post("databases", json=data)
         self.redis = json.loads(res.text)['database']
 
     def getRedis(self):
         """Gets the details on the Redis DB CLuster
+
+        Returns:
+            (dict): The Redis DB details
         """
-        res = requests.get(f"https://api.digitalocean.com/v2/databases/{self.redis['id']}", headers=self.headers)
+        res = self.api.get(f"databases/{self.redis['id']}")
         self.redis = json.loads(res.text)['database']
+        return self.redis
 
     def waitForRedis(self):
         """Waits for the Redis DB Cluster to be provisined
         """
 
-        # Loops untill DB is provisoned
-        while True:
+        # Waits untill DB is provisoned
+        poll(lambda: self.getRedis()['status'], lambda state: state != "creating", 'Redis DB')
 
-            # Gets the Redis DB Details
-            self.getRedis()
-            
-            # Checks if the DB is provisined 
-            if self.redis['status'] != "creating":
+        # Writes Redis Detaisl to a file 
+        with open('config/do/redis.json', 'w') as f:
+            f.write(json.dumps(self.redis))
 
-                # Writes Redis Detaisl to a file 
-                with open('config/do/redis.json', 'w') as f:
-                    f.write(json.dumps(self.redis))
-                break
+    def configureRedis(self):
+        """Sets the eviction policy and the idle timeout of the Redis DB Cluster from infra.redis in the
+        settings, anything in infra.redis.config is sent as well. Digital Ocean sets maxmemory from the
+        size of the cluster so it can only be changed by picking a bigger size
 
-            # Delay inbetween checking the DB
-            time.sleep(20)
+        Returns:
+            (dict): The config values that were changed
+        """
+        settings = self.settings['infra'].get('redis') or {}
+        want = {
+            'redis_maxmemory_policy': settings.get('eviction-policy', 'allkeys-lru'),
+            'redis_timeout': settings.get('idle-timeout', 300),
+        }
+        want.update(settings.get('config') or {})
+
+        # Only sends the values that are different
+        res = self.api.get(f"databases/{self.redis['id']}/config")
+        res.raise_for_status()
+        live = res.json().get('config', {})
+        changes = {key: value for key, value in want.items() if live.get(key) != value}
+        if changes:
+            self.api.patch(f"databases/{self.redis['id']}/config", json={'config': changes}).raise_for_status()
+        return changes
 
     def createRegistry(self):
         """Creates a container registry that has a name of ctf-{random string}
@@ -339,7 +368,7 @@ class session():
         }
 
         # Call APi and store details
-        res = requests.post("https://api.digitalocean.com/v2/registry", json=data, headers=self.headers)
+        res = self.api.post("registry", json=data)
         self.registry = json.loads(res.text)
 
     def waitForRegistry(self):
@@ -347,7 +376,7 @@ class session():
         but it does get the docker creds for the registry and write the registry config to a file
         """
         # Calls API to get Registry Docker creds and stores them 
-        res = requests.get('https://api.digitalocean.com/v2/registry/docker-credentials?read_write=true', headers=self.headers)
+        res = self.api.get('registry/docker-credentials?read_write=true')
         self.registry['authJSON'] = json.loads(res.text)
 
         # Writes Registry details to a file
@@ -360,26 +389,106 @@ class session():
         id = self.registry['registry']['name'].split('ctf-')[1]
         self.boto.create_bucket(Bucket=f'ctf-{id}')
 
-    def uploadFile(self, path):
-        """Uploads a file to the storage space
+    def spaceEtag(self, path, threshold, chunk):
+        """Gets the ETag Spaces will give a file so it can be compared with the one already uploaded
 
         Args:
-            path (str): the path of the file that needs to be uloaded
+            path (str): The path of the file
+            threshold (int): The size in bytes where uploads switch to multipart
+            chunk (int): The size in bytes of each part of a multipart upload
 
         Returns:
-            (str): The url opf the file
-        """        
+            (str): The md5 of the file, or the md5 of the part md5s and the part count for multipart uploads
+        """
+        whole = hashlib.md5()
+        parts = []
+        with open(path, 'rb') as f:
+            for data in iter(lambda: f.read(chunk), b''):
+                whole.update(data)
+                parts.append(hashlib.md5(data).digest())
+
+        if os.path.getsize(path) < threshold:
+            return whole.hexdigest()
+        return f'{hashlib.md5(b"".join(parts)).hexdigest()}-{len(parts)}'
+
+    def uploadFiles(self, paths, root='challeneges', workers=8, threshold=16 * 1024 * 1024, chunk=16 * 1024 * 1024, progress=None):
+        """Uploads files to the storage space at the same time, files that are already in the space
+        with the same ETag are skipped and large files are uploaded in parts. Files are stored under
+        files/ with their path from root so two challeneges can have files with the same name
+
+        Args:
+            paths (list): The paths of the files that need to be uploaded
+            root (str, optional): The folder the keys are made relative to, files outside it are stored by their file name. Defaults to 'challeneges'.
+            workers (int, optional): The max amount of files uploaded at once. Defaults to 8.
+            threshold (int, optional): The size in bytes where uploads switch to multipart. Defaults to 16MB.
+            chunk (int, optional): The size in bytes of each part. Defaults to 16MB.
+            progress (function, optional): Gets called with the bytes done and the total bytes as the uploads go. Defaults to printing the progress.
+
+        Returns:
+            (dict): The public url of every file keyed by its path
+        """
+        from boto3.s3.transfer import TransferConfig
 
-        # Gets the file name
-        file = path.split('/')[-1:][0]
-        
         # Gets the ID used for the storage space
         id = self.registry['registry']['name'].split('ctf-')[1]
-        
-        # Uploads the file to the space
-        self.boto.upload_file(path, f'ctf-{id}', file, ExtraArgs={'ACL': 'public-read'})
+        bucket = f'ctf-{id}'
+
+        # Each file is stored under its path from root, eg challeneges/pwn1/handout.zip is files/pwn1/handout.zip
+        keys = {}
+        for path in paths:
+            relative = os.path.relpath(path, root)
+            if relative.startswith('..'):
+                relative = os.path.basename(path)
+            key = 'files/' + relative.replace(os.sep, '/')
+            if key in keys.values():
+                raise ValueError(f'More than one file would be stored as {key}')
+            keys[path] = key
+
+        # Gets the ETag of every file already in the space
+        existing = {}
+        for page in self.boto.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix='files/'):
+            for obj in page.get('Contents', []):
+                existing[obj['Key']] = obj['ETag'].strip('"')
+
+        # Only uploads the files that are new or changed
+        upload = [path for path, key in keys.items() if existing.get(key) != self.spaceEtag(path, threshold, chunk)]
+        total = sum(os.path.getsize(path) for path in upload)
+
+        if progress is None:
+            def progress(done, total):
+                print(f'\ruploaded {done / 1048576:.1f}/{total / 1048576:.1f} MB', end='' if done < total else '\n', flush=True)
+
+        done = [0]
+        lock = threading.Lock()
+        def sent(amount):
+            with lock:
+                done[0] += amount
+                progress(done[0], total)
+
+        config = TransferConfig(multipart_threshold=threshold, multipart_chunksize=chunk, max_concurrency=4, use_threads=True)
+        def send(path):
+            args = {'ACL': 'public-read', 'ContentType': mimetypes.guess_type(path)[0] or 'application/octet-stream'}
+            self.boto.upload_file(path, bucket, keys[path], ExtraArgs=args, Config=config, Callback=sent)
+
+        # Uploads the files at the same time
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for call in [pool.submit(wrap(send), path) for path in upload]:
+                call.result()
+        print(f'{len(upload)} files uploaded, {len(keys) - len(upload)} already in {bucket}')
+
+        region = self.settings['infra']['storage'].get('region', 'nyc3')
+        return {path: f'https://{bucket}.{region}.digitaloceanspaces.com/{quote(key)}' for path, key in keys.items()}
+
+    def uploadFile(self, path):
+        """Uploads a file to the storage space
 
-        return f'https://ctf-{id}.nyc3.digitaloceanspaces.com{file}'
+        Args:
+            path (str): the path of the file that needs to be uloaded
+
+        Returns:
+            (str): The url opf the file
+        """
+        return self.uploadFiles([path])[path]
 
     def connectRegistry(self):
         """Enables integration between the container registry and the kubernetes cluster it also creates namespaces because that needs to be done before connecting
@@ -400,7 +509,33 @@ class session():
         }
 
         # Call the API 
-        res = requests.post('https://api.digitalocean.com/v2/kubernetes/registry', json=data, headers=self.headers)
+        res = self.api.post('kubernetes/registry', json=data)
+
+    def forwardingRules(self):
+        """Gets the forwarding rules the backend load balancer needs, one for the node port of every challenege in the port index
+
+        Returns:
+            (list): The forwarding rules
+        """
+        ports = portIndex().ports
+        return [{'entry_protocol': 'tcp', 'entry_port': port, 'target_protocol': 'tcp', 'target_port': port} for port in sorted(ports.values())]
+
+    def healthCheck(self):
+        """Gets the health check of the backend load balancer, it checks the lowest node port in the port
+        index so it always has a challenege listening on it
+
+        Returns:
+            (dict): The health check
+        """
+        ports = portIndex().ports
+        return {
+            "protocol": "tcp",
+            "port": min(ports.values()) if ports else 30000,
+            "check_interval_seconds": 10,
+            "response_timeout_seconds": 5,
+            "healthy_threshold": 5,
+            "unhealthy_threshold": 3
+        }
 
     def createLB(self):
         """Creates a loadbalancer for the backend services
@@ -408,66 +543,305 @@ class session():
 
         data = {
         "name": "backend-lb",
-        "region": "tor1",
+        "region": self.settings['infra'].get('region', 'tor1'),
         "size": "lb-small",
         "forwarding_rules": [],
-        "health_check": {
-            "protocol": "tcp",
-            "port": 30000,
-            "check_interval_seconds": 10,
-            "response_timeout_seconds": 5,
-            "healthy_threshold": 5,
-            "unhealthy_threshold": 3
-        },
+        "health_check": self.healthCheck(),
         "sticky_sessions": {
             "type": "none"
         },
         "tag": "k8s:worker"
         }
-        with open('config/backend/ports.yaml') as f:
-            ports = yaml.load(f.read(), Loader=yaml.CLoader)
-
-        for _, port in ports.items():
-            data['forwarding_rules'].append({'entry_protocol': 'tcp', 'entry_port': port, 'target_protocol': 'tcp', 'target_port': port})
+        data['forwarding_rules'] = self.forwardingRules()
 
-        res = requests.post('https://api.digitalocean.com/v2/load_balancers', json=data, headers=self.headers)
+        res = self.api.post('load_balancers', json=data)
 
         with open('config/backend/lb.yaml', 'w') as f:
             f.write(yaml.dump(res.json(), Dumper=yaml.CDumper))
 
+    def getLB(self, id):
+        """Gets the details of a load balancer
+
+        Args:
+            id (str): The id of the load balancer
+
+        Returns:
+            (dict): The load balancer details
+        """
+        res = self.api.get(f'load_balancers/{id}')
+        return json.loads(res.text)
+
     def waitforLB(self):
-        with open('config/backend/lb.yaml') as f:
-            lb = yaml.load(f.read(), Loader=yaml.CLoader)
+        """Waits for the backend load balancer to get an ip and writes its details to a file
+        """
+        lb = store.yaml('config/backend/lb.yaml')
+
+        # Waits until the load balancer has an ip
+        id = lb['load_balancer']['id']
+        if not lb['load_balancer']['ip']:
+            lb = poll(lambda: self.getLB(id), lambda lb: lb['load_balancer']['ip'], 'Backend load balancer', timeout=600)
 
-        time.sleep(5)
-        while not lb['load_balancer']['ip']:
-            id = lb['load_balancer']['id']
-            res = requests.get(f'https://api.digitalocean.com/v2/load_balancers/{id}', headers=self.headers)
-            lb = json.loads(res.text)
-            time.sleep(15)
-        
-        print(lb)
         with open('config/backend/lb.yaml', 'w') as f:
-            f.write(yaml.dump(res.json(), Dumper=yaml.CDumper))
+            f.write(yaml.dump(lb, Dumper=yaml.CDumper))
+
+
+    def findLB(self, name='backend-lb'):
+        """Finds a load balancer, the one saved in config/backend/lb.yaml is checked first then they are searched by name
+
+        Args:
+            name (str, optional): The name of the load balancer. Defaults to 'backend-lb'.
+
+        Returns:
+            (dict): The load balancer details or None if it doesnt exist
+        """
 
+        # Checks the load balancer that was saved
+        lb = store.yaml('config/backend/lb.yaml')
+        if lb and lb.get('load_balancer', {}).get('id'):
+            res = self.api.get(f"load_balancers/{lb['load_balancer']['id']}")
+            if res.status_code == 200:
+                return res.json()
+
+        # Searches every page of load balancers for one with the name
+        page = 1
+        while True:
+            res = self.api.get('load_balancers', params={'page': page, 'per_page': 200}).json()
+            for lb in res.get('load_balancers', []):
+                if lb['name'] == name:
+                    return {'load_balancer': lb}
+            if not res.get('links', {}).get('pages', {}).get('next'):
+                return None
+            page += 1
+
+    def syncLB(self):
+        """Makes the forwarding rules and health check of the backend load balancer match the port index,
+        only the rules that changed are added or removed so the load balancer and its ip stay the same. The
+        load balancer is created if it doesnt exist yet
+        """
+        lb = self.findLB()
+        if lb is None:
+            self.createLB()
+            self.waitforLB()
+            return
+
+        # Compares the rules by their ports and protocols
+        def key(rule):
+            return (rule['entry_protocol'], rule['entry_port'], rule['target_protocol'], rule['target_port'])
+
+        id = lb['load_balancer']['id']
+        want = {key(rule): rule for rule in self.forwardingRules()}
+        have = {key(rule): rule for rule in lb['load_balancer']['forwarding_rules']}
+        add = [rule for k, rule in want.items() if k not in have]
+        remove = [rule for k, rule in have.items() if k not in want]
+
+        # Sends only the rules that changed
+        if add:
+            res = self.api.post(f'load_balancers/{id}/forwarding_rules', json={'forwarding_rules': add})
+            res.raise_for_status()
+        if remove:
+            res = self.api.delete(f'load_balancers/{id}/forwarding_rules', json={'forwarding_rules': remove})
+            res.raise_for_status()
+        print(f'backend-lb: {len(add)} rules added, {len(remove)} removed, {len(want) - len(add)} unchanged')
+
+        # Moves the health check to a port that is still in the index, the whole load balancer has to be sent to change it
+        check = self.healthCheck()
+        current = lb['load_balancer'].get('health_check') or {}
+        changed = any(current.get(field) != value for field, value in check.items())
+        if changed:
+            region = lb['load_balancer'].get('region')
+            data = {
+                'name': lb['load_balancer']['name'],
+                'region': region['slug'] if isinstance(region, dict) else region,
+                'size': lb['load_balancer'].get('size', 'lb-small'),
+                'forwarding_rules': list(want.values()),
+                'health_check': check,
+                'sticky_sessions': lb['load_balancer'].get('sticky_sessions') or {'type': 'none'},
+                'tag': lb['load_balancer'].get('tag', 'k8s:worker'),
+            }
+            res = self.api.put(f'load_balancers/{id}', json=data)
+            res.raise_for_status()
+            print(f"backend-lb: health check moved to port {check['port']}")
+
+        # Saves the up to date details
+        if add or remove or changed:
+            lb = self.getLB(id)
+        with open('config/backend/lb.yaml', 'w') as f:
+            f.write(yaml.dump(lb, Dumper=yaml.CDumper))
+        self.waitforLB()
+
+    def forget(self, *paths):
+        """Deletes local state files of resources that have been deleted
+
+        Args:
+            *paths (str): The paths of the files
+        """
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def waitForDeleted(self, path, what, deleted=None):
+        """Waits until the API says a resource is gone
+
+        Args:
+            path (str): The path of the resource in the API
+            what (str): The name of the resource used in the timeout error
+            deleted (function, optional): Gets called with the response and returns True if the resource is gone without a 404. Defaults to None.
+        """
+        poll(lambda: self.api.get(path), lambda res: res.status_code == 404 or (deleted is not None and deleted(res)), what, timeout=900, initial=1, maximum=10)
+
+    def delete(self, path, what):
+        """Deletes a resource, one that is already gone is ignored
+
+        Args:
+            path (str): The path of the delete call
+            what (str): The name of the resource used in the error
+        """
+        res = self.api.delete(path)
+        if res.status_code not in (200, 202, 204, 404):
+            raise RuntimeError(f'Deleting {what} failed with {res.status_code}: {res.text[:200]}')
+
+    def deleteLB(self, lb=None):
+        """Deletes the backend load balancer and waits for it to be gone
+
+        Args:
+            lb (dict, optional): The load balancer details. Defaults to the saved one or the one named backend-lb.
+        """
+        lb = lb or self.findLB()
+        if lb is not None:
+            id = lb['load_balancer']['id']
+            self.delete(f'load_balancers/{id}', 'the backend load balancer')
+            self.waitForDeleted(f'load_balancers/{id}', 'Deleting the backend load balancer')
+        self.forget('config/backend/lb.yaml')
+
+    def deleteKube(self):
+        """Deletes the Kubernetes cluster with the load balancers and volumes it made, eg the one of the ingress
+        """
+        id = self.kube['id']
+        self.delete(f'kubernetes/clusters/{id}/destroy_with_associated_resources/dangerous', 'the Kubernetes cluster')
+        state = lambda res: res.json().get('kubernetes_cluster', {}).get('status', {}).get('state') == 'deleted'
+        self.waitForDeleted(f'kubernetes/clusters/{id}', 'Deleting the Kubernetes cluster', state)
+        self.kube = None
+        self.forget('config/do/kube.json')
+
+    def deleteMysql(self):
+        """Deletes the read replicas then the MySQL DB, CTFd goes with it so its saved login is removed too
+        """
+        id = self.mysql['id']
+        res = self.api.get(f'databases/{id}/replicas')
+        replicas = res.json().get('replicas', []) if res.status_code == 200 else []
+        for replica in replicas:
+            self.delete(f"databases/{id}/replicas/{replica['name']}", f"the MySQL replica {replica['name']}")
+        for replica in replicas:
+            self.waitForDeleted(f"databases/{id}/replicas/{replica['name']}", f"Deleting the MySQL replica {replica['name']}")
+
+        self.delete(f'databases/{id}', 'the MySQL DB')
+        self.waitForDeleted(f'databases/{id}', 'Deleting the MySQL DB')
+        self.mysql = None
+        self.forget('config/do/mysql.json', 'config/frontend/ctfd.json')
+
+    def deleteRedis(self):
+        """Deletes the Redis DB
+        """
+        id = self.redis['id']
+        self.delete(f'databases/{id}', 'the Redis DB')
+        self.waitForDeleted(f'databases/{id}', 'Deleting the Redis DB')
+        self.redis = None
+        self.forget('config/do/redis.json')
+
+    def deleteSpace(self):
+        """Empties the storage space a page at a time and deletes it
+        """
+        from botocore.exceptions import ClientError
+
+        id = self.registry['registry']['name'].split('ctf-')[1]
+        bucket = f'ctf-{id}'
+        try:
+            for page in self.boto.get_paginator('list_objects_v2').paginate(Bucket=bucket):
+                keys = [{'Key': obj['Key']} for obj in page.get('Contents', [])]
+                if keys:
+                    self.boto.delete_objects(Bucket=bucket, Delete={'Objects': keys, 'Quiet': True})
+            self.boto.delete_bucket(Bucket=bucket)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'NoSuchBucket':
+                raise
+
+    def deleteRegistry(self):
+        """Deletes the container registry, the images in it go with it so the build cache is removed too
+        """
+        self.delete('registry', 'the container registry')
+        self.waitForDeleted('registry', 'Deleting the container registry')
+        self.forget('config/do/registry.json', 'config/backend/images.json')
+
+    def destroy(self):
+        """Deletes everything the deploy made using the ids in the state files. Resources that dont depend on each other
+        are deleted at the same time, the backend load balancer goes before the cluster, the space before the registry
+        its name is read from and the DNS records last. Every step waits until the API says the resource is gone and then
+        removes its state file, so if a step fails running destroy again only deletes what is left
+        """
+        steps = graph()
+
+        # Reads the ips before the state files are removed so only records that point at this CTF are deleted
+        lb = self.findLB()
+        ips = {ip for ip in (store.text('config/do/ingress.txt'), (lb or {}).get('load_balancer', {}).get('ip')) if ip}
+        names = ['@', 'chal'] + [f'{name}.chal' for name in store.yaml('config/backend/ports.yaml') or {}]
+
+        # The load balancer sends traffic to the nodes so it goes first
+        steps.add('deleteLB', lambda: self.deleteLB(lb))
+        after = ['deleteLB']
+        if self.kube:
+            steps.add('deleteKube', self.deleteKube, after=['deleteLB'])
+            after.append('deleteKube')
+        if self.mysql:
+            steps.add('deleteMysql', self.deleteMysql)
+            after.append('deleteMysql')
+        if self.redis:
+            steps.add('deleteRedis', self.deleteRedis)
+            after.append('deleteRedis')
+        if self.registry:
+            steps.add('deleteSpace', self.deleteSpace)
+            steps.add('deleteRegistry', self.deleteRegistry, after=['deleteSpace'])
+            after += ['deleteSpace', 'deleteRegistry']
+
+        # The records are deleted once nothing they point at is left
+        def deleteRecords():
+            if ips:
+                cf().deleteRecords(names, ips)
+            self.forget('config/do/ingress.txt')
+        steps.add('deleteRecords', deleteRecords, after=after)
+
+        try:
+            steps.run()
+        finally:
+            steps.report()
+            self.api.report()
 
     def deployInfra(self):
-        """Deploys all the infrastucture needed
+        """Deploys all the infrastucture needed, every step runs as soon as the steps it depends on are done
         """
 
-        # Deploys the k8 cluster MySQL, Redis DBs and registry container
-        self.createKube()
-        self.createMysql()
-        self.createRedis()
-        self.createRegistry()
+        steps = graph()
 
-        # Waits for all the infrastucture to be provisoned 
-        self.waitForRegistry()
-        self.waitForCluster()
-        self.waitForRedis()
-        self.waitForMysql()
+        # Deploys the k8 cluster MySQL, Redis DBs and registry container
+        steps.add('createKube', self.createKube)
+        steps.add('createMysql', self.createMysql)
+        steps.add('createRedis', self.createRedis)
+        steps.add('createRegistry', self.createRegistry)
+
+        # Waits for all the infrastucture to be provisoned
+        steps.add('waitForRegistry', self.waitForRegistry, after=['createRegistry'])
+        steps.add('waitForCluster', self.waitForCluster, after=['createKube'])
+        steps.add('waitForRedis', self.waitForRedis, after=['createRedis'])
+        steps.add('waitForMysql', self.waitForMysql, after=['createMysql'])
+        steps.add('configureRedis', self.configureRedis, after=['waitForRedis'])
+        if sizing.database(self.settings['infra'], 'mysql')['replicas']:
+            steps.add('createMysqlReplicas', self.createMysqlReplicas, after=['waitForMysql'])
 
         # Connects the Registry and creates the storage space
-        self.createSpace()
-        self.connectRegistry()
-        
+        steps.add('createSpace', self.createSpace, after=['createRegistry'])
+        steps.add('connectRegistry', self.connectRegistry, after=['waitForCluster', 'waitForRegistry'])
+
+        try:
+            steps.run()
+        finally:
+            steps.report()
+            self.api.report()
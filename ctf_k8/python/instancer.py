@@ -0,0 +1,363 @@
+import hashlib
+import os
+import re
+import random
+import string
+import time
+import yaml
+from python.cache import buildCache
+from python.state import store
+from python.tracing import traced
+from python import render
+
+
+@traced(skip=('labelValue', 'teamLabel', 'instanceValues', 'info'))
+class instancer():
+    """Gives every team its own copy of a challenege. Each instance is a Deployment and a NodePort
+    Service made from the backend templates in the instances namespace. A pool of idle instances is
+    kept running for every challenege so starting one only relabels an instance that is already up,
+    and instances are deleted once their time to live is over
+
+    A challenege is instanced if its chal.yaml has instanced: true, it can set warm (the idle instances
+    to keep) and ttl (seconds an instance lives), they default to instancer.warm and instancer.ttl
+
+    Varibles:
+        kube (kube): The Kubernetes client wrapper
+        settings (dict): The instancer settings
+        namespace (str): The namespace instances are made in
+        images (buildCache): The images that have been pushed for every challenege
+    """
+
+    kube = None
+    settings = None
+    namespace = None
+    images = None
+
+    def __init__(self, kube=None):
+        """Loads the settings
+
+        Args:
+            kube (kube, optional): The Kubernetes client wrapper. Defaults to a new one.
+        """
+        if kube is None:
+            from python.kube import kube as kubeClient
+            kube = kubeClient()
+        self.kube = kube
+        self.settings = store.settings().instancer
+        self.namespace = self.settings.get('namespace', 'instances')
+        self.images = buildCache()
+
+    def labelValue(self, value):
+        """Makes a value safe to use as a label
+
+        Args:
+            value (str): The value eg a team name
+
+        Returns:
+            (str): The value with only letters, numbers, - _ and . that is at most 63 long
+        """
+        value = re.sub(r'[^A-Za-z0-9_.-]', '-', str(value))[:63]
+        return value.strip('-_.') or 'x'
+
+    def teamLabel(self, team):
+        """Makes the label a team is found by, it is a hash so two team names never get the same label
+
+        Args:
+            team (str): The team name
+
+        Returns:
+            (str): The first 40 characters of the sha256 of the team name
+        """
+        return hashlib.sha256(str(team).encode()).hexdigest()[:40]
+
+    def challenges(self):
+        """Gets the instanced challeneges
+
+        Returns:
+            (dict): The settings of every instanced challenege keyed by its name
+        """
+        found = {}
+        for dir in sorted(os.listdir('challeneges')):
+            with open(f'challeneges/{dir}/chal.yaml') as f:
+                chal = yaml.load(f.read(), Loader=yaml.CLoader)
+            if chal.get('instanced'):
+                found[chal['name']] = chal
+        return found
+
+    def image(self, chal):
+        """Gets the image of a challenege, the last one pushed or its latest tag
+
+        Args:
+            chal (dict): The challenege settings
+
+        Returns:
+            (str): The image
+        """
+        entry = self.images.images.get(chal['name'])
+        if entry:
+            return entry['image']
+        return f"registry.digitalocean.com/{self.kube.registry['registry']['name']}/{chal['name']}:latest"
+
+    def instanceValues(self, chal, id, image):
+        """Gets the template values for an instance, the instance id is added to the name so
+        every instance gets its own Deployment, Service and pod labels
+
+        Args:
+            chal (dict): The challenege settings
+            id (str): The instance id
+            image (str): The image to run
+
+        Returns:
+            (render.challengeValues): The values
+        """
+        values = render.challengeValues.fromSettings(dict(chal, name=f"{chal['name']}-{id}"), image, None, self.kube.settings['infra'])
+        values.scale = False
+        values.min_replicas = 1
+        return values
+
+    def createNamespace(self):
+        """Creates the instances namespace if it doesnt exist
+        """
+        mani = render.render('instances/namespace.yaml')
+        mani['metadata']['name'] = self.namespace
+        mani['metadata']['labels']['name'] = self.namespace
+        self.kube.apply('Namespace', mani)
+
+    def create(self, chal, image=None):
+        """Starts an idle instance of a challenege
+
+        Args:
+            chal (dict): The challenege settings
+            image (str, optional): The image to run. Defaults to the last one pushed.
+
+        Returns:
+            (str): The name of the instance Deployment
+        """
+        image = image or self.image(chal)
+        id = ''.join(random.choice(string.ascii_lowercase + string.digits) for i in range(6))
+        values = self.instanceValues(chal, id, image)
+        labels = {'ctf-instance': self.labelValue(chal['name']), 'ctf-state': 'warm', 'ctf-id': id}
+
+        # Renders the deployment and service and labels them as an idle instance of the challenege
+        dep = render.render('backend/dep.yaml', values)
+        ser = render.render('backend/service.yaml', values)
+        for mani in (dep, ser):
+            mani['metadata'].setdefault('labels', {}).update(labels)
+        dep['metadata']['annotations'] = {'ctf-image': image}
+        dep['spec']['template']['metadata']['labels'].update(labels)
+
+        # Kubernetes picks the node port, the instance is reached on it until it is deleted
+        del ser['spec']['ports'][0]['nodePort']
+
+        self.kube.app.create_namespaced_deployment(body=dep, namespace=self.namespace)
+        self.kube.core.create_namespaced_service(body=ser, namespace=self.namespace)
+        return dep['metadata']['name']
+
+    def list(self, chal=None, state=None, team=None):
+        """Gets instances
+
+        Args:
+            chal (str, optional): Only instances of this challenege. Defaults to None.
+            state (str, optional): Only warm or claimed instances. Defaults to None.
+            team (str, optional): Only instances of this team. Defaults to None.
+
+        Returns:
+            (list): The instance Deployments
+        """
+        selector = ['ctf-instance' if chal is None else f'ctf-instance={self.labelValue(chal)}']
+        if state is not None:
+            selector.append(f'ctf-state={state}')
+        if team is not None:
+            selector.append(f'ctf-team={self.teamLabel(team)}')
+        items = self.kube.app.list_namespaced_deployment(self.namespace, label_selector=','.join(selector)).items
+
+        # The team name in the annotation has to match exactly so a team never gets the instance of another
+        if team is not None:
+            items = [dep for dep in items if (dep.metadata.annotations or {}).get('ctf-team') == team]
+        return items
+
+    def delete(self, dep):
+        """Deletes an instance
+
+        Args:
+            dep (V1Deployment): The instance Deployment
+        """
+        from kubernetes.client.rest import ApiException
+
+        name = dep.metadata.name
+        id = dep.metadata.labels['ctf-id']
+        chal = name[len('ctf-backend-'):-len(f'-{id}')]
+        for delete, target in ((self.kube.app.delete_namespaced_deployment, name), (self.kube.core.delete_namespaced_service, f'ctf-{chal}-{id}-service')):
+            try:
+                delete(target, self.namespace, propagation_policy='Background')
+            except ApiException as e:
+                if e.status != 404:
+                    raise
+
+    def info(self, dep):
+        """Gets how to connect to an instance
+
+        Args:
+            dep (V1Deployment): The instance Deployment
+
+        Returns:
+            (dict): The challenege, team, host, port and expiry time of the instance
+        """
+        id = dep.metadata.labels['ctf-id']
+        chal = dep.metadata.name[len('ctf-backend-'):-len(f'-{id}')]
+        ser = self.kube.core.read_namespaced_service(f'ctf-{chal}-{id}-service', self.namespace)
+        annotations = dep.metadata.annotations or {}
+        return {
+            'challenge': chal,
+            'team': annotations.get('ctf-team'),
+            'host': self.host(),
+            'port': ser.spec.ports[0].node_port,
+            'expires': float(annotations['ctf-expires']) if 'ctf-expires' in annotations else None,
+            'ready': bool(dep.status and dep.status.ready_replicas),
+        }
+
+    def host(self):
+        """Gets the address players connect to, instancer.host or the external ip of a node
+
+        Returns:
+            (str): The host
+        """
+        if self.settings.get('host'):
+            return self.settings['host']
+        for node in self.kube.core.list_node().items:
+            for address in node.status.addresses or []:
+                if address.type == 'ExternalIP':
+                    self.settings['host'] = address.address
+                    return address.address
+        return None
+
+    def start(self, team, chal):
+        """Gets the instance of a challenege for a team, the team keeps its instance if it already has one,
+        otherwise an idle instance is claimed and a new one is only started if the pool is empty
+
+        Args:
+            team (str): The team name
+            chal (str): The challenege name
+
+        Returns:
+            (dict): How to connect to the instance, see info
+        """
+        from kubernetes.client.rest import ApiException
+
+        settings = self.challenges()[chal]
+        existing = self.list(chal, 'claimed', team)
+        if existing:
+            return self.info(existing[0])
+
+        # Claims a warm instance, ready ones first. The resourceVersion makes the patch fail if another
+        # start claimed it at the same time and the next one is tried
+        expires = time.time() + settings.get('ttl', self.settings.get('ttl', 1800))
+        warm = sorted(self.list(chal, 'warm'), key=lambda dep: not (dep.status and dep.status.ready_replicas))
+        for dep in warm:
+            patch = {'metadata': {
+                'resourceVersion': dep.metadata.resource_version,
+                'labels': {'ctf-state': 'claimed', 'ctf-team': self.teamLabel(team)},
+                'annotations': {'ctf-team': team, 'ctf-expires': str(expires)},
+            }}
+            try:
+                dep = self.kube.app.patch_namespaced_deployment(dep.metadata.name, self.namespace, patch)
+            except ApiException as e:
+                if e.status in (404, 409):
+                    continue
+                raise
+
+            # Starts a new idle instance in place of the one that was claimed
+            if len(warm) <= settings.get('warm', self.settings.get('warm', 2)):
+                self.create(settings)
+            return self.info(dep)
+
+        # The pool is empty so an instance is started and claimed straight away
+        self.create(settings)
+        return self.start(team, chal)
+
+    def stop(self, team, chal):
+        """Deletes the instance of a challenege for a team
+
+        Args:
+            team (str): The team name
+            chal (str): The challenege name
+
+        Returns:
+            (bool): True if the team had an instance
+        """
+        existing = self.list(chal, 'claimed', team)
+        for dep in existing:
+            self.delete(dep)
+        return bool(existing)
+
+    def extend(self, team, chal):
+        """Restarts the time to live of the instance of a team
+
+        Args:
+            team (str): The team name
+            chal (str): The challenege name
+
+        Returns:
+            (dict): How to connect to the instance or None if the team doesnt have one
+        """
+        settings = self.challenges()[chal]
+        for dep in self.list(chal, 'claimed', team):
+            expires = time.time() + settings.get('ttl', self.settings.get('ttl', 1800))
+            patch = {'metadata': {'annotations': {'ctf-expires': str(expires)}}}
+            return self.info(self.kube.app.patch_namespaced_deployment(dep.metadata.name, self.namespace, patch))
+        return None
+
+    def fill(self, chal, image=None):
+        """Keeps the pool of idle instances of a challenege full, idle instances running an old image are replaced
+
+        Args:
+            chal (dict): The challenege settings
+            image (str, optional): The image to run. Defaults to the last one pushed.
+
+        Returns:
+            (int): The amount of instances started
+        """
+        image = image or self.image(chal)
+        warm = []
+        for dep in self.list(chal['name'], 'warm'):
+            if (dep.metadata.annotations or {}).get('ctf-image') == image:
+                warm.append(dep)
+            else:
+                self.delete(dep)
+
+        missing = max(0, chal.get('warm', self.settings.get('warm', 2)) - len(warm))
+        for _ in range(missing):
+            self.create(chal, image)
+        return missing
+
+    def reap(self, now=None):
+        """Deletes the instances whose time to live is over
+
+        Args:
+            now (float, optional): The current time. Defaults to time.time().
+
+        Returns:
+            (list): The names of the deleted instances
+        """
+        now = now or time.time()
+        reaped = []
+        for dep in self.list(state='claimed'):
+            expires = (dep.metadata.annotations or {}).get('ctf-expires')
+            if expires is not None and float(expires) <= now:
+                self.delete(dep)
+                reaped.append(dep.metadata.name)
+        return reaped
+
+    def run(self, every=30):
+        """Reaps expired instances and refills the pools forever
+
+        Args:
+            every (int, optional): Seconds between passes. Defaults to 30.
+        """
+        self.createNamespace()
+        while True:
+            for name in self.reap():
+                print(f'reaped {name}')
+            for chal in self.challenges().values():
+                self.fill(chal)
+            time.sleep(every)
@@ -1,343 +1,611 @@
-from kubernetes import client, config
+import base64
+import copy
 import yaml
 import requests
 import os
-import time
-from docker import client as dclient, from_env
-import shlex
-import json
+import threading
 from python.cloudflare import cf
-
+from python.tasks import pipeline
+from python.cache import buildCache
+from python.readiness import watch
+from python.state import store
+from python import render
+from python.ports import portIndex
+from python import sizing
+from python import pooling
+from python import builders
+from python.instancer import instancer
+from python import tracing
+from python.tracing import traced
+
+@traced(skip=('getClient', 'matches', 'canonical', 'manifest', 'writeManifest'))
 class kube():
     """Create the Kubernetes Cluster in Digital Ocean 
 
+    The Kubernetes and docker clients are only made the first time they are used so commands that
+    dont need them dont pay for importing the SDKs or logging into the registry
+
     Varibles:
         core (kubernetes.client.CoreV1Api): Client for core kubernetws API
         app (kubernetes.client.AppsV1Api): Client for app kubernetes API
         networkbeta (kubernetes.client.NetworkingV1beta1Api): Client for networkbetav1 kubernetes API
         network (kubernetes.client.NetworkingV1Api): Client for networkv1 kubernetes API
         scale (kubernetes.client.AutoscalingV1Api): Client for autoscaling kubernetes API
+        batch (kubernetes.client.BatchV1Api): Client for batch kubernetes API
         kube (dict): Details about kubernetes cluster
+        kubeconfig (dict): The kubeconfig the Kubernetes clients are made with
+        clients (dict): The Kubernetes clients that have been made keyed by their class name
         settings (dict): Settings for the deployment
         mysql (dict): Details of the Mysql cluster
         redis (dict): Details of the Redis Cluster
         dclient (docker.client): Client for docker API
+        builder (dockerBuilder|kanikoBuilder): The backend that builds and pushes the challenege images, made the first time it is used
         ip (str): IP address of the ingress loadbalancer
+        images (buildCache): The challenege images that are already in the container registry
+        reconcile (bool): Updates objects that already exist instead of only creating them
 
     """    
 
-    core = None
-    app = None
-    networkbeta = None
-    network = None
-    scale = None
     kube = None
+    kubeconfig = None
+    clients = None
+    docker = None
+    backend = None
     settings = None
     mysql = None
     redis = None
-    dclient = None
     ip = None
+    images = None
+    reconcile = False
+    clientLock = threading.RLock()
 
     def __init__(self):
-        """Loads all the clients and the settings if they can be loaded
+        """Loads the settings and the infrastucture details
+        """
+        self.clients = {}
+        self.docker = None
+
+        # Loads the settings and the infrastucture details
+        self.refresh()
+
+        # Loads the images that have already been pushed
+        self.images = buildCache()
+
+    def refresh(self):
+        """Loads the settings and the details of the infrastucture from the state store, the
+        Kubernetes clients are only made again if the kubeconfig changed
         """
 
         # Loads the settings for the deployment
-        with open(r'settings.yaml') as file:
-            self.settings = yaml.load(file.read(), Loader=yaml.FullLoader)
-            
-        # Loads Kubernetes details if they exist
-        try:
-            with open('config/do/kube.json') as f:
-                self.kube = yaml.load(f.read(), Loader=yaml.CLoader)
-        except:
-            pass
+        self.settings = store.settings()
 
-        # Loads mysql details if they exist
-        try:
-            with open('config/do/mysql.json') as f:
-                self.mysql = yaml.load(f.read(), Loader=yaml.CLoader)
-        except:
-            pass
+        # Loads the Kubernetes, mysql, redis and container registry details if they exist
+        self.kube = store.resource('kube')
+        self.mysql = store.resource('mysql')
+        self.redis = store.resource('redis')
+        self.registry = store.resource('registry')
 
-        # Loads redis details if they exist
-        try:
-            with open('config/do/redis.json') as f:
-                self.redis = yaml.load(f.read(), Loader=yaml.CLoader)
-        except:
-            pass
+        # Checks if objects should be reconciled instead of only created
+        self.reconcile = self.settings['infra'].get('reconcile', False)
+
+        # Drops the Kubernetes clients if the kubeconfig changed so they get made again with the new one
+        kubeconfig = (self.kube or {}).get('config')
+        with self.clientLock:
+            if kubeconfig != self.kubeconfig:
+                self.kubeconfig = kubeconfig
+                self.clients = {}
+
+    def getClient(self, name):
+        """Gets a Kubernetes API client, it is made the first time it is used
+
+        Args:
+            name (str): The name of the client class eg CoreV1Api
+
+        Returns:
+            (any): The Kubernetes API client
+        """
+        with self.clientLock:
+            if name not in self.clients:
+                from kubernetes import client, config
+
+                # Loads the kubeconfig into the pytohn kubernetes client
+                if 'api' not in self.clients:
+                    try:
+                        self.clients['api'] = config.new_client_from_config_dict(self.kubeconfig)
+                    except:
+                        self.clients['api'] = client.ApiClient()
+
+                self.clients[name] = getattr(client, name)(self.clients['api'])
+            return self.clients[name]
+
+    @property
+    def app(self):
+        return self.getClient('AppsV1Api')
+
+    @property
+    def core(self):
+        return self.getClient('CoreV1Api')
+
+    @property
+    def networkbeta(self):
+        return self.getClient('NetworkingV1beta1Api')
+
+    @property
+    def network(self):
+        return self.getClient('NetworkingV1Api')
+
+    @property
+    def scale(self):
+        return self.getClient('AutoscalingV1Api')
+
+    @property
+    def batch(self):
+        return self.getClient('BatchV1Api')
+
+    @property
+    def builder(self):
+        with self.clientLock:
+            if self.backend is None:
+                self.backend = builders.create(self)
+            return self.backend
+
+    @property
+    def dclient(self):
+        """Starts the docker client and logs into the registry the first time it is used
+        """
+        with self.clientLock:
+            if self.docker is None:
+                from docker import from_env
+                docker = from_env()
+                key = self.settings['infra']['api_key']
+                docker.login(username=key, password=key, registry='registry.digitalocean.com')
+                self.docker = docker
+            return self.docker
+
+    # The client and the name used in its methods for every kind that can be reconciled
+    kinds = {
+        'Namespace': ('core', 'namespace'),
+        'Deployment': ('app', 'namespaced_deployment'),
+        'DaemonSet': ('app', 'namespaced_daemon_set'),
+        'Service': ('core', 'namespaced_service'),
+        'Secret': ('core', 'namespaced_secret'),
+        'ConfigMap': ('core', 'namespaced_config_map'),
+        'HorizontalPodAutoscaler': ('scale', 'namespaced_horizontal_pod_autoscaler'),
+        'Ingress': ('network', 'namespaced_ingress'),
+    }
+
+    def canonical(self, body):
+        """Gets a manifest the way the API gives it back, the stringData of a secret is base64 encoded into its data
+
+        Args:
+            body (dict): The manifest
+
+        Returns:
+            (dict): The manifest to compare with the live object
+        """
+        if not body.get('stringData'):
+            return body
+        body = copy.deepcopy(body)
+        data = dict(body.get('data') or {})
+        for key, value in body.pop('stringData').items():
+            data[key] = base64.b64encode(str(value).encode()).decode()
+        body['data'] = data
+        return body
+
+    def matches(self, want, live, quantity=False):
+        """Checks if every value set in the manifest is the same in the live object, fields the
+        manifest doesnt set (defaults, status etc) are ignored
+
+        Args:
+            want (any): The value from the manifest
+            live (any): The value from the live object
+            quantity (bool, optional): The values are resource quantities the API normalizes, eg 0.5 is 500m. Defaults to False.
+
+        Returns:
+            (bool): True if the live object already matches the manifest
+        """
+        if isinstance(want, dict):
+            return isinstance(live, dict) and all(self.matches(value, live.get(key), quantity or key in ('requests', 'limits')) for key, value in want.items())
+        if isinstance(want, list):
+            return isinstance(live, list) and len(want) == len(live) and all(self.matches(a, b) for a, b in zip(want, live))
+        if want is None:
+            return True
+        if want == live or str(want) == str(live):
+            return True
+
+        # Compares quantities by their value so 1Gi and 1024Mi are the same
+        if quantity and live is not None:
+            from kubernetes.utils import parse_quantity
+            try:
+                return parse_quantity(want) == parse_quantity(live)
+            except (ValueError, TypeError):
+                return False
+        return False
+
+    def apply(self, kind, body, ns=None):
+        """Reconciles an object, it is created if it doesnt exist, patched with a strategic merge if
+        it is different from the manifest and left alone if it already matches
+
+        Args:
+            kind (str): The kind of the object
+            body (dict): The manifest of the object
+            ns (str, optional): The namespace of the object. Defaults to None.
+
+        Returns:
+            (str): created, patched or unchanged
+        """
+        from kubernetes.client.rest import ApiException
 
-        # Loads container registry details if they exist
+        api, name = self.kinds[kind]
+        api = getattr(self, api)
+        args = {'namespace': ns} if name.startswith('namespaced_') else {}
+
+        # Reads the live object
         try:
-            with open('config/do/registry.json') as f:
-                self.registry = yaml.load(f.read(), Loader=yaml.CLoader)
-        except:
-            pass
+            live = getattr(api, f'read_{name}')(body['metadata']['name'], **args)
+        except ApiException as e:
+            if e.status != 404:
+                raise
+            getattr(api, f'create_{name}')(body=body, **args)
+            return 'created'
+
+        # Only sends a patch if something is different
+        if self.matches(self.canonical(body), api.api_client.sanitize_for_serialization(live)):
+            return 'unchanged'
+        getattr(api, f'patch_{name}')(body['metadata']['name'], body=body, **args)
+        return 'patched'
+
+    def remove(self, kind, name, ns=None):
+        """Deletes an object the manifests dont make anymore, an object that is already gone is ignored
+
+        Args:
+            kind (str): The kind of the object
+            name (str): The name of the object
+            ns (str, optional): The namespace of the object. Defaults to None.
+
+        Returns:
+            (str): deleted or missing
+        """
+        from kubernetes.client.rest import ApiException
 
-        # Loads the kubeconfig into the pytohn kubernetes client
+        api, method = self.kinds[kind]
+        args = {'namespace': ns} if method.startswith('namespaced_') else {}
         try:
-            config.load_kube_config_from_dict(self.kube['config'])
-        except:
-            pass
-        
-        
+            getattr(getattr(self, api), f'delete_{method}')(name, **args)
+        except ApiException as e:
+            if e.status != 404:
+                raise
+            return 'missing'
+        return 'deleted'
 
-        # Loads all the Kubernetes clients
-        self.app = client.AppsV1Api()
-        self.core = client.CoreV1Api()
-        self.networkbeta = client.NetworkingV1beta1Api()
-        self.network = client.NetworkingV1Api()
-        self.scale = client.AutoscalingV1Api()
+    def manifest(self, file):
+        """Gets a manifest to send to the API
 
-        # Starts the docker client and logs into the registry
-        self.dclient = from_env()
-        key = self.settings['infra']['api_key']
-        self.dclient.login(username=key, password=key, registry='registry.digitalocean.com')
+        Args:
+            file (str): Path the the Kubernetes yaml file or an already rendered manifest
 
+        Returns:
+            (dict): The manifest
+        """
+        if isinstance(file, dict):
+            return file
+        with open(file) as f:
+            return yaml.safe_load(f)
 
     def createDeployment(self, file, ns):
         """Creates a Kubernetes Deployemnt
 
         Args:
-            file (str): Path the the Kubernetes yaml file
+            file (str): Path the the Kubernetes yaml file or a rendered manifest
             ns (str): The namespace to be deployed to
         """
-        # Opens file and loads yaml file
-        with open(file) as f:
-            dep = yaml.safe_load(f)
+        dep = self.manifest(file)
+
+        # Calls the API via the client
+        if self.reconcile:
+            return self.apply('Deployment', dep, ns)
+        resp = self.app.create_namespaced_deployment(
+        body=dep, namespace=ns)
+
+    def createDaemonSet(self, file, ns):
+        """Creates a Kubernetes DaemonSet
+
+        Args:
+            file (str): Path the the Kubernetes yaml file or a rendered manifest
+            ns (str): The namespace to be deployed to
+        """
+        dep = self.manifest(file)
 
-            # Calls the API via the client
-            resp = self.app.create_namespaced_deployment(
-            body=dep, namespace=ns)
+        # Calls the API via the client
+        if self.reconcile:
+            return self.apply('DaemonSet', dep, ns)
+        resp = self.app.create_namespaced_daemon_set(
+            body=dep,
+            namespace=ns
+        )
 
     def createIngress(self, file, ns):
         """Creates a Kubernetes Ingress
 
         Args:
-            file (str): Path the the Kubernetes yaml file
+            file (str): Path the the Kubernetes yaml file or a rendered manifest
             ns (str): The namespace to be deployed to
         """
+        dep = self.manifest(file)
 
-        time.sleep(5)
+        if self.reconcile:
+            return self.apply('Ingress', dep, ns)
+
+        tracing.sleep(5)
         # Sets the Headers for the API request
         headers = self.network.api_client.configuration.api_key
 
-        # Opens file and loads yaml file
-        with open(file) as f:
-            dep = yaml.safe_load(f)
-
         # Calls the API
         res = requests.post(f'{self.network.api_client.configuration.host}/apis/networking.k8s.io/v1/namespaces/{ns}/ingresses', json=dep, headers=headers, verify=self.network.api_client.configuration.ssl_ca_cert)
         if res.status_code in [200, 201, 202]:
-            print(res.status_code)
-            self.createIngress(file, ns)
+            tracing.attribute('http.status', res.status_code)
+            self.createIngress(dep, ns)
 
     def createNamespace(self, file):
         """Creates a Kubernetes Namespace
 
         Args:
-            file (str): Path the the Kubernetes yaml file
+            file (str): Path the the Kubernetes yaml file or a rendered manifest
         """
+        dep = self.manifest(file)
 
-        # Opens file and loads yaml file 
-        with open(file) as f:
-            dep = yaml.safe_load(f)
-
-            # Calls the API via the client
-            resp = self.core.create_namespace(
-                body=dep
-            )
+        # Calls the API via the client
+        if self.reconcile:
+            return self.apply('Namespace', dep)
+        resp = self.core.create_namespace(
+            body=dep
+        )
 
     def createSecret(self, file, ns):
         """Creates a Kubernetes Secret
 
         Args:
-            file (str): Path the the Kubernetes yaml file
+            file (str): Path the the Kubernetes yaml file or a rendered manifest
             ns (str): The namespace to be deployed to
         """
+        dep = self.manifest(file)
 
-        # Opens file and loads yaml file
-        with open(file) as f:
-            dep = yaml.safe_load(f)
-
-            # Calls the API via the client
-            resp = self.core.create_namespaced_secret(
-                body=dep, 
-                namespace=ns
-            )
+        # Calls the API via the client
+        if self.reconcile:
+            return self.apply('Secret', dep, ns)
+        resp = self.core.create_namespaced_secret(
+            body=dep, 
+            namespace=ns
+        )
 
     def createService(self, file, ns):
         """Creates a Kubernetes Service
 
         Args:
-            file (str): Path the the Kubernetes yaml file
+            file (str): Path the the Kubernetes yaml file or a rendered manifest
             ns (str): The namespace to be deployed to
         """
+        dep = self.manifest(file)
 
-        # Opens file and loads yaml file 
-        with open(file) as f:
-            dep = yaml.safe_load(f)
-
-            # Calls the API via the client
-            resp = self.core.create_namespaced_service(
-                body=dep, 
-                namespace=ns
-            )
+        # Calls the API via the client
+        if self.reconcile:
+            return self.apply('Service', dep, ns)
+        resp = self.core.create_namespaced_service(
+            body=dep, 
+            namespace=ns
+        )
 
     def createAutoScaler(self, file, ns):
         """Creates a Kubernetes autoscaler
 
         Args:
-            file (str): Path the the Kubernetes yaml file
+            file (str): Path the the Kubernetes yaml file or a rendered manifest
             ns (str): The namespace to be deployed to
         """
+        dep = self.manifest(file)
 
-        # Opens file and loads yaml file
-        with open(file) as f:
-            dep = yaml.safe_load(f)
-
-            # Calls the API via the client
-            resp = self.scale.create_namespaced_horizontal_pod_autoscaler(
-                body=dep, 
-                namespace=ns
-            )
+        # Calls the API via the client
+        if self.reconcile:
+            return self.apply('HorizontalPodAutoscaler', dep, ns)
+        resp = self.scale.create_namespaced_horizontal_pod_autoscaler(
+            body=dep, 
+            namespace=ns
+        )
 
     def createConfig(self, file, ns):
         """Creates a Kubernetes Config map
 
         Args:
-            file (str): Path the the Kubernetes yaml file
+            file (str): Path the the Kubernetes yaml file or a rendered manifest
             ns (str): The namespace to be deployed to
         """
+        dep = self.manifest(file)
 
-        # Opens file and loads yaml file
-        with open(file) as f:
-            dep = yaml.safe_load(f)
+        # Calls the API via the client
+        if self.reconcile:
+            return self.apply('ConfigMap', dep, ns)
+        resp = self.core.create_namespaced_config_map(
+            body=dep, 
+            namespace=ns
+        )
 
-            # Calls the API via the client
-            resp = self.core.create_namespaced_config_map(
-                body=dep, 
-                namespace=ns
-            )
-
-    def waitForIngress(self):
+    def waitForIngress(self, timeout=600):
         """Waits for ingress to get an ip address
+
+        Args:
+            timeout (int, optional): Seconds to wait before giving up. Defaults to 600.
         """
 
-        # Loops untill ingress has an ip
-        while True:
+        def ready(ingress):
+            lb = ingress.status.load_balancer
+            return bool(lb and lb.ingress and lb.ingress[0].ip)
 
-            # Sets the headers and get the ingress details from the API
-            headers = self.network.api_client.configuration.api_key
-            res = requests.get(f'{self.network.api_client.configuration.host}/apis/networking.k8s.io/v1/namespaces/frontend/ingresses/ctfd-frontend-ingress', headers=headers, verify=self.network.api_client.configuration.ssl_ca_cert)
-            print(res.status_code)
-            print(json.loads(res.text)['status'])
-            # Checks if an ip has been assigned and stores in a file
-            try:
-                self.ip = json.loads(res.text)['status']['loadBalancer']['ingress'][0]['ip']
-                with open('config/do/ingress.txt', 'w') as f:
-                    f.write(self.ip)
-                break
-            except:
-                pass
+        # Watches the ingress untill it has an ip
+        ingress = watch(self.network.list_namespaced_ingress, ready, 'Frontend ingress', timeout=timeout,
+            namespace='frontend', field_selector='metadata.name=ctfd-frontend-ingress')
 
-    def parseFrontSecret(self):
-        """Perpares the yaml file form deployment
-        """
-        # Reads the Yaml file
-        with open("templates/kubernetes/frontend/secret.yaml") as f:
-            mani = yaml.load(f.read(), Loader=yaml.CLoader)
+        # Stores the ip in a file
+        self.ip = ingress.status.load_balancer.ingress[0].ip
+        with open('config/do/ingress.txt', 'w') as f:
+            f.write(self.ip)
 
-        # Loads all the values into the yaml file
-        mani['data']['tls.crt'] = self.settings['ctfd']['tlsCert']
-        mani['data']['tls.key'] = self.settings['ctfd']['tlsKey']
+    def writeManifest(self, mani, path):
+        """Writes a rendered manifest to disk if infra.write-manifests is set, the manifests are
+        sent straight to the API so this is only needed to look at them
 
-        # Writes the yaml file to be deployed 
-        with open("config/frontend/secret.yaml", 'w') as f:
-            f.write(yaml.dump(mani, Dumper=yaml.CDumper))
-    
-    def parseFrontDep(self):
-        """Perpares the yaml file form deployment
+        Args:
+            mani (dict): The rendered manifest
+            path (str): The path to write it to
         """
-        # Reads the Yaml file
-        with open("templates/kubernetes/frontend/dep.yaml") as f:
-            mani = yaml.load(f.read(), Loader=yaml.CLoader)
+        if self.settings['infra'].get('write-manifests', False):
+            render.write(mani, path)
 
-        # Loads all the values into the yaml file
-        mani['spec']['template']['spec']['containers'][0]['image'] = self.settings['ctfd']['image']
+    def frontendValues(self):
+        """Gets the values for the frontend manifests from the settings and the infrastucture details
+
+        Returns:
+            (render.frontendValues): The values
+        """
+        ctfd = self.settings['ctfd']
+        infra = self.settings['infra']
         user = self.mysql['private_connection']['user']
         password = self.mysql['private_connection']['password']
         port = self.mysql['private_connection']['port']
         host = self.mysql['private_connection']['host']
-        uri = f'mysql+pymysql://{user}:{password}@{host}:{port}/defaultdb'
-        mani['spec']['template']['spec']['containers'][0]['env'][1]['value'] = uri
-        mani['spec']['template']['spec']['containers'][0]['env'][2]['value'] = self.redis['private_connection']['uri']
 
-        # Writes the yaml file to be deployed 
-        with open("config/frontend/dep.yaml", 'w') as f:
-            f.write(yaml.dump(mani, Dumper=yaml.CDumper))
+        # Connects through the ProxySQL sidecar in the pod when pooling is on
+        pool = pooling.settings(infra)
+        config = ''
+        if pool['mode'] == 'proxysql':
+            config = pooling.proxysqlConfig(self.mysql, pool)
+            host, port = '127.0.0.1', 6033
+        elif pool['mode'] != 'direct':
+            raise ValueError(f"Unknown MySQL pool mode {pool['mode']}, use direct or proxysql")
+
+        # Works out the workers and resources of each pod from the size of the nodes
+        slug = (self.kube or {}).get('node_pools', [{}])[0].get('size') or sizing.cluster(infra)['size']
+        profile = sizing.frontendProfile(slug, ctfd)
+
+        return render.frontendValues(
+            image=ctfd['image'],
+            database_url=f'mysql+pymysql://{user}:{password}@{host}:{port}/defaultdb',
+            redis_url=self.redis['private_connection']['uri'],
+            domain=self.settings['dns']['domain'],
+            tls_cert=ctfd['tlsCert'],
+            tls_key=ctfd['tlsKey'],
+            min_replicas=infra['min-rep'],
+            max_replicas=infra['max-rep'],
+            cpu=infra['CPU'],
+            workers=profile['workers'],
+            threads=profile['threads'],
+            worker_class=profile['worker_class'],
+            resources=profile['resources'],
+            proxysql_config=config,
+            proxysql_image=pool['image'],
+            env={name: str(value).lower() if isinstance(value, bool) else str(value) for name, value in (ctfd.get('env') or {}).items()},
+        )
 
-    def parseFrontScale(self):
-        """Perpares the yaml file form deployment
-        """
-        # Reads the Yaml file
-        with open("templates/kubernetes/frontend/scale.yaml") as f:
-            mani = yaml.load(f.read(), Loader=yaml.CLoader)
-
-        # Loads all the values into the yaml file
-        mani['spec']['maxReplicas'] = self.settings['infra']['max-rep']
-        mani['spec']['minReplicas'] = self.settings['infra']['min-rep']
-        mani['spec']['targetCPUUtilizationPercentage'] = self.settings['infra']['CPU']
+    def parseFrontSecret(self):
+        """Renders the cert secret
 
-        # Writes the yaml file to be deployed 
-        with open("config/frontend/scale.yaml", 'w') as f:
-            f.write(yaml.dump(mani, Dumper=yaml.CDumper))
+        Returns:
+            (dict): The rendered manifest
+        """
+        mani = render.render('frontend/secret.yaml', self.frontendValues())
+        self.writeManifest(mani, "config/frontend/secret.yaml")
+        return mani
     
-    def parseFrontIngress(self):
-        """Perpares the yaml file form deployment
+    def parseFrontDep(self):
+        """Renders the CTFd deployment
+
+        Returns:
+            (dict): The rendered manifest
+        """
+        values = self.frontendValues()
+        mani = render.render('frontend/dep.yaml', values)
+
+        # Gunicorn only gets threads when there is more than one, an empty value would be dropped by the API and never match
+        env = mani['spec']['template']['spec']['containers'][0]['env']
+        if values.threads > 1:
+            env.append({'name': 'GUNICORN_CMD_ARGS', 'value': f'--threads {values.threads}'})
+
+        # Sets the extra env vars from the settings, they replace the template values with the same name
+        env[:] = [var for var in env if var['name'] not in values.env]
+        env.extend({'name': name, 'value': value} for name, value in values.env.items())
+
+        # Adds the ProxySQL sidecar, the hash of its config restarts the pods when the config changes
+        if values.proxysql_config:
+            sidecar = render.render('frontend/proxysql-sidecar.yaml', values)
+            pod = mani['spec']['template']
+            pod['spec']['containers'].append(sidecar['container'])
+            pod['spec'].setdefault('volumes', []).append(sidecar['volume'])
+            pod['metadata'].setdefault('annotations', {})['proxysql-config'] = pooling.checksum(values.proxysql_config)
+
+        self.writeManifest(mani, "config/frontend/dep.yaml")
+        return mani
+
+    def parseFrontProxy(self):
+        """Renders the ProxySQL config secret
+
+        Returns:
+            (dict): The rendered manifest or None if pooling is off
         """
+        values = self.frontendValues()
+        if not values.proxysql_config:
+            return None
+        mani = render.render('frontend/proxysql.yaml', values)
+        self.writeManifest(mani, "config/frontend/proxysql.yaml")
+        return mani
 
-        # Reads the Yaml file
-        with open("templates/kubernetes/frontend/ingress.yaml") as f:
-            mani = yaml.load(f.read(), Loader=yaml.CLoader)
+    def parseFrontScale(self):
+        """Renders the CTFd HPA
 
-        # Loads all the values into the yaml file
-        mani['spec']['tls'][0]['hosts'][0] = self.settings['dns']['domain']
-        mani['spec']['rules'][0]['host'] = self.settings['dns']['domain']
+        Returns:
+            (dict): The rendered manifest
+        """
+        mani = render.render('frontend/scale.yaml', self.frontendValues())
+        self.writeManifest(mani, "config/frontend/scale.yaml")
+        return mani
+    
+    def parseFrontIngress(self):
+        """Renders the CTFd ingress
 
-        # Writes the yaml file to be deployed
-        with open("config/frontend/ingress.yaml", 'w') as f:
-            f.write(yaml.dump(mani, Dumper=yaml.CDumper))
-        
+        Returns:
+            (dict): The rendered manifest
+        """
+        mani = render.render('frontend/ingress.yaml', self.frontendValues())
+        self.writeManifest(mani, "config/frontend/ingress.yaml")
+        return mani
 
     def deployFrontEnd(self):
         """Deploys all of the Kubernetes needed to get CTFd up and running 
         """
 
-        # runs init again so if the class was created before deploying the infra it will get all the configs
-        self.__init__()
+        # reloads the configs so if the class was created before deploying the infra it will get them
+        self.refresh()
 
         # Sets the namespace string to pass into functions
         ns = "frontend"
 
-        # Parses and deploys the cert secret
-        self.parseFrontSecret()
-        self.createSecret('config/frontend/secret.yaml', ns)
+        # Renders and deploys the cert secret
+        self.createSecret(self.parseFrontSecret(), ns)
+
+        # Renders and deploys the ProxySQL config if the DB connections are pooled
+        proxy = self.parseFrontProxy()
+        if proxy is not None:
+            self.createSecret(proxy, ns)
 
-        # Parses and deploys the deployment
-        self.parseFrontDep()
-        self.createDeployment('config/frontend/dep.yaml', ns)
+        # Renders and deploys the deployment
+        self.createDeployment(self.parseFrontDep(), ns)
 
-        # Parses and deploys the HPA
-        self.parseFrontScale()
-        self.createAutoScaler('config/frontend/scale.yaml', ns)
+        # Renders and deploys the HPA
+        self.createAutoScaler(self.parseFrontScale(), ns)
 
         # Deploys the service
-        self.createService('templates/kubernetes/frontend/service.yaml', ns)
+        self.createService(render.render('frontend/service.yaml'), ns)
 
-        # Parses and deploys the ingress
-        self.parseFrontIngress()
-        self.createIngress('config/frontend/ingress.yaml', ns)
+        # Renders and deploys the ingress
+        self.createIngress(self.parseFrontIngress(), ns)
 
         # Waits for the ingress to get an IP
         self.waitForIngress()
@@ -345,71 +613,152 @@ class kube():
         # Deploys the DNS Record
         cfs = cf()
         cfs.createRecord()
-        
 
-    def deployChallenge(self, file, settings, count):
-        """Deploys a single challenege (needs updateing will comment after)
+    def buildChallenge(self, file, settings, force=False):
+        """Builds the image for a challenege with the build backend, the build is skipped if the deploy
+        folder hasnt changed since the image was last pushed
 
         Args:
             file (str): the challenege folder
             settings (dict): the challeneg settings
-            count (int): the index of the challenege
+            force (bool, optional): Builds the image even if it is in the build cache. Defaults to False.
+
+        Returns:
+            (dict): The tag, the hash and path of the deploy folder and the pushed image if it was cached
         """
 
         # Loads the Container registry name and the name of the challenege
         reg_name = self.registry['registry']['name']
         chal_name = settings['name']
+        tag = f'registry.digitalocean.com/{reg_name}/{chal_name}'
+
+        # Checks if the image for this deploy folder is already in the registry
+        context = self.images.hashContext(f'{file}/deploy/')
+        image = None if force else self.images.get(chal_name, context, tag)
+
+        # Builds the image for the challenege with the build backend
+        build = {'name': chal_name, 'tag': tag, 'hash': context, 'path': f'{file}/deploy/', 'image': image}
+        if image is None:
+            self.builder.build(build)
+
+        return build
+
+    def pushChallenge(self, build):
+        """Pushes a challenege image to the container registry and records it in the build cache
+
+        Args:
+            build (dict): The result of buildChallenge
 
-        # Builds the docker image for the challenege
-        image = self.dclient.images.build(path=f'{file}/deploy/', tag=f'registry.digitalocean.com/{reg_name}/{chal_name}', nocache=True)
-        image[0].collection.push(f'registry.digitalocean.com/{reg_name}/{chal_name}')
-
-        # Loads the Yaml file for the deployment
-        with open('templates/kubernetes/backend/dep.yaml') as f:
-            dep = yaml.load(f.read(), Loader=yaml.FullLoader)
-
-        # Sets all the values needed
-        dep['metadata']['name'] = f'ctf-backend-{chal_name}'
-        dep['metadata']['labels']['app'] = f'ctf-{chal_name}'
-        dep['spec']['selector']['matchLabels']['app'] = f'ctf-{chal_name}'
-        dep['spec']['template']['metadata']['labels']['app'] = f'ctf-{chal_name}'
-        dep['spec']['template']['spec']['containers'][0]['name'] =  f'ctf-{chal_name}'
-        dep['spec']['template']['spec']['containers'][0]['image'] = f'registry.digitalocean.com/{reg_name}/{chal_name}:latest'
-        dep['spec']['template']['spec']['containers'][0]['livenessProbe']['exec']['command'] = shlex.split(settings['liveCommand'], posix=False)
-        
-        # Writes the Yaml file for the deployment
-        with open(f'{file}/dep.yaml', 'w') as f:
-            f.write(yaml.dump(dep, Dumper=yaml.CDumper))
-
-        # Reads the yaml file for the service
-        with open('templates/kubernetes/backend/service.yaml') as f:
-            ser = yaml.load(f.read(), Loader=yaml.FullLoader)
-
-        # Loads the right values for the Yaml file
-        ser['metadata']['name'] = f'ctf-{chal_name}-service'
-        ser['spec']['selector']['app'] = f'ctf-{chal_name}'
-        ser['spec']['ports'][0]['targetPort'] = settings['docker-port']
-        ser['spec']['ports'][0]['nodePort'] = 30000 + count
-        
-        #Write the Yaml file for the service
-        with open(f'{file}/ser.yaml', 'w') as f:
-            f.write(yaml.dump(ser, Dumper=yaml.CDumper))
-
-        with open('config/backend/ports.yaml', 'a') as f:
-            f.write(f'{chal_name}: {30000+count}\n')
+        Returns:
+            (str): The image pinned to its digest
+        """
+
+        # The image is already in the registry
+        if build['image'] is not None:
+            return build['image']
+
+        # Pushes the image with the build backend, for in cluster builds this is where the image is built
+        digest = self.builder.push(build)
+
+        # Without a digest the image cant be pinned so it isnt cached
+        if digest is None:
+            return f'{build["tag"]}:latest'
+
+        image = f'{build["tag"]}@{digest}'
+        self.images.set(build['name'], build['hash'], image)
+        return image
+
+    def applyChallenge(self, file, settings, port, image=None):
+        """Renders the Kubernetes objects for a challenege and deploys them
+
+        Args:
+            file (str): the challenege folder
+            settings (dict): the challeneg settings
+            port (int): the node port of the challenege from the port index
+            image (str, optional): The image to deploy. Defaults to the latest tag of the challenege.
+        """
+
+        # Loads the Container registry name and the name of the challenege
+        reg_name = self.registry['registry']['name']
+        chal_name = settings['name']
+        image = image or f'registry.digitalocean.com/{reg_name}/{chal_name}:latest'
+        values = render.challengeValues.fromSettings(settings, image, port, self.settings['infra'])
+
+        # Renders the deployment and the service
+        dep = render.render('backend/dep.yaml', values)
+        ser = render.render('backend/service.yaml', values)
+        self.writeManifest(dep, f'{file}/dep.yaml')
+        self.writeManifest(ser, f'{file}/ser.yaml')
+
+        # Renders the HPA, the replicas are left to the HPA so redeploying doesnt scale the challenege back down
+        hpa = None
+        if values.scale:
+            dep['spec'].pop('replicas')
+            hpa = render.render('backend/scale.yaml', values)
+            self.writeManifest(hpa, f'{file}/scale.yaml')
 
         # Creates the deployment and service 
-        self.createDeployment(f'{file}/dep.yaml', 'backend')
-        self.createService(f'{file}/ser.yaml', 'backend') 
+        self.createDeployment(dep, 'backend')
+        self.createService(ser, 'backend')
+        if hpa is not None:
+            self.createAutoScaler(hpa, 'backend')
 
+        # Deletes the HPA of a challenege that stopped scaling so it doesnt fight the replicas in the manifest
+        elif self.reconcile:
+            self.remove('HorizontalPodAutoscaler', f'ctf-backend-{chal_name}', 'backend')
 
+    def parsePrepull(self, images):
+        """Renders the DaemonSet that pulls every challenege image on every node. Each image gets an
+        init container that runs a static busybox copied in by the first one so images without a shell
+        work too, the pod then idles on the pause image. Changing the images rolls the pods so new
+        images are pulled and nodes added by the autoscaler pull them all before challeneges land there
 
-    def createChallenges(self):
-        """Creates all the challeneges and deploys them
+        Args:
+            images (dict): The image pinned to its digest for every challenege
+
+        Returns:
+            (dict): The rendered manifest
         """
+        mani = render.render('backend/prepull.yaml', render.prepullValues(**self.settings['infra'].get('prepull-images', {})))
+
+        # Makes an init container for every image from the one in the template
+        init = mani['spec']['template']['spec']['initContainers']
+        pattern = init.pop()
+        for name, image in sorted(images.items()):
+            init.append(dict(copy.deepcopy(pattern), name=f'prepull-{name}'[:63], image=image))
+
+        self.writeManifest(mani, "config/backend/prepull.yaml")
+        return mani
 
-        # Loops through all the challeneges
-        for count ,dir in enumerate(os.listdir('challeneges')):
+    def deployChallenge(self, file, settings, port=None, force=False):
+        """Deploys a single challenege
+
+        Args:
+            file (str): the challenege folder
+            settings (dict): the challeneg settings
+            port (int, optional): the node port of the challenege. Defaults to its port in the port index.
+            force (bool, optional): Rebuilds the image even if it is in the build cache. Defaults to False.
+        """
+        if port is None:
+            port = portIndex().allocate(settings['name'], settings.get('node-port'))
+        build = self.buildChallenge(file, settings, force)
+        image = self.pushChallenge(build)
+        self.applyChallenge(file, settings, port, image)
+
+    def createChallenges(self, build_workers=None, push_workers=None, apply_workers=None, force=False):
+        """Creates all the challeneges and deploys them, the build, push and deploy of different
+        challeneges overlap and each stage has its own amount of workers
+
+        Args:
+            build_workers (int, optional): The max amount of images built at once. Defaults to infra.build-workers in the settings or 2.
+            push_workers (int, optional): The max amount of images pushed at once, or built at once for in cluster builds. Defaults to infra.push-workers in the settings or 4.
+            apply_workers (int, optional): The max amount of challeneges deployed to the cluster at once. Defaults to infra.apply-workers in the settings or 4.
+            force (bool, optional): Rebuilds every image even if it is in the build cache. Defaults to False.
+        """
+
+        # Loops through all the challeneges and gets the ones that need deploying
+        found = []
+        for dir in sorted(os.listdir('challeneges')):
             dir = f'challeneges/{dir}'
             # Opens the challeneges config file and loads it
             with open(f'{dir}/chal.yaml') as f:
@@ -417,5 +766,59 @@ class kube():
 
             # Deploys the challenege if needed
             if chal['needs-deployed']:
-                self.deployChallenge(dir, chal, count)
+                found.append((dir, chal))
+
+        # Frees the ports of removed challeneges then gives every challenege its port, pinned ports go first so they cant be taken.
+        # Instanced challeneges dont get one as every instance gets its own
+        ports = portIndex()
+        ports.retain(chal['name'] for _, chal in found if not chal.get('instanced'))
+        found.sort(key=lambda item: item[1].get('node-port') is None)
+        chals = [(chal['name'], (dir, chal, None if chal.get('instanced') else ports.allocate(chal['name'], chal.get('node-port')))) for dir, chal in found]
+
+        # Makes the namespace for the instances if any challenege is instanced
+        instances = None
+        if any(chal.get('instanced') for _, chal in found):
+            instances = instancer(self)
+            instances.createNamespace()
+
+        # Gets the amount of workers for every stage
+        infra = self.settings['infra']
+        build_workers = build_workers or infra.get('build-workers', 2)
+        push_workers = push_workers or infra.get('push-workers', 4)
+        apply_workers = apply_workers or infra.get('apply-workers', 4)
+
+        def build(item):
+            dir, chal, port = item
+            return self.buildChallenge(dir, chal, force), item
+
+        def push(built):
+            build, item = built
+            return self.pushChallenge(build), item
+
+        # The images that are pinned to a digest so they can be pre-pulled
+        pinned = {}
+
+        def apply(pushed):
+            image, item = pushed
+            dir, chal, port = item
+            if '@' in image:
+                pinned[chal['name']] = image
+            # Instanced challeneges get their pool of idle instances instead of a shared deployment
+            if chal.get('instanced'):
+                instances.fill(chal, image)
+            else:
+                self.applyChallenge(*item, image)
+
+        # Runs every challenege through the build, push and deploy stages
+        stages = pipeline()
+        stages.add('build', build, build_workers)
+        stages.add('push', push, push_workers)
+        stages.add('apply', apply, apply_workers)
+        try:
+            stages.run(chals)
+        finally:
+            stages.report()
 
+        # Warms every image on every node so pods dont wait on the registry when they restart or scale out
+        if infra.get('prepull') and pinned:
+            self.createDaemonSet(self.parsePrepull(pinned), 'backend')
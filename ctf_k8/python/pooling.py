@@ -0,0 +1,101 @@
+import hashlib
+
+
+def settings(infra):
+    """Gets the MySQL connection pooling settings from infra.mysql.pool
+
+    Args:
+        infra (dict): The infra settings
+
+    Returns:
+        (dict): The mode, size, read_replicas, image and threads
+    """
+    pool = (infra.get('mysql') or {}).get('pool') or {}
+    return {
+        'mode': pool.get('mode', 'direct'),
+        'size': int(pool.get('size', 20)),
+        'read_replicas': pool.get('read-replicas', True),
+        'image': pool.get('image', 'proxysql/proxysql:2.6.3'),
+        'threads': int(pool.get('threads', 2)),
+    }
+
+
+def quote(value):
+    """Quotes a value for a ProxySQL config file
+
+    Args:
+        value (any): The value
+
+    Returns:
+        (str): The quoted value
+    """
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def proxysqlConfig(mysql, pool):
+    """Makes the proxysql.cnf for the ProxySQL sidecar. Writes and transactions go to the primary
+    (hostgroup 10) and plain SELECTs go to the read replicas (hostgroup 20) when there are any.
+    Every CTFd pod runs its own sidecar so the connections to the DB are pods * pool size
+
+    Args:
+        mysql (dict): The MySQL details, private_connection and replicas are used
+        pool (dict): The pooling settings from settings()
+
+    Returns:
+        (str): The config file
+    """
+    primary = mysql['private_connection']
+    replicas = [replica['private_connection'] for replica in mysql.get('replicas') or [] if replica.get('private_connection')]
+    if not pool['read_replicas']:
+        replicas = []
+
+    # The primary and every replica, Digital Ocean only accepts connections over TLS
+    servers = [{'address': primary['host'], 'port': primary['port'], 'hostgroup': 10}]
+    servers += [{'address': replica['host'], 'port': replica['port'], 'hostgroup': 20} for replica in replicas]
+    lines = [
+        'datadir="/var/lib/proxysql"',
+        'admin_variables=',
+        '{',
+        '    admin_credentials="admin:admin"',
+        '    mysql_ifaces="127.0.0.1:6032"',
+        '}',
+        'mysql_variables=',
+        '{',
+        f'    threads={pool["threads"]}',
+        '    interfaces="127.0.0.1:6033"',
+        '    server_version="8.0.30"',
+        '    multiplexing=true',
+        f'    max_connections={pool["size"] * 50}',
+        '}',
+        'mysql_servers=',
+        '(',
+        ',\n'.join(f'    {{ address={quote(server["address"])}, port={server["port"]}, hostgroup={server["hostgroup"]}, max_connections={pool["size"]}, use_ssl=1 }}' for server in servers),
+        ')',
+        'mysql_users=',
+        '(',
+        f'    {{ username={quote(primary["user"])}, password={quote(primary["password"])}, default_hostgroup=10, transaction_persistent=1 }}',
+        ')',
+    ]
+
+    # Locking reads stay on the primary, every other SELECT goes to the replicas
+    if replicas:
+        lines += [
+            'mysql_query_rules=',
+            '(',
+            '    { rule_id=1, active=1, match_digest="^SELECT .* FOR UPDATE", destination_hostgroup=10, apply=1 },',
+            '    { rule_id=2, active=1, match_digest="^SELECT", destination_hostgroup=20, apply=1 }',
+            ')',
+        ]
+    return '\n'.join(lines) + '\n'
+
+
+def checksum(config):
+    """Gets a short hash of the config, it is put on the pod template so the pods restart when it changes
+
+    Args:
+        config (str): The config file
+
+    Returns:
+        (str): The hash
+    """
+    return hashlib.sha256(config.encode()).hexdigest()[:16]
@@ -0,0 +1,140 @@
+import os
+import threading
+import yaml
+
+
+class portIndex():
+    """Keeps the node port of every challenege the same between deploys, ports of removed
+    challeneges are freed and given to new ones
+
+    Varibles:
+        path (str): The path of the index file, it is a plain name: port yaml file
+        low (int): The lowest node port that can be used
+        high (int): The highest node port that can be used
+        ports (dict): The node port of every challenege
+    """
+
+    path = None
+    low = None
+    high = None
+    ports = None
+
+    def __init__(self, path='config/backend/ports.yaml', low=30000, high=32767):
+        """Loads the index if it exists
+
+        Args:
+            path (str, optional): The path of the index file. Defaults to 'config/backend/ports.yaml'.
+            low (int, optional): The lowest node port that can be used. Defaults to 30000.
+            high (int, optional): The highest node port that can be used. Defaults to 32767.
+        """
+        self.path = path
+        self.low = low
+        self.high = high
+        self.lock = threading.RLock()
+        self.ports = {}
+
+        try:
+            with open(path) as f:
+                ports = yaml.load(f.read(), Loader=yaml.CLoader) or {}
+        except FileNotFoundError:
+            ports = {}
+
+        # Older deploys appended to the file so a name can be in it more than once, yaml keeps the last one
+        # and a port that clashes is dropped so the challenege gets a new one
+        for name, port in ports.items():
+            try:
+                self.reserve(name, port, save=False)
+            except ValueError:
+                pass
+
+    def save(self):
+        """Writes the index to its file
+        """
+        with self.lock:
+            with open(f'{self.path}.tmp', 'w') as f:
+                f.write(yaml.dump(dict(sorted(self.ports.items(), key=lambda item: item[1])), Dumper=yaml.CDumper))
+            os.replace(f'{self.path}.tmp', self.path)
+
+    def owner(self, port):
+        """Gets the challenege that has a port
+
+        Args:
+            port (int): The node port
+
+        Returns:
+            (str): The name of the challenege or None if the port is free
+        """
+        for name, used in self.ports.items():
+            if used == port:
+                return name
+        return None
+
+    def reserve(self, name, port, save=True):
+        """Gives a challenege a specific port
+
+        Args:
+            name (str): The name of the challenege
+            port (int): The node port it needs
+            save (bool, optional): Writes the index after. Defaults to True.
+
+        Returns:
+            (int): The port
+        """
+        port = int(port)
+        if not self.low <= port <= self.high:
+            raise ValueError(f'Port {port} for {name} is outside the node port range {self.low}-{self.high}')
+
+        with self.lock:
+            owner = self.owner(port)
+            if owner is not None and owner != name:
+                raise ValueError(f'Port {port} for {name} is already used by {owner}')
+            self.ports[name] = port
+            if save:
+                self.save()
+        return port
+
+    def allocate(self, name, port=None):
+        """Gets the port for a challenege, it keeps its port if it has one otherwise it gets the lowest free port
+
+        Args:
+            name (str): The name of the challenege
+            port (int, optional): A specific port the challenege needs. Defaults to None.
+
+        Returns:
+            (int): The port
+        """
+        with self.lock:
+            if port is not None:
+                return self.reserve(name, port)
+            if name in self.ports:
+                return self.ports[name]
+
+            used = set(self.ports.values())
+            for free in range(self.low, self.high + 1):
+                if free not in used:
+                    return self.reserve(name, free)
+        raise ValueError(f'No free node ports left for {name}')
+
+    def release(self, name):
+        """Frees the port of a challenege
+
+        Args:
+            name (str): The name of the challenege
+        """
+        with self.lock:
+            if self.ports.pop(name, None) is not None:
+                self.save()
+
+    def retain(self, names):
+        """Frees the ports of every challenege that isnt in a list
+
+        Args:
+            names (list): The challeneges that are still deployed
+        """
+        with self.lock:
+            names = set(names)
+            removed = [name for name in self.ports if name not in names]
+            for name in removed:
+                del self.ports[name]
+            if removed:
+                self.save()
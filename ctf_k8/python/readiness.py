@@ -0,0 +1,116 @@
+import random
+import time
+from python import tracing
+
+
+class ReadinessTimeout(TimeoutError):
+    """Raised when a resource isnt ready before its deadline
+
+    Varibles:
+        what (str): The resource that was being waited on
+        waited (float): How long it was waited on in seconds
+        last (any): The last state that was seen
+    """
+
+    def __init__(self, what, waited, last=None):
+        self.what = what
+        self.waited = waited
+        self.last = last
+        super().__init__(f'{what} was not ready after {waited:.0f}s (last state: {last})')
+
+
+def poll(get, ready, what, timeout=1800, initial=2, maximum=30, factor=1.5):
+    """Polls a resource until it is ready. The delay between checks grows each time the state
+    stays the same and goes back to the start when the state changes, every delay is jittered
+    so parallel waits dont hit the API at the same time
+
+    Args:
+        get (function): Gets the current state of the resource
+        ready (function): Gets called with the state and returns True once the resource is ready
+        what (str): The name of the resource used in the timeout error
+        timeout (int, optional): Seconds to wait before giving up. Defaults to 1800.
+        initial (int, optional): The first delay in seconds. Defaults to 2.
+        maximum (int, optional): The longest delay in seconds. Defaults to 30.
+        factor (float, optional): How much the delay grows after each check. Defaults to 1.5.
+
+    Returns:
+        (any): The state once the resource is ready
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    delay = initial
+    last = None
+
+    while True:
+        state = get()
+        if ready(state):
+            return state
+
+        # Checks more often again when the resource is moving through its states
+        if state != last:
+            delay = initial
+        last = state
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise ReadinessTimeout(what, time.monotonic() - start, state)
+
+        tracing.sleep(min(remaining, random.uniform(delay / 2, delay)))
+        delay = min(maximum, delay * factor)
+
+
+def watch(list_func, ready, what, timeout=600, **kwargs):
+    """Waits for a Kubernetes object with the watch API so it is seen as soon as it is ready.
+    The watch resumes from the last resourceVersion if the connection drops and lists again if
+    that version has expired
+
+    Args:
+        list_func (function): The list method of the Kubernetes client for the object
+        ready (function): Gets called with the object and returns True once it is ready
+        what (str): The name of the object used in the timeout error
+        timeout (int, optional): Seconds to wait before giving up. Defaults to 600.
+        **kwargs: Passed to the list method, eg namespace and field_selector
+
+    Returns:
+        (any): The object once it is ready
+    """
+    from kubernetes import watch as kwatch
+    from kubernetes.client.rest import ApiException
+
+    start = time.monotonic()
+    deadline = start + timeout
+    version = None
+    last = None
+
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise ReadinessTimeout(what, time.monotonic() - start, last)
+
+        # Lists the objects to check the current state and get a version to watch from
+        if version is None:
+            items = list_func(**kwargs)
+            version = items.metadata.resource_version
+            for obj in items.items:
+                last = obj.status
+                if ready(obj):
+                    return obj
+
+        # Watches for changes from the last version seen, the time spent in the watch is counted as waiting
+        stream = kwatch.Watch()
+        watched = time.monotonic()
+        try:
+            for event in stream.stream(list_func, resource_version=version, timeout_seconds=max(1, int(remaining)), **kwargs):
+                obj = event['object']
+                version = obj.metadata.resource_version
+                last = obj.status
+                if event['type'] != 'DELETED' and ready(obj):
+                    stream.stop()
+                    return obj
+        except ApiException as e:
+            # The version is too old to watch from so it is listed again
+            if e.status != 410:
+                raise
+            version = None
+        finally:
+            tracing.count('wait.seconds', time.monotonic() - watched)
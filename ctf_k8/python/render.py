@@ -0,0 +1,294 @@
+import copy
+import os
+import shlex
+import threading
+import yaml
+from dataclasses import dataclass, field
+
+
+@dataclass
+class frontendValues:
+    """The values that get rendered into the frontend manifests
+    """
+    image: str = 'ctfd/ctfd'
+    database_url: str = ''
+    redis_url: str = ''
+    domain: str = ''
+    tls_cert: str = ''
+    tls_key: str = ''
+    min_replicas: int = 1
+    max_replicas: int = 9
+    cpu: int = 60
+    workers: int = 1
+    threads: int = 1
+    worker_class: str = 'gevent'
+    resources: dict = field(default_factory=dict)
+    proxysql_config: str = ''
+    proxysql_image: str = 'proxysql/proxysql:2.6.3'
+    env: dict = field(default_factory=dict)
+
+
+@dataclass
+class prepullValues:
+    """The values that get rendered into the image pre-pull DaemonSet
+    """
+    busybox: str = 'busybox:1.36-musl'
+    pause: str = 'registry.k8s.io/pause:3.9'
+
+
+@dataclass
+class buildValues:
+    """The values that get rendered into an in cluster build Job and the secret it uses
+    """
+    job: str = ''
+    context: str = ''
+    destination: str = ''
+    image: str = 'gcr.io/kaniko-project/executor:v1.23.2'
+    endpoint: str = ''
+    region: str = ''
+    args: list = field(default_factory=list)
+    resources: dict = field(default_factory=dict)
+    timeout: int = 1800
+    registry_auth: str = ''
+    space_key: str = ''
+    space_secret: str = ''
+
+
+@dataclass
+class challengeValues:
+    """The values that get rendered into the manifests of a challenege
+    """
+    name: str
+    image: str
+    port: int
+    node_port: int
+    live_command: list = field(default_factory=list)
+    resources: dict = field(default_factory=dict)
+    scale: bool = False
+    min_replicas: int = 1
+    max_replicas: int = 1
+    cpu: int = 70
+
+    @property
+    def pull_policy(self):
+        """Images pinned to a digest never change so nodes only pull them once, a tag can be pushed
+        again so it is pulled every time a pod starts
+        """
+        return 'IfNotPresent' if '@' in self.image else 'Always'
+
+    @classmethod
+    def fromSettings(cls, settings, image, node_port, defaults=None):
+        """Makes the values for a challenege from its chal.yaml
+
+        Args:
+            settings (dict): The challenege settings
+            image (str): The image to deploy
+            node_port (int): The node port of the challenege
+            defaults (dict, optional): The infra settings, challenge-resources and challenge-scale are used when the challenege doesnt set them. Defaults to None.
+
+        Returns:
+            (challengeValues): The values
+        """
+        defaults = defaults or {}
+        resources = settings.get('resources', defaults.get('challenge-resources')) or {}
+        scale = settings.get('scale', defaults.get('challenge-scale')) or {}
+        return cls(
+            name=settings['name'],
+            image=image,
+            port=settings['docker-port'],
+            node_port=node_port,
+            live_command=shlex.split(settings['liveCommand'], posix=False),
+            resources={kind: dict(resources[kind]) for kind in ('requests', 'limits') if resources.get(kind)},
+            scale=bool(scale),
+            min_replicas=scale.get('min', 1),
+            max_replicas=scale.get('max', scale.get('min', 1)),
+            cpu=scale.get('cpu', 70),
+        )
+
+
+class template():
+    """A manifest template that is parsed once, rendering it copies the parsed manifest and sets the
+    bound values instead of loading and dumping the yaml again
+
+    A binding is a path into the manifest and the value to set there. Each step of the path is a key,
+    a list index or a dict that selects the list item with those fields (eg {'name': 'REDIS_URL'}).
+    The value is the name of a field in the values or a function that gets the values.
+
+    Varibles:
+        path (str): The path of the template file
+        manifest (dict): The parsed template
+        bindings (list): The (path, value) pairs set when rendering
+    """
+
+    path = None
+    manifest = None
+    bindings = None
+
+    def __init__(self, path, bindings):
+        """Parses the template
+
+        Args:
+            path (str): The path of the template file
+            bindings (list): The (path, value) pairs set when rendering
+        """
+        self.path = path
+        self.bindings = bindings
+        with open(path) as f:
+            self.manifest = yaml.load(f.read(), Loader=yaml.CLoader)
+
+    def step(self, node, key):
+        """Gets the child of a node for one step of a binding path
+
+        Args:
+            node (any): The current dict or list
+            key (any): The key, index or selector
+
+        Returns:
+            (any): The child
+        """
+        if isinstance(key, dict):
+            for item in node:
+                if all(item.get(k) == v for k, v in key.items()):
+                    return item
+            raise KeyError(f'{self.path}: nothing matches {key}')
+        return node[key]
+
+    def render(self, values):
+        """Renders the template
+
+        Args:
+            values (any): The values, eg frontendValues or challengeValues
+
+        Returns:
+            (dict): The rendered manifest ready to send to the API
+        """
+        mani = copy.deepcopy(self.manifest)
+        for path, value in self.bindings:
+            value = value(values) if callable(value) else getattr(values, value)
+            node = mani
+            for key in path[:-1]:
+                node = self.step(node, key)
+            node[path[-1]] = value
+        return mani
+
+
+container = ('spec', 'template', 'spec', 'containers', 0)
+
+# The values set in every template under templates/kubernetes
+bindings = {
+    'frontend/secret.yaml': [
+        (('data', 'tls.crt'), 'tls_cert'),
+        (('data', 'tls.key'), 'tls_key'),
+    ],
+    'frontend/dep.yaml': [
+        (container + ('image',), 'image'),
+        (container + ('env', {'name': 'DATABASE_URL'}, 'value'), 'database_url'),
+        (container + ('env', {'name': 'REDIS_URL'}, 'value'), 'redis_url'),
+        (container + ('env', {'name': 'WORKERS'}, 'value'), lambda v: str(v.workers)),
+        (container + ('env', {'name': 'WORKER_CLASS'}, 'value'), 'worker_class'),
+        (container + ('resources',), 'resources'),
+    ],
+    'frontend/scale.yaml': [
+        (('spec', 'maxReplicas'), 'max_replicas'),
+        (('spec', 'minReplicas'), 'min_replicas'),
+        (('spec', 'targetCPUUtilizationPercentage'), 'cpu'),
+    ],
+    'frontend/ingress.yaml': [
+        (('spec', 'tls', 0, 'hosts', 0), 'domain'),
+        (('spec', 'rules', 0, 'host'), 'domain'),
+    ],
+    'frontend/service.yaml': [],
+    'frontend/proxysql.yaml': [
+        (('stringData', 'proxysql.cnf'), 'proxysql_config'),
+    ],
+    'frontend/proxysql-sidecar.yaml': [
+        (('container', 'image'), 'proxysql_image'),
+    ],
+    'frontend/namespace.yaml': [],
+    'backend/namespace.yaml': [],
+    'instances/namespace.yaml': [],
+    'backend/dep.yaml': [
+        (('metadata', 'name'), lambda v: f'ctf-backend-{v.name}'),
+        (('metadata', 'labels', 'app'), lambda v: f'ctf-{v.name}'),
+        (('spec', 'selector', 'matchLabels', 'app'), lambda v: f'ctf-{v.name}'),
+        (('spec', 'template', 'metadata', 'labels', 'app'), lambda v: f'ctf-{v.name}'),
+        (container + ('name',), lambda v: f'ctf-{v.name}'),
+        (container + ('image',), 'image'),
+        (container + ('imagePullPolicy',), 'pull_policy'),
+        (container + ('livenessProbe', 'exec', 'command'), 'live_command'),
+        (container + ('resources',), 'resources'),
+        (('spec', 'replicas'), 'min_replicas'),
+    ],
+    'backend/prepull.yaml': [
+        (('spec', 'template', 'spec', 'initContainers', {'name': 'prepull-copy'}, 'image'), 'busybox'),
+        (container + ('image',), 'pause'),
+    ],
+    'backend/build.yaml': [
+        (('metadata', 'name'), 'job'),
+        (('spec', 'activeDeadlineSeconds'), 'timeout'),
+        (container + ('image',), 'image'),
+        (container + ('args',), lambda v: [f'--context={v.context}', f'--destination={v.destination}', '--digest-file=/dev/termination-log'] + v.args),
+        (container + ('env', {'name': 'S3_ENDPOINT'}, 'value'), 'endpoint'),
+        (container + ('env', {'name': 'AWS_REGION'}, 'value'), 'region'),
+        (container + ('resources',), 'resources'),
+    ],
+    'backend/build-secret.yaml': [
+        (('stringData', 'config.json'), 'registry_auth'),
+        (('stringData', 'AWS_ACCESS_KEY_ID'), 'space_key'),
+        (('stringData', 'AWS_SECRET_ACCESS_KEY'), 'space_secret'),
+    ],
+    'backend/scale.yaml': [
+        (('metadata', 'name'), lambda v: f'ctf-backend-{v.name}'),
+        (('spec', 'scaleTargetRef', 'name'), lambda v: f'ctf-backend-{v.name}'),
+        (('spec', 'minReplicas'), 'min_replicas'),
+        (('spec', 'maxReplicas'), 'max_replicas'),
+        (('spec', 'targetCPUUtilizationPercentage'), 'cpu'),
+    ],
+    'backend/service.yaml': [
+        (('metadata', 'name'), lambda v: f'ctf-{v.name}-service'),
+        (('spec', 'selector', 'app'), lambda v: f'ctf-{v.name}'),
+        (('spec', 'ports', 0, 'targetPort'), 'port'),
+        (('spec', 'ports', 0, 'nodePort'), 'node_port'),
+    ],
+}
+
+templates = {}
+lock = threading.Lock()
+
+def load(name, root='templates/kubernetes'):
+    """Gets a template, it is only parsed the first time
+
+    Args:
+        name (str): The path of the template under the templates folder eg frontend/dep.yaml
+        root (str, optional): The templates folder. Defaults to 'templates/kubernetes'.
+
+    Returns:
+        (template): The parsed template
+    """
+    path = os.path.join(root, name)
+    with lock:
+        if path not in templates:
+            templates[path] = template(path, bindings[name])
+        return templates[path]
+
+def render(name, values=None):
+    """Renders a template
+
+    Args:
+        name (str): The path of the template under the templates folder eg frontend/dep.yaml
+        values (any, optional): The values to set in the template. Defaults to None.
+
+    Returns:
+        (dict): The rendered manifest
+    """
+    return load(name).render(values)
+
+def write(mani, path):
+    """Writes a rendered manifest to a file
+
+    Args:
+        mani (dict): The rendered manifest
+        path (str): The path to write it to
+    """
+    with open(path, 'w') as f:
+        f.write(yaml.dump(mani, Dumper=yaml.CDumper))
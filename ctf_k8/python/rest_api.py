@@ -0,0 +1,208 @@
+import random
+import re
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from python import tracing
+
+
+class restApi():
+    """Client for a JSON API like Digital Ocean or CTFd that reuses connections, retries failed calls and
+    stays under the rate limit when the API sends RateLimit headers
+
+    Varibles:
+        url (str): The base url of the API
+        http (requests.Session): The pooled session used for every call
+        timeout (tuple): The connect and read timeouts for every call
+        retries (int): The max amount of times a call is retried
+        remaining (int): The calls left in the current rate limit window
+        reset (float): The time the rate limit window resets
+        rateLimit (bool): Reads the RateLimit headers Digital Ocean sends
+        metrics (dict): The amount of calls, retries and total latency for every endpoint
+    """
+
+    url = None
+    http = None
+    timeout = None
+    retries = None
+    remaining = None
+    reset = None
+    rateLimit = True
+    metrics = None
+
+    # Methods that are safe to send again if the server fails
+    idempotent = ('GET', 'PUT', 'DELETE', 'HEAD')
+
+    def __init__(self, token, url='https://api.digitalocean.com/v2', scheme='Bearer', timeout=(5, 30), retries=5, pool=16, verify=True, rateLimit=True):
+        """Creates the session for the API
+
+        Args:
+            token (str): The API token
+            url (str, optional): The base url of the API. Defaults to 'https://api.digitalocean.com/v2'.
+            scheme (str, optional): The scheme of the Authorization header, CTFd uses Token. Defaults to 'Bearer'.
+            timeout (tuple, optional): The connect and read timeouts in seconds. Defaults to (5, 30).
+            retries (int, optional): The max amount of times a call is retried. Defaults to 5.
+            pool (int, optional): The max amount of open connections. Defaults to 16.
+            verify (bool, optional): Checks the TLS cert of the API. Defaults to True.
+            rateLimit (bool, optional): Waits for the rate limit window from the RateLimit headers. Defaults to True.
+        """
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.retries = retries
+        self.rateLimit = rateLimit
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+        # Keeps connections open between calls so each one doesnt do a new TLS handshake
+        self.http = requests.Session()
+        self.http.mount('https://', HTTPAdapter(pool_connections=pool, pool_maxsize=pool))
+        self.http.mount('http://', HTTPAdapter(pool_connections=pool, pool_maxsize=pool))
+        self.http.verify = verify
+        self.http.headers.update({
+            'Content-Type': 'application/json',
+            'Authorization': f'{scheme} {token}',
+        })
+
+    def endpoint(self, method, path):
+        """Gets the name an API call is recorded under, ids are replaced so calls to the same endpoint are grouped
+
+        Args:
+            method (str): The HTTP method
+            path (str): The path of the call
+
+        Returns:
+            (str): The method and path with the ids removed
+        """
+        path = path.split('?')[0]
+        path = re.sub(r'/[0-9a-f]{8}-[0-9a-f-]{27,}', '/{id}', path)
+        path = re.sub(r'/\d+(?=/|$)', '/{id}', path)
+        return f'{method} {path}'
+
+    def _record(self, name, latency, retried):
+        """Adds a call to the metrics
+
+        Args:
+            name (str): The endpoint of the call
+            latency (float): How long the call took in seconds
+            retried (bool): If the call was a retry
+        """
+        with self.lock:
+            metric = self.metrics.setdefault(name, {'calls': 0, 'retries': 0, 'seconds': 0.0})
+            metric['calls'] += 1
+            metric['retries'] += int(retried)
+            metric['seconds'] += latency
+        if retried:
+            tracing.count('http.retries')
+
+    def _throttle(self):
+        """Waits for the rate limit window to reset if there are almost no calls left in it
+        """
+        with self.lock:
+            remaining, reset = self.remaining, self.reset
+        if remaining is not None and remaining < 5 and reset and reset > time.time():
+            tracing.sleep(reset - time.time())
+
+    def _rateLimit(self, res):
+        """Stores the rate limit from the headers of a response
+
+        Args:
+            res (requests.Response): The response from the API
+        """
+        if not self.rateLimit:
+            return
+        try:
+            with self.lock:
+                self.remaining = int(res.headers['RateLimit-Remaining'])
+                self.reset = float(res.headers['RateLimit-Reset'])
+        except (KeyError, ValueError):
+            pass
+
+    def _delay(self, res, attempt):
+        """Gets how long to wait before retrying a call
+
+        Args:
+            res (requests.Response): The failed response or None if the call didnt connect
+            attempt (int): How many times the call has been tried
+
+        Returns:
+            (float): Seconds to wait
+        """
+        if res is not None:
+            if 'Retry-After' in res.headers:
+                try:
+                    return float(res.headers['Retry-After'])
+                except ValueError:
+                    pass
+            if res.status_code == 429 and self.rateLimit and 'RateLimit-Reset' in res.headers:
+                try:
+                    return max(0, float(res.headers['RateLimit-Reset']) - time.time())
+                except ValueError:
+                    pass
+        return random.uniform(0, min(30, 2 ** attempt))
+
+    def request(self, method, path, **kwargs):
+        """Calls the API, connection errors, 429s and 5xxs (for idempotent methods) are retried with backoff
+
+        Args:
+            method (str): The HTTP method
+            path (str): The path of the call after the base url
+            **kwargs: Passed to requests, eg json and params
+
+        Returns:
+            (requests.Response): The response from the API
+        """
+        method = method.upper()
+        name = self.endpoint(method, path)
+        kwargs.setdefault('timeout', self.timeout)
+
+        attempt = 0
+        while True:
+            self._throttle()
+            start = time.monotonic()
+            res = None
+            try:
+                res = self.http.request(method, f'{self.url}/{path.lstrip("/")}', **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.retries or method not in self.idempotent:
+                    raise
+            finally:
+                self._record(name, time.monotonic() - start, attempt > 0)
+
+            if res is not None:
+                self._rateLimit(res)
+                retry = res.status_code == 429 or (res.status_code >= 500 and method in self.idempotent)
+                if not retry or attempt >= self.retries:
+                    return res
+
+            tracing.sleep(self._delay(res, attempt))
+            attempt += 1
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.request('PATCH', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+    def report(self):
+        """Prints the amount of calls, retries and the latency for every endpoint used
+        """
+        with self.lock:
+            metrics = dict(self.metrics)
+        if not metrics:
+            return
+
+        width = max(len(name) for name in metrics)
+        print(f'{"endpoint".ljust(width)}  {"calls":>5}  {"retries":>7}  {"avg":>7}  {"total":>7}')
+        for name, metric in sorted(metrics.items(), key=lambda item: -item[1]['seconds']):
+            avg = metric['seconds'] / metric['calls']
+            print(f'{name.ljust(width)}  {metric["calls"]:5}  {metric["retries"]:7}  {avg:6.2f}s  {metric["seconds"]:6.1f}s')
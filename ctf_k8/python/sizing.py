@@ -0,0 +1,179 @@
+import math
+import re
+
+
+def nodeSize(slug):
+    """Gets the vcpus and memory of a Digital Ocean droplet size slug eg s-2vcpu-4gb, c-4 or g-2vcpu-8gb
+
+    Args:
+        slug (str): The size slug
+
+    Returns:
+        (tuple): The vcpus and the memory in MB
+    """
+    match = re.search(r'(\d+)vcpu-(\d+)(gb|mb)', slug)
+    if match:
+        memory = int(match.group(2)) * (1024 if match.group(3) == 'gb' else 1)
+        return int(match.group(1)), memory
+
+    # CPU optimized sizes only have the vcpus in the name and have 2GB per vcpu
+    match = re.fullmatch(r'c-(\d+)(-intel)?', slug)
+    if match:
+        return int(match.group(1)), int(match.group(1)) * 2048
+
+    raise ValueError(f'Unknown node size {slug}')
+
+
+def frontendProfile(slug, settings=None):
+    """Works out the gunicorn workers and the container resources for CTFd from the node size.
+    Each node is split between pods-per-node CTFd pods after leaving room for the system pods,
+    each pod gets 2 * cores + 1 workers as long as there is memory for them
+
+    Args:
+        slug (str): The node size slug
+        settings (dict, optional): The ctfd settings, workers, threads, worker-class, pods-per-node,
+            cpu-request, memory-request and memory-limit override what is worked out. Defaults to None.
+
+    Returns:
+        (dict): The workers, threads, worker_class and resources
+    """
+    settings = settings or {}
+    vcpus, memory = nodeSize(slug)
+
+    # Leaves part of every node for kubelet and the system pods
+    pods = max(1, int(settings.get('pods-per-node', 2)))
+    cpu = max(100, int(vcpus * 1000 * 0.8 / pods))
+    mem = max(256, int(memory * 0.7 / pods))
+
+    # A CTFd worker needs about 150MB so the memory caps the workers on small nodes
+    workers = max(1, min(2 * math.ceil(cpu / 1000) + 1, mem // 150))
+    worker_class = settings.get('worker-class', 'gevent')
+
+    return {
+        'workers': int(settings.get('workers', workers)),
+        'threads': int(settings.get('threads', 4 if worker_class == 'gthread' else 1)),
+        'worker_class': worker_class,
+        'resources': {
+            'requests': {
+                'cpu': str(settings.get('cpu-request', f'{cpu}m')),
+                'memory': str(settings.get('memory-request', f'{mem}Mi')),
+            },
+            'limits': {
+                'memory': str(settings.get('memory-limit', settings.get('memory-request', f'{mem}Mi'))),
+            },
+        },
+    }
+
+
+# The sizes the old 1-4 size numbers map to
+nodeSlugs = {1: 's-1vcpu-2gb', 2: 's-2vcpu-2gb', 3: 's-2vcpu-4gb'}
+dbSlugs = {1: 'db-s-1vcpu-1gb', 2: 'db-s-1vcpu-2gb', 3: 'db-s-2vcpu-4gb', 4: 'db-s-4vcpu-8gb'}
+
+# Node sizes the estimator picks from, smallest first
+nodeChoices = ['s-1vcpu-2gb', 's-2vcpu-4gb', 's-4vcpu-8gb', 's-8vcpu-16gb', 'c-16', 'c-32']
+
+
+def slug(size, table):
+    """Gets a size slug, any Digital Ocean slug is passed through and the old 1-4 numbers are looked up
+
+    Args:
+        size (any): The slug or size number
+        table (dict): The slug for every size number
+
+    Returns:
+        (str): The size slug
+    """
+    if isinstance(size, int):
+        if size not in table:
+            raise ValueError(f'Unknown size {size}, use 1-{max(table)} or a Digital Ocean size slug')
+        return table[size]
+    return str(size)
+
+
+def cluster(infra):
+    """Gets the cluster sizing from the infra settings
+
+    Args:
+        infra (dict): The infra settings, region and the cluster section are used
+
+    Returns:
+        (dict): The region, size, count, scale, min_nodes and max_nodes for session.createKube
+    """
+    settings = infra.get('cluster') or {}
+    count = settings.get('count', 1)
+    return {
+        'region': infra.get('region', 'tor1'),
+        'size': slug(settings.get('size', 1), nodeSlugs),
+        'count': count,
+        'scale': settings.get('auto-scale', True),
+        'min_nodes': settings.get('min-nodes', count),
+        'max_nodes': settings.get('max-nodes', max(count, 3)),
+    }
+
+
+def database(infra, name):
+    """Gets the sizing of a database from the infra settings
+
+    Args:
+        infra (dict): The infra settings, region and the mysql or redis section are used
+        name (str): mysql or redis
+
+    Returns:
+        (dict): The region, size, nodes and replicas for the database
+    """
+    settings = infra.get(name) or {}
+    return {
+        'region': infra.get('region', 'tor1'),
+        'size': slug(settings.get('size', 1), dbSlugs),
+        'nodes': settings.get('nodes', 1),
+        'replicas': settings.get('replicas', 0),
+    }
+
+
+def estimate(players, challenges, deployed=None):
+    """Suggests sizes for an event. It assumes each player makes about one request every two seconds
+    at peak, a CTFd vcpu serves about 40 requests a second and every deployed challenege needs its
+    resource requests plus headroom to scale
+
+    Args:
+        players (int): The amount of players expected
+        challenges (int): The amount of challeneges
+        deployed (int, optional): The amount of challeneges that run in the cluster. Defaults to all of them.
+
+    Returns:
+        (dict): The suggested infra settings
+    """
+    deployed = challenges if deployed is None else deployed
+
+    # vcpus needed for the frontend at peak and for the challeneges scaled up to 2 pods each
+    frontend = math.ceil(players * 0.5 / 40)
+    backend = deployed * 2 * 0.05
+    vcpus = max(1.0, frontend + backend) / 0.8
+
+    # Picks the smallest node that keeps the cluster at 4 nodes or less when it isnt busy
+    for size in nodeChoices:
+        cpus, _ = nodeSize(size)
+        nodes = math.ceil(vcpus / cpus)
+        if nodes <= 4:
+            break
+
+    # Bigger events need bigger databases and a read replica for the scoreboard
+    if players <= 200:
+        mysql, redis, replicas = 'db-s-1vcpu-2gb', 'db-s-1vcpu-1gb', 0
+    elif players <= 1000:
+        mysql, redis, replicas = 'db-s-2vcpu-4gb', 'db-s-1vcpu-2gb', 0
+    else:
+        mysql, redis, replicas = 'db-s-4vcpu-8gb', 'db-s-2vcpu-4gb', 1
+
+    return {
+        'cluster': {
+            'size': size,
+            'count': max(1, nodes),
+            'auto-scale': True,
+            'min-nodes': max(1, nodes),
+            'max-nodes': max(2, nodes * 2),
+        },
+        'mysql': {'size': mysql, 'nodes': 2 if players > 1000 else 1, 'replicas': replicas},
+        'redis': {'size': redis, 'nodes': 1},
+        'max-rep': max(2, 2 * math.ceil(frontend / (cpus * 0.8 / 2))),
+    }
@@ -0,0 +1,155 @@
+import copy
+import json
+import os
+import threading
+import yaml
+
+
+class config(dict):
+    """A parsed config file, it works like the dict it was loaded from with typed helpers for the common values
+    """
+
+    def section(self, name):
+        """Gets a section of the config
+
+        Args:
+            name (str): The name of the section
+
+        Returns:
+            (config): The section or an empty config if it isnt set
+        """
+        return config(self.get(name) or {})
+
+
+class settingsConfig(config):
+    """The settings for the deployment from settings.yaml
+    """
+
+    @property
+    def infra(self):
+        return self.section('infra')
+
+    @property
+    def ctfd(self):
+        return self.section('ctfd')
+
+    @property
+    def dns(self):
+        return self.section('dns')
+
+    @property
+    def instancer(self):
+        return self.section('instancer')
+
+    @property
+    def apiKey(self):
+        return self.infra['api_key']
+
+    @property
+    def domain(self):
+        return self.dns['domain']
+
+
+class resourceConfig(config):
+    """The details of a resource made in Digital Ocean from config/do/*.json
+    """
+
+    @property
+    def id(self):
+        return self.get('id')
+
+
+class store():
+    """Process wide cache of the settings and state files, each file is parsed once and only parsed
+    again if it changes on disk
+
+    Varibles:
+        files (dict): The (mtime, size) and parsed value of every file read keyed by path
+    """
+
+    files = {}
+    lock = threading.Lock()
+
+    @classmethod
+    def read(cls, path, parse, default=None):
+        """Gets a parsed file from the cache, it is parsed again if it changed since it was last read
+
+        Args:
+            path (str): The path of the file
+            parse (function): Turns the text of the file into a value
+            default (any, optional): Returned if the file doesnt exist, parse errors are raised. Defaults to None.
+
+        Returns:
+            (any): A copy of the parsed file so callers can change it without changing the cache
+        """
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return default
+        key = (stat.st_mtime_ns, stat.st_size)
+
+        with cls.lock:
+            cached = cls.files.get(path)
+            if cached is None or cached[0] != key:
+                try:
+                    with open(path) as f:
+                        text = f.read()
+                except FileNotFoundError:
+                    return default
+                value = parse(text)
+                cached = (key, value)
+                cls.files[path] = cached
+
+        return copy.deepcopy(cached[1])
+
+    @classmethod
+    def settings(cls, path='settings.yaml'):
+        """Gets the settings for the deployment
+
+        Args:
+            path (str, optional): The path of the settings file. Defaults to 'settings.yaml'.
+
+        Returns:
+            (settingsConfig): The settings
+        """
+        value = cls.read(path, lambda text: yaml.load(text, Loader=yaml.FullLoader))
+        if value is None:
+            raise FileNotFoundError(f'Could not load the settings from {path}')
+        return settingsConfig(value)
+
+    @classmethod
+    def resource(cls, name):
+        """Gets the details of a resource made in Digital Ocean
+
+        Args:
+            name (str): The name of the resource, eg kube, mysql, redis or registry
+
+        Returns:
+            (resourceConfig): The details or None if the resource hasnt been made
+        """
+        value = cls.read(f'config/do/{name}.json', json.loads)
+        return None if value is None else resourceConfig(value)
+
+    @classmethod
+    def yaml(cls, path):
+        """Gets a yaml state file, eg config/backend/lb.yaml
+
+        Args:
+            path (str): The path of the file
+
+        Returns:
+            (dict): The parsed file or None if it doesnt exist
+        """
+        return cls.read(path, lambda text: yaml.load(text, Loader=yaml.CLoader))
+
+    @classmethod
+    def text(cls, path):
+        """Gets a plain text state file
+
+        Args:
+            path (str): The path of the file
+
+        Returns:
+            (str): The contents of the file or None if it doesnt exist
+        """
+        return cls.read(path, lambda text: text)
@@ -0,0 +1,272 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from python import tracing
+
+
+class graph():
+    """Runs a set of steps in parallel on a thread pool while respecting the dependencies between them
+
+    Varibles:
+        workers (int): The max amount of steps that can run at the same time
+        steps (dict): The function for each step keyed by the step name
+        deps (dict): The names of the steps each step has to wait for
+        timings (dict): The start and end time of each step that has run
+        start (float): The time the last run started
+    """
+
+    workers = None
+    steps = None
+    deps = None
+    timings = None
+    start = None
+
+    def __init__(self, workers=8):
+        """Creates an empty graph
+
+        Args:
+            workers (int, optional): The max amount of steps that can run at the same time. Defaults to 8.
+        """
+        self.workers = workers
+        self.steps = {}
+        self.deps = {}
+        self.timings = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, func, after=()):
+        """Adds a step to the graph
+
+        Args:
+            name (str): The name of the step, used for the dependencies and the report
+            func (function): The function to run for the step, it gets called with no arguments
+            after (list, optional): The names of the steps that need to finish before this one starts. Defaults to ().
+        """
+        if name in self.steps:
+            raise ValueError(f'Step {name} is already in the graph')
+        self.steps[name] = func
+        self.deps[name] = list(after)
+
+    def order(self):
+        """Checks the graph and gets an order the steps can run in
+
+        Returns:
+            (list): The step names in dependency order
+        """
+
+        # Makes sure every dependency is a real step
+        for name, deps in self.deps.items():
+            for dep in deps:
+                if dep not in self.steps:
+                    raise ValueError(f'Step {name} depends on unknown step {dep}')
+
+        # Sorts the steps so every step comes after its dependencies
+        order = []
+        done = set()
+        pending = list(self.steps)
+        while pending:
+            ready = [name for name in pending if all(dep in done for dep in self.deps[name])]
+            if not ready:
+                raise ValueError(f'Dependency cycle between steps {", ".join(pending)}')
+            for name in ready:
+                order.append(name)
+                done.add(name)
+                pending.remove(name)
+        return order
+
+    def _runStep(self, name):
+        """Runs a single step and records how long it took
+
+        Args:
+            name (str): The name of the step
+        """
+        start = time.monotonic()
+        try:
+            self.steps[name]()
+        finally:
+            with self.lock:
+                self.timings[name] = (start, time.monotonic())
+
+    def run(self):
+        """Runs all the steps, each step starts as soon as all of its dependencies are done.
+        If a step fails no new steps are started and the error is raised once the running steps finish
+        """
+
+        # Validates the graph before anything is started
+        self.order()
+
+        self.start = time.monotonic()
+        self.timings = {}
+        done = set()
+        running = {}
+        error = None
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while True:
+
+                # Starts every step that has all of its dependencies done
+                if error is None:
+                    for name in self.steps:
+                        if name in done or name in running.values():
+                            continue
+                        if all(dep in done for dep in self.deps[name]):
+                            running[pool.submit(tracing.wrap(self._runStep), name)] = name
+
+                if not running:
+                    break
+
+                # Waits for at least one step to finish
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    if future.exception() is not None:
+                        error = error or future.exception()
+                    else:
+                        done.add(name)
+
+        if error is not None:
+            raise error
+
+    def criticalPath(self):
+        """Gets the chain of steps that decided how long the run took
+
+        Returns:
+            (list): The step names on the critical path from first to last
+        """
+        if not self.timings:
+            return []
+
+        # Starts at the step that finished last and walks back through the dependency that finished last
+        path = [max(self.timings, key=lambda name: self.timings[name][1])]
+        while True:
+            deps = [dep for dep in self.deps[path[0]] if dep in self.timings]
+            if not deps:
+                break
+            path.insert(0, max(deps, key=lambda name: self.timings[name][1]))
+        return path
+
+    def report(self):
+        """Prints the start time and duration of every step and the critical path
+        """
+        if not self.timings:
+            return
+
+        path = self.criticalPath()
+        width = max(len(name) for name in self.timings)
+
+        print(f'{"step".ljust(width)}  {"start":>8}  {"duration":>8}')
+        for name, (start, end) in sorted(self.timings.items(), key=lambda item: item[1][0]):
+            mark = ' *' if name in path else ''
+            print(f'{name.ljust(width)}  {start - self.start:7.1f}s  {end - start:7.1f}s{mark}')
+
+        total = max(end for _, end in self.timings.values()) - self.start
+        print(f'total {total:.1f}s, critical path (*): {" -> ".join(path)}')
+
+
+class pipeline():
+    """Runs a list of items through a set of stages, every stage has its own worker pool so
+    different items can be in different stages at the same time
+
+    Varibles:
+        stages (list): The name, function and worker count of each stage in order
+        timings (dict): The start and end time of every stage for every item
+        errors (dict): The error for every item that failed
+    """
+
+    stages = None
+    timings = None
+    errors = None
+
+    def __init__(self):
+        """Creates a pipeline with no stages
+        """
+        self.stages = []
+        self.timings = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, func, workers=1):
+        """Adds a stage to the end of the pipeline
+
+        Args:
+            name (str): The name of the stage used in the report
+            func (function): Called with the output of the previous stage (or the item for the first stage), its return value is passed to the next stage
+            workers (int, optional): The max amount of items that can be in this stage at the same time. Defaults to 1.
+        """
+        self.stages.append((name, func, max(1, int(workers))))
+
+    def _runStage(self, key, stage, value):
+        """Runs one stage for one item and records how long it took
+
+        Args:
+            key (str): The name of the item
+            stage (int): The index of the stage
+            value (any): The input for the stage
+
+        Returns:
+            (any): The output of the stage
+        """
+        name, func, _ = self.stages[stage]
+        start = time.monotonic()
+        try:
+            return func(value)
+        finally:
+            with self.lock:
+                self.timings.setdefault(key, {})[name] = (start, time.monotonic())
+
+    def run(self, items):
+        """Runs every item through all of the stages. An item that fails a stage is dropped from the
+        later stages but the other items keep going, the first error is raised once everything is done
+
+        Args:
+            items (list): (name, value) pairs for every item that goes through the pipeline
+        """
+        self.timings = {}
+        self.errors = {}
+        pools = [ThreadPoolExecutor(max_workers=workers) for _, _, workers in self.stages]
+        running = {}
+
+        try:
+            # Queues every item on the first stage, the pool limits how many run at once
+            for key, value in items:
+                running[pools[0].submit(tracing.wrap(self._runStage), key, 0, value)] = (key, 0)
+
+            # Moves each item to the next stage as soon as it finishes the current one
+            while running:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    key, stage = running.pop(future)
+                    if future.exception() is not None:
+                        self.errors[key] = future.exception()
+                    elif stage + 1 < len(self.stages):
+                        running[pools[stage + 1].submit(tracing.wrap(self._runStage), key, stage + 1, future.result())] = (key, stage + 1)
+        finally:
+            for pool in pools:
+                pool.shutdown()
+
+        if self.errors:
+            raise next(iter(self.errors.values()))
+
+    def report(self):
+        """Prints how long every item spent in each stage and which items failed
+        """
+        if not self.timings:
+            return
+
+        names = [name for name, _, _ in self.stages]
+        width = max(len(key) for key in self.timings)
+
+        print(f'{"".ljust(width)}  ' + '  '.join(f'{name:>8}' for name in names))
+        for key, stages in sorted(self.timings.items()):
+            cols = []
+            for name in names:
+                if name in stages:
+                    start, end = stages[name]
+                    cols.append(f'{end - start:7.1f}s')
+                else:
+                    cols.append(f'{"-":>8}')
+            failed = f'  failed: {self.errors[key]}' if key in self.errors else ''
+            print(f'{key.ljust(width)}  ' + '  '.join(cols) + failed)
+
+        start = min(start for stages in self.timings.values() for start, _ in stages.values())
+        end = max(end for stages in self.timings.values() for _, end in stages.values())
+        print(f'total {end - start:.1f}s, {len(self.timings) - len(self.errors)} done, {len(self.errors)} failed')
@@ -0,0 +1,336 @@
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+
+# Tracing is off until install is called so the spans cost nothing on a normal deploy
+enabled = False
+spans = []
+lock = threading.Lock()
+current = contextvars.ContextVar('span', default=None)
+traceId = None
+
+
+class span():
+    """A timed operation, counters added while it is running are added to every span above it as well
+
+    Varibles:
+        name (str): The name of the operation eg kube.buildChallenge
+        id (str): The span id
+        parent (span): The span it was started in or None
+        start (float): The wall clock time it started
+        end (float): The wall clock time it ended
+        attributes (dict): Details about the operation
+        counters (dict): http.calls, http.retries, http.seconds, http.sent, http.received and wait.seconds
+        error (str): The error it failed with
+        thread (str): The name of the thread it ran in
+    """
+
+    name = None
+    id = None
+    parent = None
+    start = None
+    end = None
+    attributes = None
+    counters = None
+    error = None
+    thread = None
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.id = os.urandom(8).hex()
+        self.parent = parent
+        self.attributes = attributes or {}
+        self.counters = {}
+        self.thread = threading.current_thread().name
+        self.start = time.time()
+        self.started = time.perf_counter()
+
+    def finish(self):
+        """Ends the span and stores it
+        """
+        self.end = self.start + time.perf_counter() - self.started
+        with lock:
+            spans.append(self)
+
+    @property
+    def duration(self):
+        return (self.end or time.time()) - self.start
+
+
+@contextlib.contextmanager
+def trace(name, **attributes):
+    """Runs the code in the block in a span
+
+    Args:
+        name (str): The name of the operation
+        **attributes: Details about the operation
+
+    Yields:
+        (span): The span or None if tracing is off
+    """
+    if not enabled:
+        yield None
+        return
+
+    item = span(name, current.get(), attributes)
+    token = current.set(item)
+    try:
+        yield item
+    except BaseException as e:
+        item.error = f'{type(e).__name__}: {e}'
+        raise
+    finally:
+        item.finish()
+        current.reset(token)
+
+
+def count(name, amount=1):
+    """Adds to a counter of the current span and every span above it
+
+    Args:
+        name (str): The counter eg http.calls or wait.seconds
+        amount (float, optional): The amount to add. Defaults to 1.
+    """
+    if not enabled:
+        return
+    item = current.get()
+    with lock:
+        while item is not None:
+            item.counters[name] = item.counters.get(name, 0) + amount
+            item = item.parent
+
+
+def attribute(name, value):
+    """Sets a detail on the current span
+
+    Args:
+        name (str): The name of the detail
+        value (any): The value
+    """
+    item = current.get()
+    if enabled and item is not None:
+        item.attributes[name] = value
+
+
+def sleep(seconds):
+    """Sleeps and counts the time as waiting in the current span
+
+    Args:
+        seconds (float): Seconds to sleep
+    """
+    time.sleep(seconds)
+    count('wait.seconds', seconds)
+
+
+def wrap(func):
+    """Makes a function run in the current span when it is called from another thread
+
+    Args:
+        func (function): The function
+
+    Returns:
+        (function): The function that runs in the span
+    """
+    parent = current.get()
+
+    @functools.wraps(func)
+    def run(*args, **kwargs):
+        token = current.set(parent)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            current.reset(token)
+    return run
+
+
+def traced(cls=None, skip=()):
+    """Class decorator that runs every public method of the class in a span named class.method
+
+    Args:
+        cls (type): The class
+        skip (tuple, optional): Methods that are too small or called too often to trace. Defaults to ().
+
+    Returns:
+        (type): The class
+    """
+    if cls is None:
+        return lambda cls: traced(cls, skip)
+
+    def method(func, name):
+        @functools.wraps(func)
+        def run(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with trace(name):
+                return func(*args, **kwargs)
+        return run
+
+    for name, func in list(vars(cls).items()):
+        if callable(func) and not isinstance(func, type) and not name.startswith('_') and name not in skip:
+            setattr(cls, name, method(func, f'{cls.__name__}.{name}'))
+    return cls
+
+
+# Depth of the urlopen calls in each thread so retries urllib3 does itself arent counted twice
+local = threading.local()
+
+def install():
+    """Turns tracing on and counts every HTTP call made through urllib3, which the Digital Ocean,
+    Kubernetes, docker, Cloudflare and boto3 clients all use
+    """
+    global enabled, traceId
+    if enabled:
+        return
+    enabled = True
+    traceId = os.urandom(16).hex()
+
+    import urllib3
+    urlopen = urllib3.connectionpool.HTTPConnectionPool.urlopen
+
+    @functools.wraps(urlopen)
+    def counted(pool, method, url, body=None, *args, **kwargs):
+        depth = getattr(local, 'depth', 0)
+        local.depth = depth + 1
+        start = time.perf_counter()
+        try:
+            res = urlopen(pool, method, url, body, *args, **kwargs)
+        finally:
+            local.depth = depth
+        if depth == 0:
+            count('http.calls')
+            count('http.seconds', time.perf_counter() - start)
+            count(f'http.calls.{pool.host}:{pool.port}')
+            if isinstance(body, (bytes, str)):
+                count('http.sent', len(body))
+            try:
+                count('http.received', int(res.headers.get('Content-Length') or 0))
+            except ValueError:
+                pass
+        return res
+
+    urllib3.connectionpool.HTTPConnectionPool.urlopen = counted
+
+
+def export(path, format=None):
+    """Writes the spans to a file, as a Chrome trace that chrome://tracing and Perfetto open or as
+    OTLP json that OpenTelemetry collectors and Jaeger import
+
+    Args:
+        path (str): The file to write
+        format (str, optional): json or otlp. Defaults to otlp for files ending in .otlp.json and json for anything else.
+    """
+    format = format or ('otlp' if path.endswith('.otlp.json') else 'json')
+    with lock:
+        items = sorted(spans, key=lambda item: item.start)
+
+    if format == 'otlp':
+        data = otlp(items)
+    elif format == 'json':
+        data = chrome(items)
+    else:
+        raise ValueError(f'Unknown trace format {format}, use json or otlp')
+
+    with open(path, 'w') as f:
+        f.write(json.dumps(data))
+
+
+def chrome(items):
+    """Gets the spans as Chrome trace events
+
+    Args:
+        items (list): The spans
+
+    Returns:
+        (dict): The trace
+    """
+    threads = {}
+    events = []
+    for item in items:
+        tid = threads.setdefault(item.thread, len(threads) + 1)
+        args = dict(item.attributes, **item.counters)
+        if item.error:
+            args['error'] = item.error
+        events.append({'name': item.name, 'cat': item.name.split('.')[0], 'ph': 'X', 'pid': 1, 'tid': tid,
+            'ts': int(item.start * 1e6), 'dur': int(item.duration * 1e6), 'args': args})
+    events += [{'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': name}} for name, tid in threads.items()]
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def otlp(items):
+    """Gets the spans in the OTLP json format
+
+    Args:
+        items (list): The spans
+
+    Returns:
+        (dict): The trace
+    """
+    def value(value):
+        if isinstance(value, bool):
+            return {'boolValue': value}
+        if isinstance(value, int):
+            return {'intValue': str(value)}
+        if isinstance(value, float):
+            return {'doubleValue': value}
+        return {'stringValue': str(value)}
+
+    out = []
+    for item in items:
+        attributes = dict(item.attributes, **item.counters)
+        attributes['thread.name'] = item.thread
+        out.append({
+            'traceId': traceId,
+            'spanId': item.id,
+            'parentSpanId': item.parent.id if item.parent else '',
+            'name': item.name,
+            'kind': 1,
+            'startTimeUnixNano': str(int(item.start * 1e9)),
+            'endTimeUnixNano': str(int(item.end * 1e9)),
+            'attributes': [{'key': key, 'value': value(val)} for key, val in attributes.items()],
+            'status': {'code': 2, 'message': item.error} if item.error else {'code': 1},
+        })
+    resource = {'attributes': [{'key': 'service.name', 'value': {'stringValue': 'ctf-k8'}}]}
+    return {'resourceSpans': [{'resource': resource, 'scopeSpans': [{'scope': {'name': 'ctf_k8'}, 'spans': out}]}]}
+
+
+def summary():
+    """Prints the time spent in every operation, the HTTP calls it made and how long it waited,
+    the times include everything the operation called
+    """
+    with lock:
+        items = list(spans)
+    if not items:
+        return
+
+    totals = {}
+    for item in items:
+        total = totals.setdefault(item.name, {'count': 0, 'seconds': 0.0, 'errors': 0, 'counters': {}})
+        total['count'] += 1
+        total['seconds'] += item.duration
+        total['errors'] += int(item.error is not None)
+        for key, amount in item.counters.items():
+            total['counters'][key] = total['counters'].get(key, 0) + amount
+
+    width = max(len(name) for name in totals)
+    print(f'{"operation".ljust(width)}  {"count":>5}  {"total":>8}  {"http":>5}  {"http time":>9}  {"waiting":>8}  {"KB in/out":>11}')
+    for name, total in sorted(totals.items(), key=lambda item: -item[1]['seconds']):
+        counters = total['counters']
+        moved = f'{int(counters.get("http.received", 0)) // 1024}/{int(counters.get("http.sent", 0)) // 1024}'
+        line = f'{name.ljust(width)}  {total["count"]:5}  {total["seconds"]:7.1f}s  {int(counters.get("http.calls", 0)):5}  {counters.get("http.seconds", 0):8.1f}s  {counters.get("wait.seconds", 0):7.1f}s  {moved:>11}'
+        if total['errors']:
+            line += f'  {total["errors"]} failed'
+        print(line)
+
+    # Splits the HTTP calls by the host they went to
+    hosts = {}
+    for item in items:
+        if item.parent is None:
+            for key, amount in item.counters.items():
+                if key.startswith('http.calls.'):
+                    hosts[key[len('http.calls.'):]] = hosts.get(key[len('http.calls.'):], 0) + amount
+    if hosts:
+        print('http calls by host: ' + ', '.join(f'{host} {calls}' for host, calls in sorted(hosts.items(), key=lambda item: -item[1])))